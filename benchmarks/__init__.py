@@ -0,0 +1,13 @@
+"""Benchmarks of the hot paths on seeded synthetic MovieLens-shaped data (see synthetic.py and suite.py).
+
+The modules of notebooks/ and streamlit_app/ are imported the way the
+notebooks and the app import them, by putting both folders on sys.path.
+"""
+import os
+import sys
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+for folder in ['benchmarks', 'notebooks', 'streamlit_app']:
+    if os.path.join(REPO_DIR, folder) not in sys.path:
+        sys.path.insert(0, os.path.join(REPO_DIR, folder))
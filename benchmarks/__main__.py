@@ -0,0 +1,176 @@
+"""Run the benchmarks and compare results across commits.
+
+`run` generates the synthetic data of a scale (seeded, so every run and
+machine benchmarks the same data), times every benchmark of suite.BENCHMARKS
+--repeat times and writes the timings together with the machine, library
+versions and git commit to a JSON file:
+
+    {"machine": {...}, "git": {"commit": "...", "dirty": false},
+     "config": {"scale": "1m", "seed": 42, "repeat": 3, "n_jobs": 1},
+     "generate_seconds": 9.1,
+     "benchmarks": {"dataprep.top_tags": {"status": "ok", "seconds": [...], "min": ..., "median": ...,
+                                          "n_items": 623784, "unit": "genome scores", "items_per_second": ...},
+                    "embeddings.train_word2vec": {"status": "skipped", "reason": "gensim is not installed"}}}
+
+`compare` prints the ratio of the median times of two result files and exits
+with code 1 if a benchmark got slower than the tolerance allows.
+
+Usage from the command line (in the repository root):
+
+    python -m benchmarks run --scale 1m --repeat 3
+    python -m benchmarks run --scale 5m --only dataprep.top_tags similarity.top_k_similarities
+    python -m benchmarks compare benchmarks/results/old.json benchmarks/results/new.json --tolerance 0.1
+"""
+import argparse
+import datetime
+import gc
+import importlib.metadata
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import REPO_DIR
+import suite
+
+RESULTS_DIR = os.path.join(REPO_DIR, 'benchmarks', 'results')
+LIBRARIES = ['numpy', 'pandas', 'pyarrow', 'scipy', 'scikit-surprise', 'gensim', 'streamlit']
+
+
+def machine_info():
+    """Platform, CPU, memory and versions of the libraries the benchmarks use."""
+    versions = {}
+    for library in LIBRARIES:
+        try:
+            versions[library] = importlib.metadata.version(library)
+        except importlib.metadata.PackageNotFoundError:
+            versions[library] = None
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        memory = None
+    return {'platform': platform.platform(), 'machine': platform.machine(), 'processor': platform.processor(),
+            'hostname': platform.node(), 'cpu_count': os.cpu_count(), 'memory_bytes': memory,
+            'python': platform.python_version(), 'libraries': versions}
+
+
+def git_info():
+    """Commit of the repository and whether the working tree has changes."""
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+
+    try:
+        return {'commit': git('rev-parse', 'HEAD') or None,
+                'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+    except OSError:
+        return {'commit': None, 'dirty': None}
+
+
+def time_benchmark(name, workload, repeat):
+    """Result entry of one benchmark: its setup once, then repeat timed calls."""
+    function, unit = suite.BENCHMARKS[name]
+    try:
+        run, n_items = function(workload)
+    except suite.Skip as skip:
+        return {'status': 'skipped', 'reason': str(skip)}
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+    median = statistics.median(seconds)
+    return {'status': 'ok', 'seconds': seconds, 'min': min(seconds), 'median': median, 'n_items': n_items,
+            'unit': unit, 'items_per_second': n_items / median if median > 0 else None}
+
+
+def run(args):
+    names = args.only or list(suite.BENCHMARKS)
+    unknown = [name for name in names if name not in suite.BENCHMARKS]
+    if unknown:
+        sys.exit(f'unknown benchmarks {unknown}, use some of {list(suite.BENCHMARKS)}')
+
+    result = {'machine': machine_info(), 'git': git_info(),
+              'config': {'scale': args.scale, 'seed': args.seed, 'repeat': args.repeat, 'n_jobs': args.n_jobs},
+              'started': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+              'benchmarks': {}}
+    with tempfile.TemporaryDirectory(prefix='movielens_synthetic_') as data_dir:
+        start = time.perf_counter()
+        workload = suite.Workload(data_dir, args.scale, args.seed, args.n_jobs)
+        result['generate_seconds'] = time.perf_counter() - start
+        print(f"generated {args.scale} ratings in {result['generate_seconds']:.1f} s")
+        for name in names:
+            entry = time_benchmark(name, workload, args.repeat)
+            result['benchmarks'][name] = entry
+            if entry['status'] == 'ok':
+                print(f"{name:45s} {entry['median']:9.4f} s  {entry['items_per_second']:14,.0f} {entry['unit']}/s")
+            else:
+                print(f"{name:45s} skipped: {entry['reason']}")
+
+    output = args.output or os.path.join(RESULTS_DIR, '{}-{}-{}.json'.format(
+        datetime.datetime.now().strftime('%Y%m%d-%H%M%S'), (result['git']['commit'] or 'nogit')[:8], args.scale))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=1)
+    print(f'results written to {output}')
+
+
+def compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    for key in ['scale', 'seed', 'n_jobs']:
+        if old['config'][key] != new['config'][key]:
+            print(f"warning: different {key} ({old['config'][key]} vs. {new['config'][key]}), the times are not comparable")
+    if old['machine']['hostname'] != new['machine']['hostname']:
+        print(f"warning: results of different machines ({old['machine']['hostname']} vs. {new['machine']['hostname']})")
+
+    print(f"{'benchmark':45s} {'old':>9s} {'new':>9s} {'new/old':>8s}")
+    regressions = []
+    for name, new_entry in new['benchmarks'].items():
+        old_entry = old['benchmarks'].get(name, {})
+        if old_entry.get('status') != 'ok' or new_entry['status'] != 'ok':
+            continue
+        ratio = new_entry['median'] / old_entry['median']
+        flag = ''
+        if ratio > 1 + args.tolerance:
+            flag = '  SLOWER'
+            regressions.append(name)
+        elif ratio < 1 - args.tolerance:
+            flag = '  faster'
+        print(f"{name:45s} {old_entry['median']:9.4f} {new_entry['median']:9.4f} {ratio:8.2f}{flag}")
+    if regressions:
+        print(f'FAILED: {len(regressions)} benchmarks slower by more than {args.tolerance:.0%}: {regressions}')
+    sys.exit(1 if regressions else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmarks on synthetic MovieLens data.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmarks and write the results as JSON')
+    run_parser.add_argument('--scale', default='1m', help="number of ratings: 1m, 5m, 25m or e.g. 250k")
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--repeat', type=int, default=3)
+    run_parser.add_argument('--n-jobs', type=int, default=1, help='processes / threads of the parallel steps')
+    run_parser.add_argument('--only', nargs='+', help='names of the benchmarks to run')
+    run_parser.add_argument('--output', help='JSON file, default: benchmarks/results/<time>-<commit>-<scale>.json')
+    run_parser.set_defaults(function=run)
+
+    compare_parser = subparsers.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative slowdown')
+    compare_parser.set_defaults(function=compare)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""The benchmarks: hot paths of the preprocessing, the models, the evaluation and the Streamlit app.
+
+Every benchmark is a function of a Workload registered in BENCHMARKS. It does
+its (untimed) setup and returns the function to time and the number of items
+one call processes (ratings, movies, users, ...), which gives the throughput.
+Benchmarks of optional dependencies (gensim, Surprise) raise Skip if the
+library is not installed.
+"""
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import synthetic
+
+# name -> (benchmark function, unit of the items it processes)
+BENCHMARKS = {}
+
+
+class Skip(Exception):
+    """Raised by a benchmark that cannot run here (e.g. an optional library is missing)."""
+
+
+def benchmark(name, unit):
+    """Register a benchmark function under a name."""
+    def register(function):
+        BENCHMARKS[name] = (function, unit)
+        return function
+    return register
+
+
+class Workload:
+    """Synthetic MovieLens-shaped data of a scale, as MovieLens CSVs in data_dir and as DataFrames.
+
+    Intermediate results several benchmarks need (the features table, the
+    filtered ratings, the ratings matrix) are computed once on first use.
+    """
+
+    def __init__(self, data_dir, scale='1m', seed=42, n_jobs=1):
+        self.data_dir = data_dir
+        self.scale = scale
+        self.seed = seed
+        self.n_jobs = n_jobs
+        self.n_ratings = synthetic.n_ratings_of(scale)
+        self.tables = synthetic.generate(scale, seed)
+        synthetic.write_csvs(self.tables, data_dir)
+        self._cache = {}
+
+    @property
+    def min_ratings(self):
+        """MIN_RATINGS of the preprocessing scaled to the size of the data (2000 at 25M ratings)."""
+        import dataprep
+
+        return max(1, round(dataprep.MIN_RATINGS * self.n_ratings / synthetic.ML25M['n_ratings']))
+
+    def path(self, name):
+        return os.path.join(self.data_dir, name)
+
+    def cached(self, name, compute):
+        if name not in self._cache:
+            self._cache[name] = compute()
+        return self._cache[name]
+
+    def ratings(self):
+        """Ratings with the compact dtypes of the preprocessing (userId, movieId, rating)."""
+        return self.tables['ratings'][['userId', 'movieId', 'rating']]
+
+    def features(self):
+        """Movie features table of dataprep.top_tags."""
+        import dataprep
+
+        return self.cached('features', lambda: dataprep.top_tags(self.tables['genome-scores'], self.tables['genome-tags'],
+                                                                 self.tables['movies']))
+
+    def sampled_ratings(self):
+        """Ratings after dataprep's filter and sample steps, the input of the models."""
+        import dataprep
+
+        return self.cached('sampled_ratings', lambda: dataprep.sample_ratings(
+            dataprep.filter_ratings(self.ratings(), min_ratings=self.min_ratings), self.seed))
+
+    def ratings_matrix(self):
+        """ratings_matrix.RatingsMatrix of the sampled ratings."""
+        import ratings_matrix
+
+        return self.cached('ratings_matrix', lambda: ratings_matrix.from_frame(self.sampled_ratings()))
+
+
+###################################################################################################
+########################################## preprocessing ##########################################
+###################################################################################################
+
+@benchmark('dataprep.read_csv', 'ratings')
+def read_ratings_csv(workload):
+    import dataprep
+
+    return lambda: dataprep.read_csv(workload.path('ratings.csv')), workload.n_ratings
+
+
+@benchmark('dataprep.top_tags', 'genome scores')
+def top_tags(workload):
+    import dataprep
+
+    tables = workload.tables
+    return (lambda: dataprep.top_tags(tables['genome-scores'], tables['genome-tags'], tables['movies']),
+            len(tables['genome-scores']))
+
+
+@benchmark('dataprep.filter_sample', 'ratings')
+def filter_sample(workload):
+    import dataprep
+
+    ratings = workload.ratings()
+    return (lambda: dataprep.sample_ratings(dataprep.filter_ratings(ratings, min_ratings=workload.min_ratings), workload.seed),
+            len(ratings))
+
+
+@benchmark('dataprep.join_features', 'ratings')
+def join_features(workload):
+    import dataprep
+
+    ratings, features = workload.sampled_ratings(), workload.features()
+    return lambda: dataprep.join_features(ratings, features), len(ratings)
+
+
+@benchmark('embeddings.genre_matrix', 'movies')
+def genre_matrix(workload):
+    import embeddings
+
+    genres = workload.tables['movies']['genres']
+    return lambda: embeddings.genre_matrix(genres), len(genres)
+
+
+@benchmark('embeddings.train_word2vec', 'movies')
+def train_word2vec(workload):
+    import embeddings
+
+    try:
+        import gensim  # noqa: F401
+    except ImportError:
+        raise Skip('gensim is not installed')
+    documents = embeddings.tag_documents(workload.features()['tag'])
+    return (lambda: embeddings.train_word2vec(documents, workers=workload.n_jobs, seed=workload.seed),
+            len(documents))
+
+
+###################################################################################################
+############################################# models ##############################################
+###################################################################################################
+
+@benchmark('ratings_matrix.from_arrays', 'ratings')
+def build_matrix(workload):
+    import ratings_matrix
+
+    ratings = workload.sampled_ratings()
+    user_ids, movie_ids = ratings['userId'].to_numpy(), ratings['movieId'].to_numpy()
+    values = ratings['rating'].to_numpy()
+    return lambda: ratings_matrix.from_arrays(user_ids, movie_ids, values), len(ratings)
+
+
+@benchmark('similarity.top_k_similarities', 'movies')
+def item_similarities(workload):
+    import similarity
+
+    item_user = workload.ratings_matrix().item_user
+    return lambda: similarity.top_k_similarities(item_user, k=40, n_jobs=workload.n_jobs), item_user.shape[0]
+
+
+def _surprise_data(workload):
+    try:
+        from surprise import Dataset, Reader
+    except ImportError:
+        raise Skip('surprise is not installed')
+    ratings = workload.sampled_ratings()
+    data = Dataset.load_from_df(ratings[['userId', 'movieId', 'rating']], Reader(rating_scale=(0.5, 5)))
+    return data.build_full_trainset(), len(ratings)
+
+
+@benchmark('surprise.SVD.fit', 'ratings')
+def surprise_fit(workload):
+    trainset, n_ratings = _surprise_data(workload)
+    from surprise import SVD
+
+    return lambda: SVD(random_state=workload.seed).fit(trainset), n_ratings
+
+
+@benchmark('surprise.SVD.test', 'ratings')
+def surprise_test(workload):
+    trainset, n_ratings = _surprise_data(workload)
+    from surprise import SVD
+
+    algo = SVD(random_state=workload.seed).fit(trainset)
+    testset = trainset.build_testset()
+    return lambda: algo.test(testset), n_ratings
+
+
+###################################################################################################
+########################################### evaluation ############################################
+###################################################################################################
+
+@benchmark('evaluation.precision_recall_at_ks', 'predictions')
+def precision_recall(workload):
+    import evaluation
+
+    ratings = workload.sampled_ratings()
+    rng = np.random.default_rng(workload.seed)
+    uid = ratings['userId'].to_numpy()
+    true_r = ratings['rating'].to_numpy(np.float64)
+    # predictions with the error of a good model (MAE about 0.65)
+    est = np.clip(true_r + rng.normal(0, 0.8, len(true_r)), 0.5, 5)
+    return lambda: evaluation.precision_recall_at_ks(uid, true_r, est, ks=(3, 5, 10, 20), threshold=3.5), len(uid)
+
+
+def _factor_model(workload, n_factors=100):
+    # FactorRecommender with random factors for the users and movies of the sampled ratings
+    def build():
+        from recommender import FactorRecommender
+
+        rm = workload.ratings_matrix()
+        n_users, n_items = rm.shape
+        rng = np.random.default_rng(workload.seed)
+        return FactorRecommender(rng.normal(0, 0.1, (n_users, n_factors)), rng.normal(0, 0.1, (n_items, n_factors)),
+                                 rng.normal(0, 0.3, n_users), rng.normal(0, 0.3, n_items), 3.5, rm.user_ids,
+                                 rm.movie_ids, rm.user_item)
+
+    return workload.cached('factor_model', build)
+
+
+@benchmark('recommender.recommend', 'users')
+def recommend(workload, batch_size=1024, max_users=20_000):
+    model = _factor_model(workload)
+    users = np.arange(min(len(model.user_ids), max_users))
+
+    def recommend_all():
+        for start in range(0, len(users), batch_size):
+            model.recommend(users[start:start + batch_size], n=10)
+
+    return recommend_all, len(users)
+
+
+@benchmark('recommender.recommend_for_ratings', 'visitors')
+def recommend_for_ratings(workload, n_visitors=100, n_ratings=10):
+    model = _factor_model(workload)
+    rng = np.random.default_rng(workload.seed)
+    # visitors who rate n_ratings of the 200 most rated movies
+    candidates = model.item_ids[model.popular_items(200)]
+    visitors = [(rng.choice(candidates, min(n_ratings, len(candidates)), replace=False),
+                 rng.choice(np.arange(1, 11) / 2, min(n_ratings, len(candidates)))) for _ in range(n_visitors)]
+    return lambda: [model.recommend_for_ratings(movie_ids, ratings, n=10) for movie_ids, ratings in visitors], n_visitors
+
+
+###################################################################################################
+######################################### streamlit app ###########################################
+###################################################################################################
+
+def _page_data_dir(workload):
+    # the tables of the data exploration page and a cv results table like in data/dataframes and data/models
+    def write():
+        page_dir = tempfile.mkdtemp(prefix='page_data_', dir=workload.data_dir)
+        for name in ['movies', 'ratings', 'tags', 'genome-tags', 'genome-scores']:
+            workload.tables[name].to_parquet(os.path.join(page_dir, f'{name}.parquet'), index=False)
+
+        import artifacts
+
+        rng = np.random.default_rng(workload.seed)
+        models = ['SVD', 'SVDpp', 'NMF', 'SlopeOne', 'KNNBasic', 'KNNWithMeans', 'KNNWithZScore', 'KNNBaseline',
+                  'CoClustering', 'BaselineOnly', 'NormalPredictor']
+        folds = pd.DataFrame({'model': np.repeat(models, 5), 'fold': np.tile(np.arange(5), len(models))})
+        for metric in ['test_mae', 'test_mse', 'test_rmse', 'fit_time', 'test_time']:
+            folds[metric] = rng.random(len(folds))
+        artifacts.write_table(page_dir, 'surp_cv_folds', folds)
+        return page_dir
+
+    return workload.cached('page_data_dir', write)
+
+
+def _page_load(workload, files, artifact):
+    # load like data_access.load on a cache miss: the registered loader on the file
+    import data_access
+
+    page_dir = _page_data_dir(workload)
+    loader = data_access.ARTIFACTS[artifact]['loader']
+    paths = [os.path.join(page_dir, file) for file in files]
+    return lambda: [loader(path) for path in paths]
+
+
+@benchmark('data_access.load:data_exploration', 'ratings')
+def load_exploration_tables(workload):
+    files = [f'{name}.parquet' for name in ['movies', 'ratings', 'tags', 'genome-tags', 'genome-scores']]
+    return _page_load(workload, files, 'ratings'), workload.n_ratings
+
+
+@benchmark('data_access.load:surp_cv_folds', 'tables')
+def load_cv_folds(workload):
+    return _page_load(workload, ['surp_cv_folds.parquet'], 'surp_cv_folds'), 1
+
+
+###################################################################################################
+##################################### interactive exploration #####################################
+###################################################################################################
+
+def _exploration_data(workload):
+    # the ratings partitioned by year and the movies dimension of notebooks/exploration_data.py
+    def write():
+        import exploration_data
+        import exploration_queries
+        import pyarrow.parquet as pq
+
+        output_dir = tempfile.mkdtemp(prefix='exploration_', dir=workload.data_dir)
+        exploration_data.run(workload.data_dir, output_dir)
+        return (exploration_queries.open_dataset(os.path.join(output_dir, exploration_data.RATINGS_DATASET)),
+                pq.read_table(os.path.join(output_dir, exploration_data.MOVIES_FILE)))
+
+    return workload.cached('exploration_data', write)
+
+
+@benchmark('exploration_queries.aggregate:all', 'ratings')
+def explore_all(workload):
+    import exploration_queries
+
+    dataset, movies = _exploration_data(workload)
+    return lambda: exploration_queries.aggregate(dataset, movies), workload.n_ratings
+
+
+@benchmark('exploration_queries.aggregate:filtered', 'ratings')
+def explore_filtered(workload):
+    # two large genres over six years, only movies with a number of ratings like MIN_RATINGS of the preprocessing
+    import exploration_queries
+
+    dataset, movies = _exploration_data(workload)
+    return lambda: exploration_queries.aggregate(dataset, movies, ('Comedy', 'Drama'), (2005, 2010),
+                                                 workload.min_ratings), workload.n_ratings
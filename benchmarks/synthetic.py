@@ -0,0 +1,169 @@
+"""Seeded generator for MovieLens-shaped data (ratings, movies, genome scores / tags, user tags).
+
+The tables have the columns and dtypes of the MovieLens 25M CSVs, so the
+preprocessing and models can run on them without the real data. Their sizes
+scale with the number of ratings from the proportions of MovieLens 25M
+(25M ratings, 162,541 users, 62,423 movies, 13,816 movies with genome scores
+for 1,128 genome tags, 1.09M user tags):
+
+- user and movie activity follow a power law with an offset,
+  weight(rank) = (rank + offset) ** -alpha, users and movies are sampled
+  independently by these weights and duplicate (user, movie) pairs dropped,
+- ratings are half stars from 0.5 to 5.0 with the MovieLens 25M distribution;
+  they are assigned by quantiles of user bias + movie bias + noise, so the
+  models find some signal in them,
+- genome scores exist for the most rated movies, their relevance is
+  Beta-distributed (mostly low, like the genome),
+- movieIds have gaps and genres are 1-4 of the 19 MovieLens genres.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+ML25M = {'n_ratings': 25_000_095, 'n_users': 162_541, 'n_movies': 62_423, 'n_genome_movies': 13_816,
+         'n_genome_tags': 1_128, 'n_tags': 1_093_360}
+
+SCALES = {'100k': 100_000, '1m': 1_000_000, '5m': 5_000_000, '25m': 25_000_000}
+
+# share of the half-star ratings 0.5, 1.0, ..., 5.0 in MovieLens 25M
+RATING_SHARES = np.array([393_068, 776_815, 399_490, 1_640_868, 1_262_797, 4_896_928, 3_177_318, 6_639_798,
+                          2_200_539, 3_612_474]) / 25_000_095
+RATINGS = np.arange(1, 11) / 2
+
+GENRES = ['Action', 'Adventure', 'Animation', 'Children', 'Comedy', 'Crime', 'Documentary', 'Drama', 'Fantasy',
+          'Film-Noir', 'Horror', 'IMAX', 'Musical', 'Mystery', 'Romance', 'Sci-Fi', 'Thriller', 'War', 'Western']
+
+# (alpha, offset as share of the number of users / movies) of the activity power laws, chosen so that
+# the median number of ratings per user (~75) and movie (~9) are close to MovieLens 25M
+USER_ACTIVITY = (1.0, 0.02)
+MOVIE_ACTIVITY = (2.5, 0.02)
+
+# timestamps between 1995 and 2019 like MovieLens 25M
+TIMESTAMPS = (789_652_009, 1_574_327_703)
+
+
+def n_ratings_of(scale):
+    """Number of ratings of a scale name of SCALES (or a number like '2m', '500k', 250000)."""
+    if isinstance(scale, str):
+        scale = scale.lower()
+        if scale in SCALES:
+            return SCALES[scale]
+        factor = {'k': 1_000, 'm': 1_000_000}.get(scale[-1])
+        return int(float(scale[:-1]) * factor) if factor else int(scale)
+    return int(scale)
+
+
+def sizes(n_ratings):
+    """Numbers of users, movies, genome movies, genome tags and user tags for n_ratings ratings.
+
+    Raises ValueError if the scaled numbers of users and movies have fewer
+    (user, movie) pairs than n_ratings (below about 62k ratings).
+    """
+    share = n_ratings / ML25M['n_ratings']
+    n = {'n_ratings': n_ratings,
+         'n_users': max(10, round(ML25M['n_users'] * share)),
+         'n_movies': max(10, round(ML25M['n_movies'] * share)),
+         'n_genome_movies': max(1, round(ML25M['n_genome_movies'] * share)),
+         'n_genome_tags': ML25M['n_genome_tags'],
+         'n_tags': max(1, round(ML25M['n_tags'] * share))}
+    if n['n_users'] * n['n_movies'] < n_ratings:
+        raise ValueError(f"{n_ratings} ratings do not fit into the {n['n_users'] * n['n_movies']} (user, movie) pairs "
+                         f"of {n['n_users']} users and {n['n_movies']} movies, use a larger scale")
+    return n
+
+
+def power_law(n, alpha, offset, rng):
+    """Sampling probabilities of n entities with power-law activity, in random order."""
+    weights = (np.arange(1, n + 1) + offset * n) ** -alpha
+    return rng.permutation(weights / weights.sum())
+
+
+def _sample_pairs(n_pairs, user_p, movie_p, rng):
+    # independent draws by activity, duplicate pairs dropped; draws more (scaled by the share of new
+    # pairs in the last draw) until there are enough, then keeps a random subset ordered by user like ratings.csv
+    n_movies = len(movie_p)
+    keys = np.empty(0, dtype=np.int64)
+    new_share = 1.0
+    while len(keys) < n_pairs:
+        n_draw = int((n_pairs - len(keys)) / new_share * 1.1) + 1000
+        drawn = rng.choice(len(user_p), n_draw, p=user_p).astype(np.int64) * n_movies + rng.choice(n_movies, n_draw, p=movie_p)
+        n_before = len(keys)
+        keys = np.sort(np.concatenate([keys, drawn]))
+        keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+        new_share = max((len(keys) - n_before) / n_draw, 0.01)
+    keys = np.sort(rng.choice(keys, n_pairs, replace=False))
+    return keys // n_movies, keys % n_movies
+
+
+def half_star_ratings(latent, shares=RATING_SHARES):
+    """Half-star ratings with the given shares, assigned by the rank of the latent scores."""
+    ranks = np.empty(len(latent), dtype=np.int64)
+    ranks[np.argsort(latent, kind='stable')] = np.arange(len(latent))
+    bounds = np.round(np.cumsum(shares) * len(latent)).astype(np.int64)
+    return RATINGS[np.searchsorted(bounds, ranks, side='right')].astype(np.float32)
+
+
+def _genres(n_movies, rng):
+    n_genres = rng.choice([1, 2, 3, 4], n_movies, p=[0.35, 0.35, 0.2, 0.1])
+    genres = np.array(['|'.join(sorted(rng.choice(GENRES, n, replace=False))) for n in n_genres], dtype=object)
+    genres[rng.random(n_movies) < 0.08] = '(no genres listed)'
+    return genres
+
+
+def _tag_names(n_tags, rng, vocabulary_size=2_000):
+    # one or two words of a synthetic vocabulary, unique like the genome tags
+    words = np.array([f'w{i:04d}' for i in range(vocabulary_size)])
+    names = [' '.join(rng.choice(words, rng.choice([1, 2], p=[0.7, 0.3]), replace=False)) for _ in range(n_tags * 2)]
+    return list(dict.fromkeys(names))[:n_tags]
+
+
+def generate(scale='1m', seed=42):
+    """MovieLens-shaped tables for a scale (see n_ratings_of) as dict of DataFrames.
+
+    Keys are the MovieLens file names without extension: 'ratings', 'movies',
+    'genome-scores', 'genome-tags' and 'tags'. Same scale and seed give the
+    same tables.
+    """
+    n = sizes(n_ratings_of(scale))
+    rng = np.random.default_rng(seed)
+
+    # movieIds with gaps like in MovieLens (up to about 3.4 times the number of movies)
+    movie_ids = np.sort(rng.choice(np.arange(1, int(n['n_movies'] * 3.35) + 1), n['n_movies'], replace=False)).astype(np.int32)
+    user_p = power_law(n['n_users'], *USER_ACTIVITY, rng)
+    movie_p = power_law(n['n_movies'], *MOVIE_ACTIVITY, rng)
+    users, movies = _sample_pairs(n['n_ratings'], user_p, movie_p, rng)
+
+    latent = rng.normal(0, 0.6, n['n_users'])[users] + rng.normal(0, 0.8, n['n_movies'])[movies] + rng.normal(0, 1, len(users))
+    ratings = pd.DataFrame({'userId': (users + 1).astype(np.int32), 'movieId': movie_ids[movies],
+                            'rating': half_star_ratings(latent),
+                            'timestamp': rng.integers(*TIMESTAMPS, len(users))})
+
+    years = rng.integers(1920, 2020, n['n_movies'])
+    movies_table = pd.DataFrame({'movieId': movie_ids, 'title': [f'Movie {i} ({y})' for i, y in zip(movie_ids, years)],
+                                 'genres': _genres(n['n_movies'], rng)})
+
+    tag_names = _tag_names(n['n_genome_tags'], rng)
+    genome_tags = pd.DataFrame({'tagId': np.arange(1, len(tag_names) + 1, dtype=np.int32), 'tag': tag_names})
+    # genome scores for the most rated movies, every movie gets a score for every tag
+    genome_movies = np.sort(movie_ids[np.argsort(-movie_p)[:n['n_genome_movies']]])
+    genome_scores = pd.DataFrame({'movieId': np.repeat(genome_movies, len(tag_names)),
+                                  'tagId': np.tile(genome_tags['tagId'].to_numpy(), len(genome_movies)),
+                                  'relevance': np.round(rng.beta(0.6, 5, len(genome_movies) * len(tag_names)), 5)})
+
+    tag_users, tag_movies = _sample_pairs(n['n_tags'], user_p, movie_p, rng)
+    tags = pd.DataFrame({'userId': (tag_users + 1).astype(np.int32), 'movieId': movie_ids[tag_movies],
+                         'tag': np.asarray(tag_names, dtype=object)[rng.integers(0, len(tag_names), len(tag_users))],
+                         'timestamp': rng.integers(*TIMESTAMPS, len(tag_users))})
+    return {'ratings': ratings, 'movies': movies_table, 'genome-scores': genome_scores, 'genome-tags': genome_tags,
+            'tags': tags}
+
+
+def write_csvs(tables, raw_dir):
+    """Write the tables as MovieLens CSVs (ratings.csv, movies.csv, ...) to raw_dir."""
+    import pyarrow as pa
+    import pyarrow.csv as pv
+
+    os.makedirs(raw_dir, exist_ok=True)
+    for name, table in tables.items():
+        pv.write_csv(pa.Table.from_pandas(table, preserve_index=False), os.path.join(raw_dir, f'{name}.csv'))
@@ -0,0 +1,334 @@
+"""Incrementally maintained rating and tag aggregates for the data exploration of the Streamlit app.
+
+The aggregates were full recomputations over all 25M ratings
+(plots_users_ratings.ipynb, movie_genre_plots.ipynb), committed as snapshots
+to data/dataframes. Here they are running statistics that are updated from
+append-only batches of rating and tag events:
+
+- per user, per movie and per genre: count, sum, sum of squares, min, max and
+  a histogram of the ten half-star ratings 0.5 ... 5.0 (columns n_0_5 ...
+  n_5_0). The histogram is an exact, mergeable quantile sketch because
+  ratings only take these ten values (see quantiles),
+- per (user, movie): the number of tags.
+
+All statistics are mergeable: two partial aggregates of the same key combine
+by adding counts, sums and histograms and taking the min / max. append()
+aggregates a batch (O(batch)) and writes it as delta file, compact() merges the
+deltas into the tables of the store (an artifact store, see artifacts.py) and
+materialize() writes the files the app reads to data/dataframes, including
+the describe() tables of the exploration page, which are computed from the
+per-user / per-(user, movie) aggregates instead of the events.
+
+Rating events are additions: a user rating a movie again counts twice (the
+MovieLens dumps contain every (user, movie) pair once). Genre statistics use
+the genres of the movies table of the store (set_movies), ratings of unknown
+movies are not counted for any genre.
+
+Usage from the command line (paths relative to the repository root):
+
+    python notebooks/aggregates.py build --raw-dir data/raw/ml-25m
+    python notebooks/aggregates.py append --ratings new_ratings.csv --tags new_tags.csv
+    python notebooks/aggregates.py materialize
+"""
+import argparse
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+import artifacts
+
+RATING_VALUES = np.arange(1, 11) / 2
+HISTOGRAM_COLUMNS = [f"n_{str(value).replace('.', '_')}" for value in RATING_VALUES]
+
+# aggregate name -> key columns; stored as table agg_<name> of the store
+AGGREGATES = {
+    'user_ratings': ['userId'],
+    'movie_ratings': ['movieId'],
+    'genre_ratings': ['genre'],
+    'user_movie_tags': ['userId', 'movieId'],
+}
+MOVIES_TABLE = 'agg_movies'
+DELTAS_DIR = 'deltas'
+
+# genre name of the snapshots for movies without genres
+NO_GENRE = '(no genres listed)'
+NO_GENRE_COLUMN = 'no_genre_listed'
+
+# files of data/dataframes written by materialize
+USER_RATING_AVG_FILE = 'user_rating_avg.parquet.gizp'
+USER_RATING_SUM_FILE = 'user_rating_sum.parquet.gizp'
+GENRE_RATINGS_FILE = 'genre_ratings.parquet.gzip'
+FREQUENCY_GENRES_FILE = 'frequency_genres.parquet'
+GENRE_RATING_STATS_FILE = 'genre_rating_stats.parquet'
+USER_RATING_DESCRIBE_FILE = 'user_rating_describe.parquet'
+USER_TAG_DESCRIBE_FILE = 'user_tag_describe.parquet'
+
+
+###################################################################################################
+######################################## mergeable statistics ######################################
+###################################################################################################
+
+def rating_stats(keys, ratings):
+    """Partial rating aggregate of a batch: one row per key with count, sum, sum_sq, min, max and histogram.
+
+    keys is a Series (userId, movieId or genre) aligned with the ratings.
+    """
+    ratings = np.asarray(ratings, dtype=np.float64)
+    bins = np.rint(ratings * 2).astype(np.int64) - 1
+    if len(bins) and (bins.min() < 0 or bins.max() > 9 or not np.allclose((bins + 1) / 2, ratings)):
+        raise ValueError('ratings have to be half stars between 0.5 and 5.0')
+    codes, uniques = pd.factorize(keys)
+    histogram = np.bincount(codes * 10 + bins, minlength=len(uniques) * 10).reshape(len(uniques), 10)
+    stats = pd.DataFrame({keys.name: uniques, 'count': histogram.sum(axis=1),
+                          'sum': np.bincount(codes, weights=ratings, minlength=len(uniques)),
+                          'sum_sq': np.bincount(codes, weights=ratings ** 2, minlength=len(uniques)),
+                          # min and max are the first and last non-empty histogram bins
+                          'min': RATING_VALUES[np.argmax(histogram > 0, axis=1)],
+                          'max': RATING_VALUES[9 - np.argmax(histogram[:, ::-1] > 0, axis=1)]})
+    stats[HISTOGRAM_COLUMNS] = histogram
+    return stats
+
+
+def tag_stats(tags):
+    """Partial tag aggregate of a batch: number of tags per (userId, movieId), missing tags count 0."""
+    return (tags.assign(n_tags=tags['tag'].notna().astype(np.int64))
+            .groupby(['userId', 'movieId'], as_index=False, sort=False)['n_tags'].sum())
+
+
+def merge(frames, key):
+    """Merge partial aggregates of the same kind into one row per key."""
+    frames = [frame for frame in frames if frame is not None and len(frame)]
+    if not frames:
+        return None
+    df = pd.concat(frames, ignore_index=True)
+    aggregations = {column: 'min' if column == 'min' else 'max' if column == 'max' else 'sum'
+                    for column in df.columns if column not in key}
+    return df.groupby(key, as_index=False, sort=True).agg(aggregations)
+
+
+def quantiles(stats, qs=(0.25, 0.5, 0.75)):
+    """Quantiles of the ratings of every row from the histogram (lower rating at ties, like nearest rank)."""
+    histogram = stats[HISTOGRAM_COLUMNS].to_numpy()
+    cumulative = np.cumsum(histogram, axis=1)
+    result = {}
+    for q in qs:
+        rank = np.maximum(np.ceil(q * cumulative[:, -1]), 1)
+        result[f'{q:.0%}'] = RATING_VALUES[np.argmax(cumulative >= rank[:, None], axis=1)]
+    return pd.DataFrame(result, index=stats.index)
+
+
+def summary(stats, qs=(0.25, 0.5, 0.75)):
+    """count, mean, std (sample), min, quantiles and max of the ratings of every row of a rating aggregate."""
+    count = stats['count'].to_numpy(np.float64)
+    mean = stats['sum'] / count
+    variance = (stats['sum_sq'] - count * mean ** 2) / (count - 1)
+    result = pd.DataFrame({'count': stats['count'], 'mean': mean, 'std': np.sqrt(variance.clip(lower=0)),
+                           'min': stats['min']}, index=stats.index)
+    return pd.concat([result, quantiles(stats, qs), stats[['max']]], axis=1)
+
+
+def genre_rating_stats(ratings, movies):
+    """Partial genre aggregate of a batch: every rating counts for each genre of its movie."""
+    genres = movies[['movieId', 'genres']].assign(genre=movies['genres'].str.split('|')).explode('genre')
+    rated = ratings[['movieId', 'rating']].merge(genres[['movieId', 'genre']], on='movieId', how='inner')
+    return rating_stats(rated['genre'], rated['rating'].to_numpy())
+
+
+###################################################################################################
+############################################## store ###############################################
+###################################################################################################
+
+def _table(name):
+    return f'agg_{name}'
+
+
+def _delta_files(store_dir, name=None):
+    # delta files with their sequence numbers, oldest first
+    pattern = os.path.join(store_dir, DELTAS_DIR, f"{name or '*'}-*.parquet")
+    files = [(int(os.path.basename(path).rsplit('-', 1)[1].split('.')[0]), path) for path in glob.glob(pattern)]
+    return sorted(files)
+
+
+def _applied_through(store_dir, name):
+    entry = artifacts.read_manifest(store_dir)['tables'].get(_table(name))
+    return entry['metadata'].get('applied_through', 0) if entry else 0
+
+
+def _next_sequence(store_dir):
+    sequences = [sequence for sequence, _ in _delta_files(store_dir)]
+    sequences += [_applied_through(store_dir, name) for name in AGGREGATES]
+    return max(sequences, default=0) + 1
+
+
+def set_movies(store_dir, df_movies):
+    """Add or replace movies (movieId, genres) of the movies table the genre statistics use."""
+    movies = df_movies[['movieId', 'genres']].astype({'movieId': np.int32})
+    artifacts.update_table(store_dir, MOVIES_TABLE, movies, key='movieId')
+
+
+def read_movies(store_dir):
+    """Movies table of the store (movieId, genres), empty if not set."""
+    if not artifacts.exists(store_dir, MOVIES_TABLE):
+        return pd.DataFrame({'movieId': pd.Series(dtype=np.int32), 'genres': pd.Series(dtype=str)})
+    return artifacts.read_table(store_dir, MOVIES_TABLE)
+
+
+def append(store_dir, ratings=None, tags=None):
+    """Aggregate a batch of new rating (userId, movieId, rating) and / or tag (userId, movieId, tag) events.
+
+    Only the batch is aggregated, the partial aggregates are written as delta
+    files of one sequence number (merged by compact or read). Returns the
+    sequence number.
+    """
+    deltas = {}
+    if ratings is not None and len(ratings):
+        values = ratings['rating'].to_numpy()
+        deltas['user_ratings'] = rating_stats(ratings['userId'], values)
+        deltas['movie_ratings'] = rating_stats(ratings['movieId'], values)
+        deltas['genre_ratings'] = genre_rating_stats(ratings, read_movies(store_dir))
+    if tags is not None and len(tags):
+        deltas['user_movie_tags'] = tag_stats(tags)
+
+    sequence = _next_sequence(store_dir)
+    os.makedirs(os.path.join(store_dir, DELTAS_DIR), exist_ok=True)
+    for name, delta in deltas.items():
+        path = os.path.join(store_dir, DELTAS_DIR, f'{name}-{sequence:08d}.parquet')
+        # readers never see a partly written delta
+        pq.write_table(pa.Table.from_pandas(delta, preserve_index=False), f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
+    return sequence
+
+
+def read(store_dir, name):
+    """Current aggregate: the table of the store merged with the deltas not compacted yet (None if empty)."""
+    applied = _applied_through(store_dir, name)
+    frames = [artifacts.read_table(store_dir, _table(name))] if artifacts.exists(store_dir, _table(name)) else []
+    frames += [pd.read_parquet(path) for sequence, path in _delta_files(store_dir, name) if sequence > applied]
+    return merge(frames, AGGREGATES[name])
+
+
+def compact(store_dir):
+    """Merge the deltas into the tables of the store and delete them.
+
+    The table records the last merged sequence number, deltas of a compaction
+    that was interrupted before deleting them are not merged twice.
+    """
+    for name in AGGREGATES:
+        files = _delta_files(store_dir, name)
+        if not files:
+            continue
+        stats = read(store_dir, name)
+        if stats is not None:
+            artifacts.write_table(store_dir, _table(name), stats, metadata={'applied_through': files[-1][0]})
+        for _, path in files:
+            os.remove(path)
+
+
+###################################################################################################
+########################################## materialization #########################################
+###################################################################################################
+
+def _write_parquet(df, path, **kwargs):
+    # the app reloads a file when its modification time changes, it must never see a partial file
+    df.to_parquet(f'{path}.tmp', **kwargs)
+    os.replace(f'{path}.tmp', path)
+
+
+def _genre_columns(movies):
+    # genre names in the order and naming of the snapshots (pandas get_dummies on the genres)
+    genres = sorted(set(movies['genres'].str.split('|').explode()))
+    return genres, [NO_GENRE_COLUMN if genre == NO_GENRE else genre for genre in genres]
+
+
+def materialize(store_dir, output_dir):
+    """Write the aggregates as the files of data/dataframes the app and the notebooks read."""
+    os.makedirs(output_dir, exist_ok=True)
+    users = read(store_dir, 'user_ratings')
+    if users is not None:
+        user_rating_avg = pd.DataFrame({'avg_rating': users['sum'] / users['count']}).set_index(users['userId'].rename('userId'))
+        user_rating_sum = pd.DataFrame({'n_movies': users['count'].astype(np.int64)}).set_index(users['userId'].rename('userId'))
+        _write_parquet(user_rating_avg, os.path.join(output_dir, USER_RATING_AVG_FILE), compression='gzip')
+        _write_parquet(user_rating_sum, os.path.join(output_dir, USER_RATING_SUM_FILE), compression='gzip')
+        _write_parquet(pd.concat([user_rating_sum.describe(), user_rating_avg.describe()], axis=1),
+                       os.path.join(output_dir, USER_RATING_DESCRIBE_FILE))
+
+    user_movie_tags = read(store_dir, 'user_movie_tags')
+    if user_movie_tags is not None:
+        _write_parquet(user_movie_tags[['n_tags']].describe(), os.path.join(output_dir, USER_TAG_DESCRIBE_FILE))
+
+    movies = read_movies(store_dir).sort_values('movieId')
+    if len(movies):
+        genres, columns = _genre_columns(movies)
+        one_hot = movies['genres'].str.get_dummies(sep='|')[genres].set_axis(columns, axis=1)
+        frequency = pd.DataFrame({'n_movies': one_hot.sum().astype(np.int64)})
+        _write_parquet(frequency.rename_axis('genre'), os.path.join(output_dir, FREQUENCY_GENRES_FILE))
+
+        # average rating per movie on its genre columns (movie_genre_plots.ipynb), unrated movies get the mean
+        movie_stats = read(store_dir, 'movie_ratings')
+        rating_avg = pd.Series(np.nan, index=movies['movieId'].to_numpy())
+        if movie_stats is not None:
+            averages = pd.Series((movie_stats['sum'] / movie_stats['count']).to_numpy(), index=movie_stats['movieId'].to_numpy())
+            rating_avg = averages.reindex(rating_avg.index)
+        rating_avg = rating_avg.fillna(rating_avg.mean()).to_numpy()
+        genre_ratings = one_hot.astype(np.float64).mul(rating_avg, axis=0)
+        genre_ratings.insert(0, 'movieId', movies['movieId'].to_numpy(np.float64))
+        genre_ratings['rating_avg'] = rating_avg
+        _write_parquet(genre_ratings.reset_index(drop=True), os.path.join(output_dir, GENRE_RATINGS_FILE), compression='gzip')
+
+    genre_stats = read(store_dir, 'genre_ratings')
+    if genre_stats is not None:
+        _write_parquet(summary(genre_stats.set_index('genre')), os.path.join(output_dir, GENRE_RATING_STATS_FILE))
+
+
+###################################################################################################
+########################################## command line ############################################
+###################################################################################################
+
+def read_events(path, columns, block_size=64 << 20):
+    """Batches (DataFrames) of a rating or tag events CSV, read block by block."""
+    types = {'userId': pa.int32(), 'movieId': pa.int32(), 'rating': pa.float32(), 'tag': pa.string()}
+    reader = pv.open_csv(path, read_options=pv.ReadOptions(block_size=block_size),
+                         convert_options=pv.ConvertOptions(column_types={column: types[column] for column in columns},
+                                                           include_columns=columns))
+    for batch in reader:
+        yield batch.to_pandas()
+
+
+def main():
+    repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    parser = argparse.ArgumentParser(description='Incrementally maintained rating and tag aggregates.')
+    parser.add_argument('command', choices=['build', 'append', 'compact', 'materialize'])
+    parser.add_argument('--store-dir', default=os.path.join(repo_dir, 'data', 'aggregates'))
+    parser.add_argument('--output-dir', default=os.path.join(repo_dir, 'data', 'dataframes'))
+    parser.add_argument('--raw-dir', default=os.path.join(repo_dir, 'data', 'raw', 'ml-25m'),
+                        help='MovieLens CSVs for build')
+    parser.add_argument('--ratings', help='CSV of new rating events (userId, movieId, rating) for append')
+    parser.add_argument('--tags', help='CSV of new tag events (userId, movieId, tag) for append')
+    parser.add_argument('--movies', help='CSV of new or changed movies (movieId, genres) for append')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        # the whole dump as a sequence of batches
+        args.movies, args.ratings, args.tags = (os.path.join(args.raw_dir, file) for file in ['movies.csv', 'ratings.csv', 'tags.csv'])
+    if args.command in ('build', 'append'):
+        if args.movies:
+            set_movies(args.store_dir, pd.read_csv(args.movies, usecols=['movieId', 'genres']))
+        if args.ratings:
+            for batch in read_events(args.ratings, ['userId', 'movieId', 'rating']):
+                append(args.store_dir, ratings=batch)
+        if args.tags:
+            for batch in read_events(args.tags, ['userId', 'movieId', 'tag']):
+                append(args.store_dir, tags=batch)
+    if args.command in ('build', 'compact', 'materialize'):
+        compact(args.store_dir)
+    if args.command in ('build', 'materialize'):
+        materialize(args.store_dir, args.output_dir)
+
+
+if __name__ == '__main__':
+    main()
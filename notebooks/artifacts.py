@@ -0,0 +1,117 @@
+"""Columnar store for the model evaluation artifacts (metrics, cv results, best parameters).
+
+Replaces the joblib pickles in the models folder (surp_cv_results.json and
+surp_precision_at_k_recall_at_k.json were pickles despite their extension,
+the hyperparameter searches pickled whole search objects only to read
+best_params later). Every artifact is a table, written as <name>.parquet into
+the store folder and described in its manifest.json:
+
+    {"schema_version": 1,
+     "tables": {"surp_cv_folds": {"file": "surp_cv_folds.parquet", "schema_version": 1,
+                                  "n_rows": 50, "columns": {"model": "string", ...},
+                                  "dataset_hash": "sha256:...", "created": "...", "updated": "...",
+                                  "metadata": {...}}}}
+
+Tables are read memory-mapped with pyarrow, nothing is unpickled, so reading
+them needs neither Surprise nor the classes that produced them. Nested values
+like parameter dicts are stored as JSON strings (see to_json / from_json).
+"""
+import datetime
+import hashlib
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SCHEMA_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+
+
+def _replace(path, write):
+    # write to a temporary file first, so that readers never see a partly written file
+    tmp_path = f'{path}.tmp'
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def file_hash(*paths, chunk_size=1 << 20):
+    """sha256 of the content of the files, e.g. the ratings an artifact was computed from."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    return f'sha256:{digest.hexdigest()}'
+
+
+def to_json(value):
+    """JSON string of a nested value (e.g. parameters with sim_options) for a table column."""
+    return json.dumps(value, sort_keys=True)
+
+
+def from_json(value):
+    """Value of a JSON column."""
+    return json.loads(value)
+
+
+def read_manifest(store_dir):
+    """Manifest of a store (empty if nothing was written yet)."""
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'schema_version': SCHEMA_VERSION, 'tables': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(store_dir, manifest):
+    def write(path):
+        with open(path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+
+    _replace(os.path.join(store_dir, MANIFEST_FILE), write)
+
+
+def write_table(store_dir, name, df, dataset_hash=None, metadata=None):
+    """Write a DataFrame as table name of the store and record it in the manifest."""
+    os.makedirs(store_dir, exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    file = f'{name}.parquet'
+    _replace(os.path.join(store_dir, file), lambda path: pq.write_table(table, path))
+
+    manifest = read_manifest(store_dir)
+    created = manifest['tables'].get(name, {}).get('created', _now())
+    manifest['tables'][name] = {'file': file, 'schema_version': SCHEMA_VERSION, 'n_rows': table.num_rows,
+                                'columns': {field.name: str(field.type) for field in table.schema},
+                                'dataset_hash': dataset_hash, 'created': created, 'updated': _now(),
+                                'metadata': metadata or {}}
+    _write_manifest(store_dir, manifest)
+
+
+def exists(store_dir, name):
+    """Whether the store has a table."""
+    return name in read_manifest(store_dir)['tables']
+
+
+def read_table(store_dir, name, columns=None):
+    """Table of the store as DataFrame, read memory-mapped (optionally only some columns)."""
+    entry = read_manifest(store_dir)['tables'].get(name)
+    if entry is None:
+        raise KeyError(f"no table '{name}' in {store_dir}")
+    if entry['schema_version'] > SCHEMA_VERSION:
+        raise ValueError(f"table '{name}' has schema version {entry['schema_version']}, "
+                         f"this version reads up to {SCHEMA_VERSION}")
+    return pq.read_table(os.path.join(store_dir, entry['file']), columns=columns, memory_map=True).to_pandas()
+
+
+def update_table(store_dir, name, df, key, dataset_hash=None, metadata=None):
+    """Replace the rows of the table whose key column values are in df by df (e.g. the results of rerun models)."""
+    if exists(store_dir, name):
+        existing = read_table(store_dir, name)
+        df = pd.concat([existing[~existing[key].isin(df[key])], df], ignore_index=True)
+    write_table(store_dir, name, df, dataset_hash, metadata)
@@ -0,0 +1,209 @@
+"""Single-pass cross-validation of the tuned Surprise models.
+
+Replaces the two passes of model_surprise_cross_validation.ipynb (cross_validate
+for MAE / MSE / RMSE) and model_surprise_evaluation.ipynb (a second KFold loop
+that fits every model again for precision@k / recall@k): every (model, fold) is
+fitted once, and all metrics of evaluation.METRICS (error metrics, precision /
+recall@k, NDCG@k, catalog coverage@k) are computed from the same predictions.
+
+The folds are the ones of surprise.model_selection.KFold(n_splits, random_state)
+on the slim ratings table, every task builds only its own fold. The tasks run
+in a process pool with one task per worker process, so that the peak memory
+(max RSS) reported with every fold belongs to that (model, fold) alone, next to
+its fit and test time.
+
+write_results() stores the fold records as table surp_cv_folds of the artifact
+store (see artifacts.py), one row per (model, fold) and one column per metric,
+with the hash of the ratings they were computed from. legacy_folds() converts
+the pickled results of earlier runs (surp_cv_results.json and
+surp_precision_at_k_recall_at_k.json) into the same table.
+
+Usage from the command line (paths relative to the repository root):
+
+    python notebooks/cross_validation.py --models SVD NMF --n-jobs 5
+"""
+import argparse
+import os
+import random
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+import surprise
+from surprise import Dataset, Reader
+from surprise.utils import get_rng
+
+import artifacts
+import dataprep
+import evaluation
+
+# name, Surprise algorithm, result keys in the pickled surp_cv_results.json / surp_precision_at_k_recall_at_k.json
+# of earlier runs (see legacy_folds), whether the parameters come from the hyperparameter search and
+# whether the algorithm takes a random_state (set to the random_state of the folds unless the search found one)
+MODELS = [
+    {'name': 'knnBasic', 'algo': 'KNNBasic', 'cv_key': 'knnBasic', 'pr_key': 'knnBasic', 'tuned': True},
+    {'name': 'knnMeans', 'algo': 'KNNWithMeans', 'cv_key': 'knnMeans', 'pr_key': 'knnMean', 'tuned': True},
+    {'name': 'knnBaseline', 'algo': 'KNNBaseline', 'cv_key': 'knnBaseline', 'pr_key': 'knnBaseline', 'tuned': True},
+    {'name': 'knnZScore', 'algo': 'KNNWithZScore', 'cv_key': 'knnZScore', 'pr_key': 'knnZScore', 'tuned': True},
+    {'name': 'SVD', 'algo': 'SVD', 'cv_key': 'SVD', 'pr_key': 'SVD', 'tuned': True, 'seeded': True},
+    {'name': 'NMF', 'algo': 'NMF', 'cv_key': 'NMF', 'pr_key': 'NMF', 'tuned': True, 'seeded': True},
+    {'name': 'NormalPredictor', 'algo': 'NormalPredictor', 'cv_key': 'rand', 'pr_key': 'rand', 'tuned': False},
+    {'name': 'SlopeOne', 'algo': 'SlopeOne', 'cv_key': 'SlopeOne', 'pr_key': 'SlopeOne', 'tuned': False},
+    {'name': 'BaselineOnly', 'algo': 'BaselineOnly', 'cv_key': 'BaselineOnly', 'pr_key': 'Baseline', 'tuned': True},
+    {'name': 'CoClustering', 'algo': 'CoClustering', 'cv_key': 'CoClustering', 'pr_key': 'CC', 'tuned': True, 'seeded': True},
+]
+
+FOLDS_TABLE = 'surp_cv_folds'
+LEGACY_CV_RESULTS_FILE = 'surp_cv_results.json'
+LEGACY_PRECISION_RECALL_FILE = 'surp_precision_at_k_recall_at_k.json'
+
+
+def model_params(model, gridsearch_dir, measure='mae'):
+    """Best parameters of the hyperparameter search for a model of MODELS ({} for untuned models).
+
+    They are read from the table surp_best_params that surprise_search writes
+    to the artifact store in gridsearch_dir.
+    """
+    if not model['tuned']:
+        return {}
+    best = artifacts.read_table(gridsearch_dir, 'surp_best_params')
+    row = best[(best['search'] == model['name']) & (best['measure'] == measure)]
+    if row.empty:
+        raise KeyError(f"no search results for {model['name']} in {gridsearch_dir}")
+    return artifacts.from_json(row['params'].iloc[0])
+
+
+def kfold_split(data, n_splits=5, fold=0, random_state=42):
+    """Trainset and testset of one fold of surprise.model_selection.KFold(n_splits, random_state)."""
+    n_ratings = len(data.raw_ratings)
+    indices = np.arange(n_ratings)
+    get_rng(random_state).shuffle(indices)
+    # fold boundaries like KFold: the first n_ratings % n_splits folds get one rating more
+    sizes = [n_ratings // n_splits + (1 if i < n_ratings % n_splits else 0) for i in range(n_splits)]
+    start = sum(sizes[:fold])
+    stop = start + sizes[fold]
+    raw_trainset = [data.raw_ratings[i] for i in np.concatenate([indices[:start], indices[stop:]])]
+    raw_testset = [data.raw_ratings[i] for i in indices[start:stop]]
+    return data.construct_trainset(raw_trainset), data.construct_testset(raw_testset)
+
+
+def _evaluate_fold(model, params, data_dir, fold, n_splits, random_state, metrics, ks, threshold, train_measures):
+    df = dataprep.read_ratings(data_dir, columns=['userId', 'movieId', 'rating'])
+    data = Dataset.load_from_df(df, Reader(rating_scale=(0.5, 5.0)))
+    del df
+    trainset, testset = kfold_split(data, n_splits, fold, random_state)
+    # the seeds of the notebooks
+    random.seed(random_state)
+    np.random.seed(random_state)
+    if model.get('seeded'):
+        params = {'random_state': random_state, **params}
+    algo = getattr(surprise, model['algo'])(**params)
+
+    start = time.perf_counter()
+    algo.fit(trainset)
+    fit_time = time.perf_counter() - start
+    start = time.perf_counter()
+    predictions = algo.test(testset)
+    test_time = time.perf_counter() - start
+
+    record = {'name': model['name'], 'fold': fold, 'fit_time': fit_time, 'test_time': test_time}
+    record.update(evaluation.fold_metrics(predictions, metrics, ks, threshold, trainset.n_items))
+    if train_measures:
+        errors = evaluation.error_metrics(*evaluation.prediction_arrays(algo.test(trainset.build_testset()))[2:])
+        record.update({f'train_{measure}': value for measure, value in errors.items()})
+    # max RSS of this worker process, which only ran this task (KiB on Linux)
+    record['peak_memory_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return record
+
+
+def cross_validate_models(data_dir, gridsearch_dir, models=None, n_splits=5, random_state=42,
+                          metrics=tuple(evaluation.METRICS), ks=(3, 5, 10, 20), threshold=3.5,
+                          train_measures=True, measure='mae', n_jobs=-1):
+    """Cross-validate the models (names of MODELS, default all) and return their fold records by name."""
+    models = [model for model in MODELS if models is None or model['name'] in models]
+    tasks = [(model, model_params(model, gridsearch_dir, measure), fold) for model in models for fold in range(n_splits)]
+    # a fresh worker process per task, so that the peak memory is measured per (model, fold)
+    with ProcessPoolExecutor(max_workers=None if n_jobs == -1 else n_jobs, max_tasks_per_child=1) as executor:
+        futures = [executor.submit(_evaluate_fold, model, params, data_dir, fold, n_splits, random_state,
+                                   metrics, ks, threshold, train_measures) for model, params, fold in tasks]
+        records = [future.result() for future in futures]
+
+    results = {model['name']: [] for model in models}
+    for record in records:
+        results[record['name']].append(record)
+    return results
+
+
+def folds_table(results):
+    """Fold records of cross_validate_models as one table (model, fold, one column per metric)."""
+    return pd.DataFrame([record for records in results.values() for record in records]).rename(columns={'name': 'model'})
+
+
+def legacy_folds(cv_results, precision_recall):
+    """Table of folds_table from the pickled results of earlier runs (the dicts by cv_key / pr_key)."""
+    rows = []
+    for model in MODELS:
+        cv = cv_results.get(f"cv_{model['cv_key']}")
+        if cv is None:
+            continue
+        n_folds = len(cv['test_mae'])
+        records = [{'model': model['name'], 'fold': fold} for fold in range(n_folds)]
+        for key, values in cv.items():
+            for record, value in zip(records, values):
+                record[key] = float(value)
+        for metric in ('precision', 'recall'):
+            for k, values in precision_recall.get(f"{metric}s_{model['pr_key']}_dict", {}).items():
+                for record, value in zip(records, values):
+                    record[f'{metric}@{k}'] = float(value)
+        rows += records
+    return pd.DataFrame(rows)
+
+
+def convert_legacy(legacy_dir, store_dir):
+    """Write the pickled cv results of legacy_dir as table surp_cv_folds of the store."""
+    cv_results = joblib.load(os.path.join(legacy_dir, LEGACY_CV_RESULTS_FILE))
+    precision_recall_path = os.path.join(legacy_dir, LEGACY_PRECISION_RECALL_FILE)
+    precision_recall = joblib.load(precision_recall_path) if os.path.exists(precision_recall_path) else {}
+    artifacts.write_table(store_dir, FOLDS_TABLE, legacy_folds(cv_results, precision_recall),
+                          metadata={'source': 'legacy'})
+
+
+def write_results(results, output_dir, dataset_hash=None):
+    """Write the fold records to the artifact store, replacing earlier results of the same models."""
+    artifacts.update_table(output_dir, FOLDS_TABLE, folds_table(results), key='model', dataset_hash=dataset_hash)
+
+
+def main():
+    repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    parser = argparse.ArgumentParser(description='Cross-validate the tuned Surprise models in a single pass.')
+    parser.add_argument('--data-dir', default=os.path.join(repo_dir, 'data', 'processed'))
+    parser.add_argument('--gridsearch-dir', default=os.path.join(repo_dir, 'models'),
+                        help='artifact store with the surp_best_params of the searches')
+    parser.add_argument('--output-dir', default=os.path.join(repo_dir, 'data', 'models'))
+    parser.add_argument('--models', nargs='*', default=None, help='names of the models to evaluate (default: all)')
+    parser.add_argument('--n-splits', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42, help='random_state of the folds and models')
+    parser.add_argument('--metrics', nargs='*', choices=list(evaluation.METRICS), default=list(evaluation.METRICS))
+    parser.add_argument('--n-jobs', type=int, default=-1, help='worker processes (-1: all CPUs)')
+    args = parser.parse_args()
+
+    results = cross_validate_models(args.data_dir, args.gridsearch_dir, args.models, args.n_splits, args.seed,
+                                    args.metrics, n_jobs=args.n_jobs)
+    write_results(results, args.output_dir, artifacts.file_hash(*dataprep.ratings_files(args.data_dir)))
+    # the summary tables and figures of the Streamlit app, they also need the metrics of the default models
+    import model_results
+    if artifacts.exists(args.output_dir, model_results.DEFAULT_METRICS_TABLE):
+        model_results.build_results(args.output_dir)
+    else:
+        print(f'no table {model_results.DEFAULT_METRICS_TABLE} in {args.output_dir}, '
+              'the summaries and figures of the app are not rebuilt')
+    for name, records in results.items():
+        print(name, {key: round(float(np.mean([record[key] for record in records])), 4)
+                     for key in records[0] if key not in ('name', 'fold')})
+
+
+if __name__ == '__main__':
+    main()
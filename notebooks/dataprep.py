@@ -0,0 +1,243 @@
+"""Preprocessing pipeline for the raw MovieLens 25M CSVs (see Dataprep.ipynb).
+
+Same steps and output as the notebook, but with compact dtypes and without
+ever materializing the 25M-row merged table with the tag lists:
+
+1. genome scores are read as int32/float64 (via pyarrow; float64 keeps the
+   relevance values of the CSV exactly, ties included), the top 40 tags per
+   movie are selected with one stable sort and a cumcount instead of
+   groupby().apply(nlargest), and aggregated into the 'relevance' and 'tag'
+   lists per movie,
+2. the ratings (int32/float32, no timestamp) are filtered and sampled on their
+   own: outlier user removed, movies with fewer than 2000 ratings dropped,
+   log-scaled sample per movie (vectorized and seeded, other quota curves
+   like sqrt or a cap create differently sized subsets),
+3. the result is stored normalized as star schema: a slim ratings table
+   (int32 userId, int32 movieId, float32 rating), partitioned into Parquet
+   files of one million ratings that each hold a contiguous userId range, and
+   a movie features table (title, genres and the top tag / relevance lists,
+   one row per movie).
+
+The movie features are only joined onto the ratings by movieId where a model
+needs them (join_features), instead of repeating the 40-element lists on every
+rating row. The denormalized table of the notebook can still be written as
+preprocessed_data_movielens.csv.
+
+Usage from the command line (paths relative to the repository root):
+
+    python notebooks/dataprep.py --raw-dir data/raw/ml-25m --output-dir data/processed --csv
+"""
+import argparse
+import glob
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+RATINGS_DIR = 'ratings'
+RATINGS_PER_FILE = 1_000_000
+MOVIE_FEATURES_FILE = 'movie_features.parquet'
+
+# user that was identified as outlier in the data exploration
+OUTLIER_USERS = (75309,)
+N_TAGS = 40
+MIN_RATINGS = 2000
+
+DTYPES = {
+    'ratings.csv': {'userId': pa.int32(), 'movieId': pa.int32(), 'rating': pa.float32()},
+    'genome-scores.csv': {'movieId': pa.int32(), 'tagId': pa.int32(), 'relevance': pa.float64()},
+    'genome-tags.csv': {'tagId': pa.int32(), 'tag': pa.string()},
+    'movies.csv': {'movieId': pa.int32(), 'title': pa.string(), 'genres': pa.string()},
+}
+
+
+def read_csv(path):
+    """Read one of the MovieLens CSVs with compact dtypes (only the needed columns)."""
+    column_types = DTYPES[os.path.basename(path)]
+    table = pv.read_csv(path, convert_options=pv.ConvertOptions(column_types=column_types,
+                                                                include_columns=list(column_types)))
+    return table.to_pandas()
+
+
+def top_tags(df_gscores, df_gtags, df_movies, n_tags=N_TAGS):
+    """Top n_tags tags per movie, aggregated to lists.
+
+    Returns one row per movie (movieId, title, genres, relevance, tag) like
+    cells 1-3 of Dataprep.ipynb; movies without genome scores get [nan] lists.
+    """
+    movie_ids = df_gscores['movieId'].to_numpy()
+    relevance = df_gscores['relevance'].to_numpy()
+    # stable sort by movieId ascending and relevance descending, ties keep the file
+    # order like sort_values(['movieId', 'relevance'], ascending=[True, False])
+    order = np.lexsort((-relevance, movie_ids))
+    top = df_gscores.iloc[order]
+    top = top[top.groupby('movieId', sort=False).cumcount().to_numpy() < n_tags]
+    top = top.merge(df_gtags, how='left', on='tagId')
+    lists = top.groupby('movieId', sort=False).agg({'relevance': list, 'tag': list})
+
+    features = df_movies.merge(lists, how='left', left_on='movieId', right_index=True)
+    for column in ['relevance', 'tag']:
+        features[column] = [value if isinstance(value, list) else [np.nan] for value in features[column]]
+    return features.sort_values('movieId', kind='stable').reset_index(drop=True)
+
+
+def filter_ratings(df_ratings, outlier_users=OUTLIER_USERS, min_ratings=MIN_RATINGS):
+    """Drop outlier users and movies with fewer than min_ratings ratings.
+
+    The result is ordered by movieId (stable, i.e. ratings.csv order within a
+    movie), which is the row order of the merged table in the notebook.
+    """
+    df_ratings = df_ratings[~df_ratings['userId'].isin(outlier_users)]
+    movie_counts = df_ratings['movieId'].value_counts()
+    df_ratings = df_ratings[df_ratings['movieId'].isin(movie_counts[movie_counts >= min_ratings].index)]
+    order = np.argsort(df_ratings['movieId'].to_numpy(), kind='stable')
+    return df_ratings.iloc[order]
+
+
+def quota_log(counts, base=1.004):
+    """Logarithm to base `base` of the number of ratings (the notebook's sample_log_base_1_004)."""
+    return np.round(np.log(counts) / np.log(base)).astype(np.int64)
+
+
+def quota_sqrt(counts, factor=1.0):
+    """factor * square root of the number of ratings."""
+    return np.round(factor * np.sqrt(counts)).astype(np.int64)
+
+
+def quota_cap(counts, cap=500):
+    """The number of ratings, capped at cap."""
+    return np.minimum(counts, int(cap))
+
+
+QUOTAS = {'log': quota_log, 'sqrt': quota_sqrt, 'cap': quota_cap}
+
+
+def sample_ratings(df_ratings, seed=42, quota='log', quota_param=None, stratify=False, n_strata=4):
+    """Sample of the ratings of every movie, vectorized over all movies.
+
+    The number of ratings kept per movie is quota(count) (a name of QUOTAS or a
+    function of the array of counts, quota_param is passed on), at most all of
+    them. Every rating gets a random key, ratings are ranked by key within
+    their movie in one sort and the ones ranked below the quota are kept.
+
+    With stratify=True the quota of a movie is split over n_strata user
+    activity strata (quantiles of the number of ratings per user) in
+    proportion to the movie's ratings in each stratum, so light and heavy
+    users keep their share. The rows keep their input order.
+    """
+    quota = QUOTAS[quota] if isinstance(quota, str) else quota
+    movie_codes, _ = pd.factorize(df_ratings['movieId'], sort=True)
+    counts = np.bincount(movie_codes)
+    quotas = np.minimum(quota(counts) if quota_param is None else quota(counts, quota_param), counts)
+
+    if stratify:
+        user_counts = df_ratings['userId'].map(df_ratings['userId'].value_counts()).to_numpy()
+        strata = pd.qcut(user_counts, n_strata, labels=False, duplicates='drop')
+        group_codes = movie_codes * n_strata + strata
+        group_counts = np.bincount(group_codes, minlength=len(counts) * n_strata)
+        # quota of the movie split in proportion to the ratings per stratum
+        quotas = np.round(np.repeat(quotas / counts, n_strata) * group_counts).astype(np.int64)
+    else:
+        group_codes, group_counts = movie_codes, counts
+
+    rng = np.random.default_rng(seed)
+    # group code in the upper and random key in the lower 32 bits: one int64 argsort
+    # orders by group and randomly within the group (much faster than np.lexsort)
+    keys = (group_codes.astype(np.int64) << 32) | rng.integers(0, 2**32, len(df_ratings), dtype=np.int64)
+    order = np.argsort(keys)
+    # rank of every rating within its group in the order of the random keys
+    starts = np.cumsum(group_counts) - group_counts
+    ranks = np.arange(len(order)) - starts[group_codes[order]]
+    keep = np.sort(order[ranks < quotas[group_codes[order]]])
+    return df_ratings.iloc[keep]
+
+
+def join_features(df_ratings, features):
+    """Attach the movie features to the ratings, in the column order of the notebook output."""
+    df = df_ratings[['movieId', 'userId', 'rating']].merge(features, how='left', on='movieId')
+    return df[['movieId', 'title', 'genres', 'relevance', 'tag', 'userId', 'rating']]
+
+
+def write_star_schema(df_ratings, features, output_dir, rows_per_file=RATINGS_PER_FILE):
+    """Write the slim ratings table and the features of the movies they contain as Parquet files.
+
+    The ratings are ordered by userId (like ratings.csv) and split into files
+    of rows_per_file rows, part-0000.parquet, part-0001.parquet, ... in the
+    directory RATINGS_DIR, so every file holds a contiguous userId range.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    df_ratings = df_ratings[['userId', 'movieId', 'rating']].sort_values('userId', kind='stable').reset_index(drop=True)
+    ratings_dir = os.path.join(output_dir, RATINGS_DIR)
+    # parts of an earlier, larger sample must not remain
+    shutil.rmtree(ratings_dir, ignore_errors=True)
+    os.makedirs(ratings_dir)
+    for i, start in enumerate(range(0, max(len(df_ratings), 1), rows_per_file)):
+        table = pa.Table.from_pandas(df_ratings.iloc[start:start + rows_per_file], preserve_index=False)
+        pq.write_table(table, os.path.join(ratings_dir, f'part-{i:04d}.parquet'), compression='snappy')
+    features = features[features['movieId'].isin(df_ratings['movieId'].unique())].reset_index(drop=True)
+    features.to_parquet(os.path.join(output_dir, MOVIE_FEATURES_FILE), index=False, compression='snappy')
+
+
+def ratings_files(data_dir):
+    """Paths of the Parquet files of the ratings table in order, e.g. to hash the data."""
+    return sorted(glob.glob(os.path.join(data_dir, RATINGS_DIR, 'part-*.parquet')))
+
+
+def read_ratings(data_dir, columns=None):
+    """Slim ratings table (userId, movieId, rating) written by write_star_schema."""
+    if not ratings_files(data_dir):
+        raise FileNotFoundError(f'no ratings table in {data_dir}, run notebooks/dataprep.py first')
+    return pd.concat([pd.read_parquet(path, columns=columns) for path in ratings_files(data_dir)], ignore_index=True)
+
+
+def read_movie_features(data_dir, columns=None):
+    """Movie features table (movieId, title, genres, relevance, tag) written by write_star_schema.
+
+    The relevance and tag lists are only read if requested, e.g.
+    read_movie_features(data_dir, columns=['movieId', 'title']) for the titles.
+    """
+    features = pd.read_parquet(os.path.join(data_dir, MOVIE_FEATURES_FILE), columns=columns)
+    # parquet returns the lists as numpy arrays (missing tags as None), convert them
+    # back to lists like in the notebook
+    for column in ['relevance', 'tag']:
+        if column in features:
+            features[column] = [[np.nan if item is None else item for item in value.tolist()] for value in features[column]]
+    return features
+
+
+def run(raw_dir, output_dir, seed=42, csv=False, quota='log', quota_param=None, stratify=False):
+    """Run the whole preprocessing and write the results to output_dir."""
+    features = top_tags(read_csv(os.path.join(raw_dir, 'genome-scores.csv')),
+                        read_csv(os.path.join(raw_dir, 'genome-tags.csv')),
+                        read_csv(os.path.join(raw_dir, 'movies.csv')))
+    df_ratings = sample_ratings(filter_ratings(read_csv(os.path.join(raw_dir, 'ratings.csv'))), seed, quota, quota_param, stratify)
+
+    write_star_schema(df_ratings, features, output_dir)
+    if csv:
+        join_features(df_ratings, features).to_csv(os.path.join(output_dir, 'preprocessed_data_movielens.csv'), index=False)
+    return df_ratings
+
+
+def main():
+    repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    parser = argparse.ArgumentParser(description='Preprocess the raw MovieLens 25M CSVs.')
+    parser.add_argument('--raw-dir', default=os.path.join(repo_dir, 'data', 'raw', 'ml-25m'))
+    parser.add_argument('--output-dir', default=os.path.join(repo_dir, 'data', 'processed'))
+    parser.add_argument('--seed', type=int, default=42, help='seed of the per-movie sampling')
+    parser.add_argument('--quota', choices=sorted(QUOTAS), default='log', help='ratings kept per movie')
+    parser.add_argument('--quota-param', type=float, default=None,
+                        help='parameter of the quota (log base, sqrt factor or cap)')
+    parser.add_argument('--stratify', action='store_true', help='sample stratified by user activity')
+    parser.add_argument('--csv', action='store_true', help='also write the denormalized preprocessed_data_movielens.csv')
+    args = parser.parse_args()
+
+    df = run(args.raw_dir, args.output_dir, args.seed, args.csv, args.quota, args.quota_param, args.stratify)
+    print(f'{len(df)} rows written to {args.output_dir}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""Tag embeddings and genre encoding per movie (see Embedding_data.ipynb).
+
+Word2Vec is trained on one tag document per movie (the words of its top tags
+from the movie features table of dataprep.py) with several worker threads, not
+on one sentence per rating row. The embedding of a movie is the mean of the
+word vectors of its document, computed for all movies at once as sparse
+(movies x vocabulary) product with the float32 word vector matrix.
+
+The result is a movie x 100 float32 table (movieId, tag_emb_0, ...,
+tag_emb_99) stored separately as movie_tag_embeddings.parquet and joined onto
+the ratings by movieId where a model needs it.
+
+Genres are encoded once per movie as multi-label uint8 matrix (one column per
+genre, from a single vectorized split of the genre strings) and stored as
+movie_genres.parquet. movie_feature_block() combines both tables into one
+float32 (movies x features) block and gather_features() picks its rows for the
+movieIds of the ratings, e.g. as additional features input of the NCF model.
+
+Usage from the command line (paths relative to the repository root):
+
+    python notebooks/embeddings.py --data-dir data/processed
+"""
+import argparse
+import os
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+import dataprep
+
+EMBEDDINGS_FILE = 'movie_tag_embeddings.parquet'
+GENRES_FILE = 'movie_genres.parquet'
+
+
+def tag_documents(tags):
+    """Word lists per movie from the lists of its tags (missing tags are skipped)."""
+    return [[word for tag in movie_tags if isinstance(tag, str) for word in tag.split()] for movie_tags in tags]
+
+
+def train_word2vec(documents, vector_size=100, window=5, min_count=1, sg=1, workers=None, seed=42):
+    """Word2Vec model (skip-gram by default) trained on the tag documents.
+
+    workers defaults to the number of CPUs; with more than one worker the
+    training is not exactly reproducible, even with a fixed seed.
+    """
+    # gensim is only needed for the training, not for computing the mean embeddings
+    from gensim.models import Word2Vec
+
+    return Word2Vec(sentences=documents, vector_size=vector_size, window=window, min_count=min_count, sg=sg,
+                    workers=workers or os.cpu_count(), seed=seed)
+
+
+def mean_embeddings(documents, wv):
+    """Mean word vector of every document (documents x vector_size float32).
+
+    wv are gensim KeyedVectors; words missing in the vocabulary are ignored,
+    documents without known words get zeros.
+    """
+    vectors = np.asarray(wv.vectors, dtype=np.float32)
+    lengths = np.array([len(document) for document in documents])
+    rows = np.repeat(np.arange(len(documents)), lengths)
+    columns = pd.Series(list(chain.from_iterable(documents)), dtype=object).map(wv.key_to_index).to_numpy(dtype=np.float64)
+    known = ~np.isnan(columns)
+    # gather and mean as one sparse product: (documents x vocabulary) word counts @ word vectors
+    counts = sp.csr_matrix((np.ones(known.sum(), dtype=np.float32), (rows[known], columns[known].astype(np.int64))),
+                           shape=(len(documents), len(vectors)))
+    n_words = np.asarray(counts.sum(axis=1)).ravel()
+    return (counts @ vectors) / np.maximum(n_words, 1)[:, None]
+
+
+def embedding_table(movie_ids, embeddings, prefix='tag_emb_'):
+    """DataFrame with movieId and one float32 column per embedding dimension."""
+    table = pd.DataFrame(np.asarray(embeddings, dtype=np.float32),
+                         columns=[f'{prefix}{i}' for i in range(embeddings.shape[1])])
+    table.insert(0, 'movieId', np.asarray(movie_ids))
+    return table
+
+
+def read_embeddings(data_dir):
+    """Movie tag embedding table written by run()."""
+    return pd.read_parquet(os.path.join(data_dir, EMBEDDINGS_FILE))
+
+
+def genre_matrix(genres, sep='|'):
+    """Multi-label genre encoding of genre strings like 'Action|Comedy'.
+
+    Returns a (movies x genres) uint8 CSR matrix and the sorted genre names.
+    """
+    split = pd.Series(np.asarray(genres, dtype=object)).str.split(sep)
+    genre_codes, names = pd.factorize(split.explode(), sort=True)
+    rows = np.repeat(np.arange(len(split)), split.str.len().to_numpy())
+    matrix = sp.csr_matrix((np.ones(len(rows), dtype=np.uint8), (rows, genre_codes)), shape=(len(split), len(names)))
+    return matrix, np.asarray(names)
+
+
+def genre_table(movie_ids, genres, sep='|'):
+    """DataFrame with movieId and one uint8 column per genre."""
+    matrix, names = genre_matrix(genres, sep)
+    table = pd.DataFrame(matrix.toarray(), columns=names)
+    table.insert(0, 'movieId', np.asarray(movie_ids))
+    return table
+
+
+def read_genres(data_dir):
+    """Movie genre table written by run()."""
+    return pd.read_parquet(os.path.join(data_dir, GENRES_FILE))
+
+
+def movie_feature_block(data_dir, tag_embeddings=True, genres=True):
+    """Movie features as one float32 block: (sorted movieIds, movies x features matrix, feature names).
+
+    Contains the tag embedding and / or the genre columns, movies missing in
+    one of the tables get zeros there.
+    """
+    tables = ([read_embeddings(data_dir)] if tag_embeddings else []) + ([read_genres(data_dir)] if genres else [])
+    movie_ids = np.unique(np.concatenate([table['movieId'].to_numpy() for table in tables]))
+    blocks, names = [], []
+    for table in tables:
+        block = np.zeros((len(movie_ids), table.shape[1] - 1), dtype=np.float32)
+        block[np.searchsorted(movie_ids, table['movieId'].to_numpy())] = table.drop(columns=['movieId']).to_numpy(dtype=np.float32)
+        blocks.append(block)
+        names.extend(table.columns[1:])
+    return movie_ids, np.hstack(blocks), names
+
+
+def gather_features(block_movie_ids, block, movie_ids):
+    """Rows of a movie feature block for the movieIds of ratings (ratings x features float32)."""
+    positions = np.searchsorted(block_movie_ids, np.asarray(movie_ids))
+    if np.any(block_movie_ids[np.minimum(positions, len(block_movie_ids) - 1)] != movie_ids):
+        raise KeyError('movieIds without features')
+    return block[positions]
+
+
+def run(data_dir, vector_size=100, workers=None, seed=42):
+    """Compute tag embeddings and genre encoding of the movie features in data_dir and write them there."""
+    features = dataprep.read_movie_features(data_dir, columns=['movieId', 'genres', 'tag'])
+    genre_table(features['movieId'], features['genres']).to_parquet(os.path.join(data_dir, GENRES_FILE), index=False)
+    documents = tag_documents(features['tag'])
+    model = train_word2vec(documents, vector_size=vector_size, workers=workers, seed=seed)
+    table = embedding_table(features['movieId'], mean_embeddings(documents, model.wv))
+    table.to_parquet(os.path.join(data_dir, EMBEDDINGS_FILE), index=False)
+    return table
+
+
+def main():
+    repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    parser = argparse.ArgumentParser(description='Compute the tag embeddings and genre encoding per movie.')
+    parser.add_argument('--data-dir', default=os.path.join(repo_dir, 'data', 'processed'))
+    parser.add_argument('--vector-size', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=None, help='Word2Vec worker threads (default: all CPUs)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    table = run(args.data_dir, args.vector_size, args.workers, args.seed)
+    print(f'{len(table)} movie embeddings written to {args.data_dir}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""Vectorized evaluation metrics for Surprise predictions.
+
+precision@k and recall@k compute the same values as the per-user loop in
+model_surprise_evaluation.ipynb, but for all k at once: predictions are sorted
+by user and estimate with a single lexsort and the counts per user are obtained
+with segment reductions (np.bincount) instead of Python loops. NDCG@k and
+catalog coverage@k use the same ranking.
+
+METRICS registers the metrics that fold_metrics() computes from the
+predictions of one fold (see cross_validation.py).
+"""
+import numpy as np
+import pandas as pd
+
+
+def predictions_to_arrays(predictions):
+    """Split a list of Surprise predictions into uid, true rating and estimate arrays."""
+    if len(predictions) == 0:
+        return np.array([]), np.array([], dtype=np.float64), np.array([], dtype=np.float64)
+    # each prediction is a tuple (uid, iid, r_ui, est, details)
+    uid, _, true_r, est, _ = zip(*predictions)
+    return np.asarray(uid), np.asarray(true_r, dtype=np.float64), np.asarray(est, dtype=np.float64)
+
+
+def prediction_arrays(predictions):
+    """Split a list of Surprise predictions into uid, iid, true rating and estimate arrays."""
+    if len(predictions) == 0:
+        return np.array([]), np.array([]), np.array([], dtype=np.float64), np.array([], dtype=np.float64)
+    uid, iid, true_r, est, _ = zip(*predictions)
+    return np.asarray(uid), np.asarray(iid), np.asarray(true_r, dtype=np.float64), np.asarray(est, dtype=np.float64)
+
+
+def _rank_by_user(codes, score):
+    """Order sorting by user and descending score, and the rank within the user of every sorted entry."""
+    order = np.lexsort((-score, codes))
+    counts = np.bincount(codes, minlength=codes.max() + 1 if len(codes) else 0)
+    starts = np.cumsum(counts) - counts
+    return order, np.arange(len(codes)) - starts[codes[order]]
+
+
+def precision_recall_at_ks(uid, true_r, est, ks=(3, 5, 10, 20), threshold=3.5):
+    """Return users and per-user precision and recall for every k in ks.
+
+    uid, true_r and est are array-likes of equal length. The result is a tuple
+    (users, precisions, recalls) where precisions[k] and recalls[k] are arrays
+    aligned with users.
+    """
+    true_r = np.asarray(true_r, dtype=np.float64)
+    est = np.asarray(est, dtype=np.float64)
+    # map raw user ids to contiguous codes 0..n_users-1
+    codes, users = pd.factorize(np.asarray(uid))
+    n_users = len(users)
+
+    # sort by user, then by estimate descending; lexsort is stable, so ties keep
+    # the order of the prediction list like list.sort() in the original function
+    order, rank = _rank_by_user(codes, est)
+    codes = codes[order]
+    relevant = true_r[order] >= threshold
+    recommended = est[order] >= threshold
+
+    # Number of relevant items per user
+    n_rel = np.bincount(codes, weights=relevant, minlength=n_users)
+
+    precisions, recalls = {}, {}
+    for k in ks:
+        in_top_k = rank < k
+        # Number of recommended items in top k
+        n_rec_k = np.bincount(codes, weights=recommended & in_top_k, minlength=n_users)
+        # Number of relevant and recommended items in top k
+        n_rel_and_rec_k = np.bincount(codes, weights=relevant & recommended & in_top_k, minlength=n_users)
+
+        # When n_rec_k (n_rel) is 0, precision (recall) is undefined. We here set it to 0.
+        precisions[k] = np.divide(n_rel_and_rec_k, n_rec_k, out=np.zeros(n_users), where=n_rec_k != 0)
+        recalls[k] = np.divide(n_rel_and_rec_k, n_rel, out=np.zeros(n_users), where=n_rel != 0)
+
+    return users, precisions, recalls
+
+
+def precision_recall_at_k(predictions, k=10, threshold=3.5):
+    """Return precision and recall at k metrics for each user"""
+    users, precisions, recalls = precision_recall_at_ks(*predictions_to_arrays(predictions), ks=(k,), threshold=threshold)
+    return dict(zip(users, precisions[k])), dict(zip(users, recalls[k]))
+
+
+def average_precision_recall_at_k(predictions, ks=(3, 5, 10, 20), threshold=3.5):
+    """Return precision and recall at k averaged over all users, as dicts keyed by k."""
+    _, precisions, recalls = precision_recall_at_ks(*predictions_to_arrays(predictions), ks=ks, threshold=threshold)
+    # Precision and recall are averaged over all users
+    avg_precisions = {k: float(np.mean(precisions[k])) if len(precisions[k]) else 0.0 for k in ks}
+    avg_recalls = {k: float(np.mean(recalls[k])) if len(recalls[k]) else 0.0 for k in ks}
+    return avg_precisions, avg_recalls
+
+
+def ndcg_at_ks(uid, true_r, est, ks=(3, 5, 10, 20)):
+    """Return users and per-user NDCG@k (true ratings as gains) for every k in ks."""
+    true_r = np.asarray(true_r, dtype=np.float64)
+    est = np.asarray(est, dtype=np.float64)
+    codes, users = pd.factorize(np.asarray(uid))
+    n_users = len(users)
+    # ranking by estimate and ideal ranking by true rating
+    order, rank = _rank_by_user(codes, est)
+    ideal_order, ideal_rank = _rank_by_user(codes, true_r)
+    discount = 1 / np.log2(rank + 2)
+    ideal_discount = 1 / np.log2(ideal_rank + 2)
+
+    ndcgs = {}
+    for k in ks:
+        dcg = np.bincount(codes[order], weights=true_r[order] * discount * (rank < k), minlength=n_users)
+        idcg = np.bincount(codes[ideal_order], weights=true_r[ideal_order] * ideal_discount * (ideal_rank < k), minlength=n_users)
+        ndcgs[k] = np.divide(dcg, idcg, out=np.zeros(n_users), where=idcg != 0)
+    return users, ndcgs
+
+
+def coverage_at_ks(uid, iid, est, n_items, ks=(3, 5, 10, 20)):
+    """Share of the n_items catalog items that are in the top k of at least one user, for every k in ks."""
+    codes, _ = pd.factorize(np.asarray(uid))
+    order, rank = _rank_by_user(codes, np.asarray(est, dtype=np.float64))
+    iid = np.asarray(iid)[order]
+    return {k: len(np.unique(iid[rank < k])) / n_items for k in ks}
+
+
+def error_metrics(true_r, est):
+    """MAE, MSE and RMSE like surprise.accuracy."""
+    errors = np.asarray(true_r, dtype=np.float64) - np.asarray(est, dtype=np.float64)
+    mse = float(np.mean(errors ** 2))
+    return {'mae': float(np.mean(np.abs(errors))), 'mse': mse, 'rmse': float(np.sqrt(mse))}
+
+
+def _mean(values):
+    # averaged over all users, 0 without users
+    return float(np.mean(values)) if len(values) else 0.0
+
+
+def _error(uid, iid, true_r, est, ks, threshold, n_items):
+    return {f'test_{name}': value for name, value in error_metrics(true_r, est).items()}
+
+
+def _precision_recall(uid, iid, true_r, est, ks, threshold, n_items):
+    _, precisions, recalls = precision_recall_at_ks(uid, true_r, est, ks, threshold)
+    result = {f'precision@{k}': _mean(precisions[k]) for k in ks}
+    result.update({f'recall@{k}': _mean(recalls[k]) for k in ks})
+    return result
+
+
+def _ndcg(uid, iid, true_r, est, ks, threshold, n_items):
+    _, ndcgs = ndcg_at_ks(uid, true_r, est, ks)
+    return {f'ndcg@{k}': _mean(ndcgs[k]) for k in ks}
+
+
+def _coverage(uid, iid, true_r, est, ks, threshold, n_items):
+    return {f'coverage@{k}': value for k, value in coverage_at_ks(uid, iid, est, n_items, ks).items()}
+
+
+# metric name -> function of the prediction arrays returning {result key: value}
+METRICS = {'error': _error, 'precision_recall': _precision_recall, 'ndcg': _ndcg, 'coverage': _coverage}
+
+
+def fold_metrics(predictions, metrics=tuple(METRICS), ks=(3, 5, 10, 20), threshold=3.5, n_items=None):
+    """All requested metrics of the predictions of one fold in one dict.
+
+    n_items (size of the catalog, e.g. trainset.n_items) is needed for coverage.
+    """
+    uid, iid, true_r, est = prediction_arrays(predictions)
+    result = {}
+    for name in metrics:
+        result.update(METRICS[name](uid, iid, true_r, est, ks, threshold, n_items))
+    return result
@@ -0,0 +1,100 @@
+"""Ratings partitioned by year for the interactive data exploration of the Streamlit app.
+
+The exploration page aggregates the ratings on the fly for the filters of the
+sidebar (genres, years, minimum number of ratings per movie), see
+streamlit_app/exploration_queries.py. This module writes the data it queries:
+
+- ratings_by_year/: the ratings (int32 userId, int32 movieId, float32 rating)
+  as Parquet dataset with one hive partition per year of the rating
+  (year=1995/, ..., year=2019/), sorted by movieId within a partition so that
+  the row group statistics prune movieId filters; a year range only reads its
+  partitions and a query only reads the columns it needs,
+- movies_dim.parquet: movieId, title, genres and the release year (from the
+  title) of every movie, the dimension the genre filter is resolved with.
+
+Usage from the command line (paths relative to the repository root):
+
+    python notebooks/exploration_data.py --raw-dir data/raw/ml-25m --output-dir data/dataframes
+"""
+import argparse
+import os
+import shutil
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.dataset as pads
+import pyarrow.parquet as pq
+
+RATINGS_DATASET = 'ratings_by_year'
+MOVIES_FILE = 'movies_dim.parquet'
+PARTITIONING = pads.partitioning(pa.schema([('year', pa.int16())]), flavor='hive')
+ROW_GROUP_SIZE = 128 * 1024
+
+
+def read_ratings(path, block_size=64 << 20):
+    """Record batches of ratings.csv with the year of the rating instead of the timestamp."""
+    reader = pv.open_csv(path, read_options=pv.ReadOptions(block_size=block_size),
+                         convert_options=pv.ConvertOptions(column_types={'userId': pa.int32(), 'movieId': pa.int32(),
+                                                                         'rating': pa.float32(), 'timestamp': pa.int64()}))
+    for batch in reader:
+        year = pc.cast(pc.year(pc.cast(batch.column('timestamp'), pa.timestamp('s'))), pa.int16())
+        yield pa.RecordBatch.from_arrays([batch.column('userId'), batch.column('movieId'), batch.column('rating'), year],
+                                         names=['userId', 'movieId', 'rating', 'year'])
+
+
+def write_ratings(batches, output_dir):
+    """Write rating batches (with year) as dataset partitioned by year, every partition sorted by movieId.
+
+    The dataset is written next to the old one and swapped in at the end, the
+    app never reads a partly written dataset.
+    """
+    path = os.path.join(output_dir, RATINGS_DATASET)
+    tmp_path = f'{path}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    batches = iter(batches)
+    first = next(batches)
+    pads.write_dataset(_chain(first, batches), tmp_path, schema=first.schema, format='parquet',
+                       partitioning=PARTITIONING, basename_template='part-{i}.parquet')
+    # sort every partition by movieId (one year is at most a few million ratings)
+    for partition in sorted(os.listdir(tmp_path)):
+        partition_dir = os.path.join(tmp_path, partition)
+        table = pads.dataset(partition_dir, format='parquet').to_table().sort_by('movieId')
+        shutil.rmtree(partition_dir)
+        os.makedirs(partition_dir)
+        pq.write_table(table, os.path.join(partition_dir, 'part-0.parquet'), row_group_size=ROW_GROUP_SIZE)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def _chain(first, batches):
+    yield first
+    yield from batches
+
+
+def movies_table(path):
+    """movieId, title, genres and release year (None if the title has none) of movies.csv."""
+    movies = pv.read_csv(path, convert_options=pv.ConvertOptions(column_types={'movieId': pa.int32()}))
+    year = pc.extract_regex(pc.utf8_trim_whitespace(movies.column('title')), r'\((?P<year>\d{4})\)$')
+    year = pc.cast(pc.struct_field(year, [0]), pa.int16())
+    return movies.select(['movieId', 'title', 'genres']).append_column('year', year)
+
+
+def run(raw_dir, output_dir):
+    """Write the partitioned ratings and the movies dimension of the MovieLens CSVs in raw_dir."""
+    os.makedirs(output_dir, exist_ok=True)
+    pq.write_table(movies_table(os.path.join(raw_dir, 'movies.csv')), os.path.join(output_dir, MOVIES_FILE))
+    write_ratings(read_ratings(os.path.join(raw_dir, 'ratings.csv')), output_dir)
+
+
+def main():
+    repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    parser = argparse.ArgumentParser(description='Write the ratings partitioned by year for the data exploration.')
+    parser.add_argument('--raw-dir', default=os.path.join(repo_dir, 'data', 'raw', 'ml-25m'))
+    parser.add_argument('--output-dir', default=os.path.join(repo_dir, 'data', 'dataframes'))
+    args = parser.parse_args()
+    run(args.raw_dir, args.output_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""Precomputed tables and figures of the Surprise model results for the Streamlit app.
+
+The models_classical and results pages used to rebuild their tables from the
+raw result files on every rerun (pd.concat in a loop over the models, renaming,
+groupby(...).agg(['mean', 'std'])) before drawing a chart. build_results() does
+this once, offline, from the tables surp_default_metrics (model, measure, value
+of the default models) and surp_cv_folds (see cross_validation.py) of the
+artifact store and writes into the same store:
+
+- surp_cv_summary: model, measure, mean, std, n_folds of the cross-validation
+- surp_precision_recall_summary: model, metric, k, mean, std of precision@k / recall@k
+- surp_figures.json: the Plotly figure specs of the models_classical page for
+  every combination of the sidebar options (metric, tuned results, sorting)
+
+The model names are the names of cross_validation.MODELS in all tables. The
+app loads the figures through data_access.figure(), so a change of a sidebar
+option only selects another cached figure.
+
+Usage from the command line (paths relative to the repository root):
+
+    python notebooks/model_results.py --results-dir data/models
+
+With --legacy-dir the pickled results of earlier runs in that folder are
+converted into the store first.
+"""
+import argparse
+import json
+import os
+
+import joblib
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+
+import artifacts
+import cross_validation
+
+LEGACY_DEFAULT_METRICS_FILE = 'surp_metrics_default_models.pkl'
+DEFAULT_METRICS_TABLE = 'surp_default_metrics'
+CV_SUMMARY_TABLE = 'surp_cv_summary'
+PRECISION_RECALL_TABLE = 'surp_precision_recall_summary'
+FIGURES_FILE = 'surp_figures.json'
+
+MEASURES = ('mae', 'mse', 'rmse')
+
+
+def default_metrics_table(default_metrics):
+    """Tidy table (model, measure, value) of the default metrics by model ({model: [mae, mse, rmse]})."""
+    return pd.DataFrame([{'model': model, 'measure': measure, 'value': float(value)}
+                         for model, values in default_metrics.items() for measure, value in zip(MEASURES, values)])
+
+
+def _is_at_k(column):
+    return column.startswith(('precision@', 'recall@'))
+
+
+def cv_summary_table(folds):
+    """Mean and standard deviation over the folds (model, measure, mean, std, n_folds) of the surp_cv_folds table."""
+    measures = [column for column in folds.columns if column not in ('model', 'fold') and not _is_at_k(column)]
+    long = folds.melt(id_vars='model', value_vars=measures, var_name='measure').dropna(subset='value')
+    summary = long.groupby(['model', 'measure'], sort=False)['value'].agg(['mean', 'std', 'count'])
+    return summary.rename(columns={'count': 'n_folds'}).reset_index()
+
+
+def precision_recall_table(folds):
+    """Mean and standard deviation over the folds (model, metric, k, mean, std) of precision@k / recall@k."""
+    long = folds.melt(id_vars='model', value_vars=[column for column in folds.columns if _is_at_k(column)],
+                      var_name='metric').dropna(subset='value')
+    long[['metric', 'k']] = long['metric'].str.split('@', expand=True)
+    long['k'] = long['k'].astype(int)
+    return long.groupby(['model', 'metric', 'k'], sort=False)['value'].agg(['mean', 'std']).reset_index()
+
+
+def _measure(cv_summary, measure):
+    return cv_summary[cv_summary['measure'] == measure].set_index('model')
+
+
+def default_metrics_figure(default_metrics):
+    """MAE, MSE and RMSE of the default models, sorted by MAE."""
+    values = default_metrics.pivot(index='model', columns='measure', values='value')
+    fig = go.Figure()
+    for measure in MEASURES:
+        fig.add_trace(go.Bar(x=values.index, y=values[measure], name=measure, orientation='v'))
+    fig.update_layout(xaxis_title='Model', yaxis_title='Error', legend=dict(x=0, y=1))
+    fig.update_xaxes(categoryorder='array', categoryarray=values['mae'].sort_values().index)
+    return fig
+
+
+def cv_results_figure(default_metrics, cv_summary, metric, tuned):
+    """Error of the default models and, if tuned, the cross-validated error of the tuned models, sorted by the latter."""
+    default = default_metrics[default_metrics['measure'] == metric].set_index('model')['value']
+    test = _measure(cv_summary, f'test_{metric}')
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=default.index, y=default, name=f'{metric} before optimization', orientation='v'))
+    if tuned:
+        fig.add_trace(go.Bar(x=test.index, y=test['mean'], error_y=dict(type='data', array=test['std'], visible=True),
+                             name=f'average {metric} after optimization (cv=5)', orientation='v'))
+    fig.update_layout(xaxis_title='Model', yaxis_title='Error', legend=dict(x=0, y=1))
+    fig.update_xaxes(categoryorder='array', categoryarray=test['mean'].sort_values().index)
+    return fig
+
+
+def cv_times_figure(cv_summary, sorting):
+    """Test and fit time of the tuned models, sorted by the mean of the measure sorting."""
+    fig = go.Figure()
+    for measure, name in [('test_time', 'test time'), ('fit_time', 'fit time')]:
+        times = _measure(cv_summary, measure)
+        fig.add_trace(go.Bar(x=times.index, y=times['mean'], error_y=dict(type='data', array=times['std'], visible=True),
+                             name=name, orientation='v'))
+    fig.update_layout(xaxis_title='Model', yaxis_title='t [s]', legend=dict(x=0, y=1))
+    fig.update_xaxes(categoryorder='array', categoryarray=_measure(cv_summary, sorting)['mean'].sort_values().index)
+    return fig
+
+
+def at_k_figure(precision_recall, metric):
+    """precision@k or recall@k of the tuned models for all k, sorted by decreasing value at the smallest k."""
+    values = precision_recall[precision_recall['metric'] == metric]
+    fig = go.Figure()
+    for k, by_k in values.groupby('k'):
+        fig.add_trace(go.Bar(x=by_k['model'], y=by_k['mean'], error_y=dict(type='data', array=by_k['std'], visible=True),
+                             name=f'k = {k}', orientation='v'))
+    fig.update_layout(xaxis_title='Model', yaxis_title=f'{metric.capitalize()}@k', autosize=False, width=1000, height=400,
+                      legend=dict(orientation='h', xanchor='center', x=0.5, yanchor='bottom', y=1.05))
+    first = values[values['k'] == values['k'].min()]
+    fig.update_xaxes(categoryorder='array', categoryarray=first.sort_values('mean', ascending=False)['model'],
+                     tickangle=30 if metric == 'precision' else None)
+    return fig
+
+
+def figures(default_metrics, cv_summary, precision_recall):
+    """(name, options, figure) of the models_classical page for all combinations of the sidebar options."""
+    yield 'default_metrics', {}, default_metrics_figure(default_metrics)
+    for metric in MEASURES:
+        for tuned in (False, True):
+            yield 'cv_results', {'metric': metric, 'tuned': tuned}, cv_results_figure(default_metrics, cv_summary, metric, tuned)
+    for sorting in [f'test_{metric}' for metric in MEASURES] + ['fit_time', 'test_time']:
+        yield 'cv_times', {'sorting': sorting}, cv_times_figure(cv_summary, sorting)
+    for metric in ('precision', 'recall'):
+        yield f'{metric}_at_k', {}, at_k_figure(precision_recall, metric)
+
+
+def convert_legacy(legacy_dir, store_dir):
+    """Write the pickled default metrics and cv results of legacy_dir as tables of the store."""
+    default_metrics = joblib.load(os.path.join(legacy_dir, LEGACY_DEFAULT_METRICS_FILE))
+    artifacts.write_table(store_dir, DEFAULT_METRICS_TABLE, default_metrics_table(default_metrics),
+                          metadata={'source': 'legacy'})
+    cross_validation.convert_legacy(legacy_dir, store_dir)
+
+
+def build_results(results_dir):
+    """Write the summary tables and figure specs of the results in the store results_dir, returns their names."""
+    default_metrics = artifacts.read_table(results_dir, DEFAULT_METRICS_TABLE)
+    folds = artifacts.read_table(results_dir, cross_validation.FOLDS_TABLE)
+    cv_summary = cv_summary_table(folds)
+    precision_recall = precision_recall_table(folds)
+
+    # the summaries belong to the ratings of the folds
+    dataset_hash = artifacts.read_manifest(results_dir)['tables'][cross_validation.FOLDS_TABLE]['dataset_hash']
+    for name, table in [(CV_SUMMARY_TABLE, cv_summary), (PRECISION_RECALL_TABLE, precision_recall)]:
+        artifacts.write_table(results_dir, name, table, dataset_hash)
+
+    specs = []
+    for name, options, fig in figures(default_metrics, cv_summary, precision_recall):
+        spec = json.loads(pio.to_json(fig))
+        # the default template is applied again when the figure is created, no need to store it with every figure
+        spec['layout'].pop('template', None)
+        specs.append({'figure': name, 'options': options, 'spec': spec})
+    with open(os.path.join(results_dir, FIGURES_FILE), 'w') as f:
+        json.dump(specs, f)
+    return [CV_SUMMARY_TABLE, PRECISION_RECALL_TABLE, FIGURES_FILE]
+
+
+def main():
+    repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    parser = argparse.ArgumentParser(description='Precompute the tables and figures of the Surprise model results.')
+    parser.add_argument('--results-dir', default=os.path.join(repo_dir, 'data', 'models'))
+    parser.add_argument('--legacy-dir', default=None, help='folder with pickled results to convert first')
+    args = parser.parse_args()
+
+    if args.legacy_dir:
+        convert_legacy(args.legacy_dir, args.results_dir)
+    for file in build_results(args.results_dir):
+        print(f'written {file} to {args.results_dir}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""Sharded, memory-mapped training data and streaming tf.data input for the NCF models.
+
+Replaces the in-memory preparation of ML_all_features.ipynb and
+ML_find_hypterparameters.ipynb (userId / movieId mapped through Python dicts,
+the tag embedding and genre columns copied onto every rating row, several
+NumPy copies passed to model.fit):
+
+1. write_shards() factorizes userId and movieId to contiguous int32 codes in one
+   vectorized pass, shuffles the ratings (seeded), splits them into train /
+   validation / test and writes every split as shards of records
+   (int32 user, int32 item, float32 rating, 12 bytes per rating) in .npy files
+   that are read memory-mapped. The movie features (tag embedding and genres
+   of embeddings.movie_feature_block) are stored once per movie, in the order
+   of the item codes.
+2. make_dataset() streams a split with tf.data: the shards are read in
+   parallel (interleave) in blocks, shuffled, batched and the movie features
+   are gathered from the per-movie table by item code inside the pipeline,
+   then prefetched. Only the shards' pages in use and the per-movie table are
+   in memory, so the full 25M ratings can be used for training.
+
+The batches are dicts keyed by the input names of the NCF models ('user_input',
+'item_input', 'additional_features_input') and the ratings as targets, so they
+can be passed to model.fit directly.
+
+Usage from the command line (paths relative to the repository root):
+
+    python notebooks/ncf_data.py --data-dir data/processed --output-dir data/processed/ncf
+"""
+import argparse
+import json
+import os
+from itertools import count
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+import dataprep
+import embeddings
+
+MANIFEST_FILE = 'manifest.json'
+USERS_FILE = 'users.npy'
+MOVIES_FILE = 'movies.npy'
+MOVIE_FEATURES_FILE = 'movie_features.npy'
+SPLITS = ('train', 'validation', 'test')
+
+# one rating on disk
+RECORD = np.dtype([('user', '<i4'), ('item', '<i4'), ('rating', '<f4')])
+
+
+def split_sizes(n_ratings, test_size=0.25, validation_size=0.1):
+    """Number of ratings per split, validation_size is the share of the ratings that are not in the test split."""
+    n_test = int(np.ceil(n_ratings * test_size))
+    n_validation = int(np.ceil((n_ratings - n_test) * validation_size))
+    return dict(zip(SPLITS, (n_ratings - n_test - n_validation, n_validation, n_test)))
+
+
+def write_shards(data_dir, output_dir, test_size=0.25, validation_size=0.1, rows_per_shard=1_000_000, seed=42,
+                 movie_features=True):
+    """Write the ratings of data_dir as shuffled, sharded record files to output_dir and return the manifest."""
+    os.makedirs(output_dir, exist_ok=True)
+    df = dataprep.read_ratings(data_dir, columns=['userId', 'movieId', 'rating'])
+    users, user_ids = pd.factorize(df['userId'], sort=True)
+    items, movie_ids = pd.factorize(df['movieId'], sort=True)
+    ratings = df['rating'].to_numpy(dtype=np.float32)
+    del df
+    np.save(os.path.join(output_dir, USERS_FILE), np.asarray(user_ids, dtype=np.int32))
+    np.save(os.path.join(output_dir, MOVIES_FILE), np.asarray(movie_ids, dtype=np.int32))
+
+    manifest = {'n_users': len(user_ids), 'n_items': len(movie_ids), 'seed': seed, 'n_features': 0, 'splits': {}}
+    if movie_features:
+        block_movie_ids, block, names = embeddings.movie_feature_block(data_dir)
+        features = embeddings.gather_features(block_movie_ids, block, np.asarray(movie_ids))
+        np.save(os.path.join(output_dir, MOVIE_FEATURES_FILE), features)
+        manifest.update(n_features=features.shape[1], feature_names=list(names))
+
+    # shuffled once here, so every shard and every block of a shard is a random sample
+    order = np.random.default_rng(seed).permutation(len(ratings))
+    start = 0
+    for split, n_rows in split_sizes(len(ratings), test_size, validation_size).items():
+        shards = []
+        for shard, shard_start in enumerate(range(start, start + n_rows, rows_per_shard)):
+            index = order[shard_start:min(shard_start + rows_per_shard, start + n_rows)]
+            file = f'{split}-{shard:05d}.npy'
+            records = np.lib.format.open_memmap(os.path.join(output_dir, file), mode='w+', dtype=RECORD, shape=(len(index),))
+            records['user'], records['item'], records['rating'] = users[index], items[index], ratings[index]
+            records.flush()
+            del records
+            shards.append({'file': file, 'n_rows': len(index)})
+        manifest['splits'][split] = {'n_rows': n_rows, 'shards': shards}
+        start += n_rows
+
+    with open(os.path.join(output_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def read_manifest(ncf_dir):
+    """Manifest written by write_shards (number of users / items / features and the shards of every split)."""
+    with open(os.path.join(ncf_dir, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def read_ids(ncf_dir):
+    """Raw userIds and movieIds by user / item code."""
+    return np.load(os.path.join(ncf_dir, USERS_FILE)), np.load(os.path.join(ncf_dir, MOVIES_FILE))
+
+
+def read_movie_features(ncf_dir, mmap=False):
+    """Movie features by item code (items x features float32)."""
+    return np.load(os.path.join(ncf_dir, MOVIE_FEATURES_FILE), mmap_mode='r' if mmap else None)
+
+
+def _n_rows(n_rows, fraction):
+    return n_rows if fraction >= 1 else int(np.ceil(n_rows * fraction))
+
+
+def read_split(ncf_dir, split, fraction=1.0):
+    """Records (user, item, rating) of a split as one array, e.g. the test ratings for model.predict.
+
+    With fraction < 1 only the first share of every shard is read.
+    """
+    shards = read_manifest(ncf_dir)['splits'][split]['shards']
+    return np.concatenate([np.load(os.path.join(ncf_dir, shard['file']), mmap_mode='r')[:_n_rows(shard['n_rows'], fraction)]
+                           for shard in shards])
+
+
+def rating_history(ncf_dir, splits=('train', 'validation')):
+    """Rated movies per user in the given splits as (users x items) CSR matrix of ones, e.g. to mask them in top-N lists."""
+    manifest = read_manifest(ncf_dir)
+    records = np.concatenate([read_split(ncf_dir, split) for split in splits])
+    history = sp.csr_matrix((np.ones(len(records), dtype=np.int8), (records['user'], records['item'])),
+                            shape=(manifest['n_users'], manifest['n_items']))
+    history.sum_duplicates()
+    history.data[:] = 1
+    return history
+
+
+def model_inputs(records, movie_features=None):
+    """Input dict of the NCF models for records of read_split (with the gathered movie features if given)."""
+    inputs = {'user_input': np.ascontiguousarray(records['user']), 'item_input': np.ascontiguousarray(records['item'])}
+    if movie_features is not None:
+        inputs['additional_features_input'] = movie_features[inputs['item_input']]
+    return inputs
+
+
+def _shard_blocks(path, n_rows, block_size, shuffle, seed):
+    """Blocks of a shard (user, item, rating arrays) read from the memory map, in random order if shuffle."""
+    records = np.load(path, mmap_mode='r')
+    starts = np.arange(0, n_rows, block_size)
+    if shuffle:
+        np.random.default_rng(seed).shuffle(starts)
+    for start in starts:
+        block = np.array(records[start:min(start + block_size, n_rows)])
+        yield np.ascontiguousarray(block['user']), np.ascontiguousarray(block['item']), np.ascontiguousarray(block['rating'])
+
+
+def make_dataset(ncf_dir, split, batch_size=256, shuffle=True, features=True, fraction=1.0, block_size=4096,
+                 shuffle_buffer=65536, cycle_length=4, seed=42):
+    """tf.data.Dataset of (inputs dict, ratings) batches streamed from the shards of a split.
+
+    The shards are read cycle_length at a time in parallel blocks of block_size
+    ratings; with shuffle=True the shard and block order changes every epoch
+    and the ratings are shuffled in a buffer of shuffle_buffer. fraction < 1
+    only uses the first share of every shard (a random sample, since the
+    ratings were shuffled when they were written), e.g. for hyperparameter
+    searches. features=True adds the movie features of the rated movies.
+    With shuffle=False the batches are in the order of read_split, e.g. to
+    compare model.predict(dataset) with its ratings.
+    """
+    import tensorflow as tf
+
+    manifest = read_manifest(ncf_dir)
+    shards = manifest['splits'][split]['shards']
+    paths = [os.path.join(ncf_dir, shard['file']) for shard in shards]
+    n_rows = [_n_rows(shard['n_rows'], fraction) for shard in shards]
+    calls = count()
+    signature = (tf.TensorSpec([None], tf.int32), tf.TensorSpec([None], tf.int32), tf.TensorSpec([None], tf.float32))
+
+    def shard_blocks(shard):
+        # a different block order for every epoch (every call of the generator)
+        shard = int(shard)
+        return _shard_blocks(paths[shard], n_rows[shard], block_size, shuffle, [seed, shard, next(calls)])
+
+    dataset = tf.data.Dataset.range(len(shards))
+    if shuffle:
+        dataset = dataset.shuffle(len(shards), seed=seed, reshuffle_each_iteration=True)
+    # without shuffling one shard after the other, so that the ratings are in the order of read_split
+    dataset = dataset.interleave(lambda shard: tf.data.Dataset.from_generator(shard_blocks, output_signature=signature, args=(shard,)),
+                                 cycle_length=cycle_length if shuffle else 1, num_parallel_calls=tf.data.AUTOTUNE,
+                                 deterministic=not shuffle)
+    dataset = dataset.unbatch()
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+
+    movie_features = tf.constant(read_movie_features(ncf_dir)) if features and manifest['n_features'] else None
+
+    def to_inputs(user, item, rating):
+        inputs = {'user_input': user, 'item_input': item}
+        if movie_features is not None:
+            # per-movie table lookup instead of features stored on every rating
+            inputs['additional_features_input'] = tf.gather(movie_features, item)
+        return inputs, rating
+
+    return dataset.map(to_inputs, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+
+
+def steps_per_epoch(ncf_dir, split, batch_size=256, fraction=1.0):
+    """Number of batches of make_dataset for a split."""
+    shards = read_manifest(ncf_dir)['splits'][split]['shards']
+    return int(np.ceil(sum(_n_rows(shard['n_rows'], fraction) for shard in shards) / batch_size))
+
+
+def main():
+    repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    parser = argparse.ArgumentParser(description='Write the ratings as sharded, memory-mapped NCF training data.')
+    parser.add_argument('--data-dir', default=os.path.join(repo_dir, 'data', 'processed'))
+    parser.add_argument('--output-dir', default=os.path.join(repo_dir, 'data', 'processed', 'ncf'))
+    parser.add_argument('--test-size', type=float, default=0.25)
+    parser.add_argument('--validation-size', type=float, default=0.1, help='share of the non-test ratings')
+    parser.add_argument('--rows-per-shard', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-features', action='store_true', help='do not store the movie features')
+    args = parser.parse_args()
+
+    manifest = write_shards(args.data_dir, args.output_dir, args.test_size, args.validation_size, args.rows_per_shard,
+                            args.seed, not args.no_features)
+    print({split: info['n_rows'] for split, info in manifest['splits'].items()}, f'ratings written to {args.output_dir}')
+
+
+if __name__ == '__main__':
+    main()
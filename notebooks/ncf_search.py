@@ -0,0 +1,397 @@
+"""Early-stopping, parallel hyperparameter search for the NCF models.
+
+Replaces the ParameterSampler loop of ML_find_hypterparameters.ipynb (10
+configurations trained one after another for 30 epochs each) with
+asynchronous successive halving (ASHA) and Hyperband:
+
+- n_trials configurations are sampled from the param_distributions of a JSON
+  spec (see ncf_search_spec.json): lists are sampled uniformly, ranges like
+  {"loguniform": [0.0001, 0.01]} log-uniformly. The model family is
+  create_model(), the NCF network of the notebooks with a variable number of
+  dense layers and optional movie features.
+- Every trial is trained in rungs of min_epochs, min_epochs * eta, ... up to
+  max_epochs epochs. Whenever a worker is free, the best 1 / eta of the trials
+  that reached a rung (by their lowest validation loss so far) are promoted to
+  the next rung, otherwise a new trial is started. Bad trials are stopped after
+  a few epochs without waiting for the other trials of their rung.
+- 'hyperband' runs several of these rung ladders (brackets) with later first
+  rungs side by side, the trials are assigned to the brackets in turn.
+  'asha' only uses the most aggressive bracket.
+
+The jobs (trial, rung) run in a process pool. Every worker process uses a fixed
+number of TensorFlow threads (threads_per_worker) and is pinned to its own CPU
+cores, so that the workers do not compete for them. The workers stream the
+training data with ncf_data.make_dataset (a fraction of the ratings).
+
+The learning curve of every trial (loss and val_loss per epoch) is appended to
+a JSON lines store when a job is finished, and the model is checkpointed. A
+rerun with the same store continues the search from the store and the
+checkpoints, only the running jobs are lost.
+
+At the end the SearchResult (best_params / best_score and the learning curves)
+is written to the artifact store in output_dir (see artifacts.py): all trials
+to the table ncf_search_trials, the best trial with its checkpoint to
+ncf_best_params and the learning curves to ncf_search_curves, parameters as
+JSON strings. Reading them needs no unpickling.
+
+Usage from the command line (in the notebooks folder):
+
+    python ncf_search.py ncf_search_spec.json --n-jobs 4
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+import artifacts
+import ncf_data
+
+STRATEGIES = ('asha', 'hyperband')
+
+# settings of the worker process, set by _init_worker
+_shared = {}
+
+
+class SearchResult:
+    """Result of an NCF search.
+
+    trials holds params, bracket, trained epochs and best validation loss of
+    every trial, curves the learning curves (dict of trial -> list of
+    (epoch, loss, val_loss)). best_params / best_score belong to the trial with
+    the lowest validation loss among the trials trained longest, its model
+    after best_epochs epochs is saved at best_checkpoint.
+    """
+
+    def __init__(self, name, trials, curves, best_checkpoint=None):
+        self.name = name
+        self.trials = trials
+        self.curves = curves
+        max_epochs = max(trial['epochs'] for trial in trials)
+        best = min((trial for trial in trials if trial['epochs'] == max_epochs), key=lambda trial: trial['best_val_loss'])
+        self.best_trial = best['trial']
+        self.best_epochs = best['epochs']
+        self.best_params = best['params']
+        self.best_score = best['best_val_loss']
+        self.best_checkpoint = best_checkpoint
+
+
+def create_model(n_users, n_items, n_features=0, embedding_dim=20, dropout_rate=0.2, dense_units=64, n_layers=3,
+                 learning_rate=0.001, regularization=0.01, features=False):
+    """NCF model of the notebooks: user / item embeddings (and movie features) into n_layers dense layers.
+
+    The dense layers have dense_units, dense_units // 2, ... units with dropout
+    in between, n_layers=3 is the network of ML_find_hypterparameters.ipynb.
+    """
+    from tensorflow.keras.layers import Concatenate, Dense, Dropout, Embedding, Flatten, Input
+    from tensorflow.keras.models import Model
+    from tensorflow.keras.optimizers import Adam
+    from tensorflow.keras.regularizers import l2
+
+    user_input = Input(shape=(1,), name='user_input')
+    item_input = Input(shape=(1,), name='item_input')
+    inputs = [user_input, item_input]
+
+    user_embedding = Embedding(input_dim=n_users, output_dim=embedding_dim, name='user_embedding', embeddings_regularizer=l2(regularization))(user_input)
+    item_embedding = Embedding(input_dim=n_items, output_dim=embedding_dim, name='item_embedding', embeddings_regularizer=l2(regularization))(item_input)
+    concat = [Flatten()(user_embedding), Flatten()(item_embedding)]
+    if features:
+        additional_features_input = Input(shape=(n_features,), name='additional_features_input')
+        inputs.append(additional_features_input)
+        concat.append(additional_features_input)
+
+    hidden = Concatenate()(concat)
+    for layer in range(n_layers):
+        hidden = Dense(max(1, dense_units // 2 ** layer), activation='relu')(hidden)
+        if layer < n_layers - 1:
+            hidden = Dropout(dropout_rate)(hidden)
+    output = Dense(1)(hidden)
+
+    model = Model(inputs=inputs, outputs=output)
+    model.compile(optimizer=Adam(learning_rate=learning_rate), loss='mae')
+    return model
+
+
+def sample_params(param_distributions, trial, seed=42):
+    """Parameters of a trial, drawn from the distributions with a seed of its own (same for every run)."""
+    rng = np.random.default_rng([seed, trial])
+    params = {}
+    for name, distribution in param_distributions.items():
+        if isinstance(distribution, dict) and 'loguniform' in distribution:
+            low, high = distribution['loguniform']
+            params[name] = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+        elif isinstance(distribution, dict) and 'uniform' in distribution:
+            params[name] = float(rng.uniform(*distribution['uniform']))
+        else:
+            # plain Python values for the JSON store
+            params[name] = distribution[rng.integers(len(distribution))]
+    return params
+
+
+def brackets(spec):
+    """Rungs (epochs) of every bracket, the most aggressive bracket first."""
+    min_epochs, max_epochs, eta = spec['min_epochs'], spec['max_epochs'], spec['eta']
+    n_brackets = int(math.floor(math.log(max_epochs / min_epochs, eta) + 1e-9)) + 1
+    if spec['strategy'] == 'asha':
+        n_brackets = 1
+    result = []
+    for bracket in range(n_brackets):
+        epochs = min_epochs * eta ** bracket
+        rungs = []
+        while epochs < max_epochs:
+            rungs.append(int(round(epochs)))
+            epochs *= eta
+        result.append(rungs + [max_epochs])
+    return result
+
+
+def read_store(path):
+    """Learning curve records of the store by trial (a truncated last line from a crash is ignored)."""
+    curves = {}
+    if not os.path.exists(path):
+        return curves
+    with open(path, 'rb+') as f:
+        content = f.read()
+        if content and not content.endswith(b'\n'):
+            # drop the incomplete last line, later records are appended after it
+            f.truncate(content.rfind(b'\n') + 1)
+    for line in content.decode().splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        curves.setdefault(record['trial'], {})[record['epoch']] = record
+    return curves
+
+
+def append_records(path, records):
+    """Append records to the store and flush them to disk."""
+    with open(path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def checkpoint_path(checkpoint_dir, trial, epochs):
+    """Checkpoint of a trial after the given number of epochs."""
+    return os.path.join(checkpoint_dir, f'trial_{trial:04d}_epoch_{epochs:03d}.keras')
+
+
+def _init_worker(ncf_dir, threads, cores):
+    # pin the worker to its own cores and TensorFlow to as many threads, before TensorFlow is imported
+    core_set = cores.get() if cores is not None else None
+    if core_set and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, core_set)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    _shared.update(ncf_dir=ncf_dir, manifest=ncf_data.read_manifest(ncf_dir))
+
+
+def _train(trial, params, start_epoch, stop_epoch, checkpoint_dir, fraction, batch_size, seed):
+    import tensorflow as tf
+
+    ncf_dir, manifest = _shared['ncf_dir'], _shared['manifest']
+    features = bool(params.get('features', False))
+    train = ncf_data.make_dataset(ncf_dir, 'train', batch_size, features=features, fraction=fraction, seed=seed + trial)
+    validation = ncf_data.make_dataset(ncf_dir, 'validation', batch_size, shuffle=False, features=features, fraction=fraction)
+    if start_epoch:
+        model = tf.keras.models.load_model(checkpoint_path(checkpoint_dir, trial, start_epoch))
+    else:
+        tf.keras.utils.set_random_seed(seed + trial)
+        model = create_model(manifest['n_users'], manifest['n_items'], manifest['n_features'], **params)
+    start = time.perf_counter()
+    history = model.fit(train, validation_data=validation, epochs=stop_epoch, initial_epoch=start_epoch, verbose=0)
+    fit_time = time.perf_counter() - start
+    model.save(checkpoint_path(checkpoint_dir, trial, stop_epoch))
+    return [{'trial': trial, 'params': params, 'epoch': start_epoch + i + 1, 'loss': float(loss),
+             'val_loss': float(val_loss), 'epoch_time': fit_time / len(history.history['loss'])}
+            for i, (loss, val_loss) in enumerate(zip(history.history['loss'], history.history['val_loss']))]
+
+
+class _Scheduler:
+    """ASHA promotions over the brackets, from the learning curves of the trials."""
+
+    def __init__(self, spec, curves):
+        self.spec = spec
+        self.brackets = brackets(spec)
+        self.curves = curves # trial -> {epoch: record}
+        self.running = set()
+        # trials are started in order, the trials in the store continue and the ones
+        # that were started without finishing a job start again
+        self.n_started = max(curves, default=-1) + 1
+        self.restart = [trial for trial in range(self.n_started) if trial not in curves]
+
+    def epochs(self, trial):
+        return max(self.curves.get(trial, {0: None}))
+
+    def score(self, trial, epochs):
+        # lowest validation loss up to the rung, like np.min(history['val_loss'])
+        return min(record['val_loss'] for epoch, record in self.curves[trial].items() if epoch <= epochs)
+
+    def next_job(self):
+        """(trial, start epoch, stop epoch) of the next job, None if there is none right now."""
+        eta = self.spec['eta']
+        for bracket, rungs in enumerate(self.brackets):
+            trials = range(bracket, self.n_started, len(self.brackets))
+            # promotions from the highest rung down
+            for rung in reversed(range(len(rungs) - 1)):
+                reached = sorted((trial for trial in trials if self.epochs(trial) >= rungs[rung]),
+                                 key=lambda trial: self.score(trial, rungs[rung]))
+                for trial in reached[:len(reached) // eta]:
+                    if trial not in self.running and self.epochs(trial) == rungs[rung]:
+                        return trial, rungs[rung], rungs[rung + 1]
+        if self.restart or self.n_started < self.spec['n_trials']:
+            if self.restart:
+                trial = self.restart.pop(0)
+            else:
+                trial = self.n_started
+                self.n_started += 1
+            return trial, 0, self.brackets[trial % len(self.brackets)][0]
+        return None
+
+    def trials(self):
+        """Summary of all trials for the SearchResult."""
+        return [{'trial': trial, 'params': next(iter(curve.values()))['params'], 'bracket': trial % len(self.brackets),
+                 'epochs': max(curve), 'best_val_loss': min(record['val_loss'] for record in curve.values())}
+                for trial, curve in sorted(self.curves.items())]
+
+
+def result_tables(result):
+    """Tables of a SearchResult: the trials, the best trial and the learning curves."""
+    trials = pd.DataFrame([{'search': result.name, 'trial': trial['trial'], 'bracket': trial['bracket'],
+                            'epochs': trial['epochs'], 'best_val_loss': trial['best_val_loss'],
+                            'params': artifacts.to_json(trial['params'])} for trial in result.trials])
+    best = pd.DataFrame([{'search': result.name, 'trial': result.best_trial, 'epochs': result.best_epochs,
+                          'params': artifacts.to_json(result.best_params), 'score': float(result.best_score),
+                          'checkpoint': result.best_checkpoint}])
+    curves = pd.DataFrame([{'search': result.name, 'trial': trial, 'epoch': epoch, 'loss': loss, 'val_loss': val_loss}
+                           for trial, curve in sorted(result.curves.items()) for epoch, loss, val_loss in curve],
+                          columns=['search', 'trial', 'epoch', 'loss', 'val_loss'])
+    return trials, best, curves
+
+
+def write_result(result, output_dir, dataset_hash=None):
+    """Write a SearchResult to the artifact store, replacing earlier results of the same search."""
+    trials, best, curves = result_tables(result)
+    artifacts.update_table(output_dir, 'ncf_search_trials', trials, key='search', dataset_hash=dataset_hash)
+    artifacts.update_table(output_dir, 'ncf_best_params', best, key='search', dataset_hash=dataset_hash)
+    artifacts.update_table(output_dir, 'ncf_search_curves', curves, key='search', dataset_hash=dataset_hash)
+
+
+def run_search(spec, executor, curves):
+    """Run the search of the spec until no trial can be promoted or started any more."""
+    scheduler = _Scheduler(spec, curves)
+    futures = {}
+    while True:
+        # fill the free workers, then wait for the next finished job
+        while len(futures) < spec['n_jobs']:
+            job = scheduler.next_job()
+            if job is None:
+                break
+            trial, start_epoch, stop_epoch = job
+            params = sample_params(spec['param_distributions'], trial, spec['seed'])
+            future = executor.submit(_train, trial, params, start_epoch, stop_epoch, spec['checkpoint_dir'],
+                                     spec['fraction'], spec['batch_size'], spec['seed'])
+            futures[future] = job
+            scheduler.running.add(trial)
+        if not futures:
+            break
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            trial, start_epoch, stop_epoch = futures.pop(future)
+            records = future.result()
+            append_records(spec['store'], records)
+            curves.setdefault(trial, {}).update({record['epoch']: record for record in records})
+            scheduler.running.discard(trial)
+            if start_epoch:
+                # the checkpoint of the previous rung is not needed any more
+                os.remove(checkpoint_path(spec['checkpoint_dir'], trial, start_epoch))
+            print(f"trial {trial}: epochs {start_epoch}-{stop_epoch}, val_loss {records[-1]['val_loss']:.4f}")
+    return scheduler.trials()
+
+
+def load_spec(path):
+    """Spec from a JSON file, relative paths in it are resolved relative to the file."""
+    with open(path) as f:
+        spec = json.load(f)
+    spec_dir = os.path.dirname(os.path.abspath(path))
+    for key in ('ncf_dir', 'output_dir', 'store', 'checkpoint_dir'):
+        spec[key] = os.path.join(spec_dir, spec[key])
+    spec.setdefault('name', 'ncf')
+    spec.setdefault('strategy', 'hyperband')
+    spec.setdefault('eta', 3)
+    spec.setdefault('seed', 42)
+    spec.setdefault('fraction', 1.0)
+    spec.setdefault('batch_size', 256)
+    spec.setdefault('threads_per_worker', 2)
+    return spec
+
+
+def _check_resume(spec, curves):
+    # trials whose last checkpoint is missing start again
+    for trial in list(curves):
+        if not os.path.exists(checkpoint_path(spec['checkpoint_dir'], trial, max(curves[trial]))):
+            del curves[trial]
+    return curves
+
+
+def run(spec, n_jobs=-1):
+    """Run the search of the spec and write its result to the artifact store."""
+    if spec['strategy'] not in STRATEGIES:
+        raise ValueError(f"unknown strategy '{spec['strategy']}', use one of {STRATEGIES}")
+    threads = spec['threads_per_worker']
+    n_cpus = os.cpu_count()
+    spec = dict(spec, n_jobs=max(1, n_cpus // threads) if n_jobs == -1 else n_jobs)
+    os.makedirs(spec['output_dir'], exist_ok=True)
+    os.makedirs(spec['checkpoint_dir'], exist_ok=True)
+    curves = _check_resume(spec, read_store(spec['store']))
+
+    # spawn: the workers import TensorFlow themselves, also if the parent (e.g. a notebook) already did
+    context = multiprocessing.get_context('spawn')
+    cores = context.Queue()
+    for worker in range(spec['n_jobs']):
+        cores.put([core % n_cpus for core in range(worker * threads, (worker + 1) * threads)])
+    with ProcessPoolExecutor(max_workers=spec['n_jobs'], mp_context=context, initializer=_init_worker,
+                             initargs=(spec['ncf_dir'], threads, cores)) as executor:
+        trials = run_search(spec, executor, curves)
+
+    curves = {trial: [(epoch, record['loss'], record['val_loss']) for epoch, record in sorted(curve.items())]
+              for trial, curve in curves.items()}
+    result = SearchResult(spec['name'], trials, curves)
+    result.best_checkpoint = checkpoint_path(spec['checkpoint_dir'], result.best_trial, result.best_epochs)
+    write_result(result, spec['output_dir'], artifacts.file_hash(os.path.join(spec['ncf_dir'], ncf_data.MANIFEST_FILE)))
+    print(result.best_score)
+    print(result.best_params)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Early-stopping hyperparameter search for the NCF models.')
+    parser.add_argument('spec', help='JSON search spec, e.g. ncf_search_spec.json')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='worker processes (-1: CPUs / threads_per_worker)')
+    parser.add_argument('--store', default=None, help='learning curve store, overrides the spec')
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec)
+    if args.store:
+        spec['store'] = args.store
+    run(spec, args.n_jobs)
+
+
+if __name__ == '__main__':
+    # run from the imported module, so that the jobs sent to the spawned workers refer to
+    # ncf_search._train and not to __main__
+    import ncf_search
+
+    ncf_search.main()
@@ -0,0 +1,155 @@
+"""Sparse user x movie rating matrix built directly from factorized ids.
+
+Replaces the chunked pivot_table / Sparse[float] pipeline of
+model_user_item_based_filtering.ipynb. The ratings are streamed from CSV or
+Parquet with compact dtypes, userId and movieId are mapped to contiguous
+indices and the matrix is assembled as scipy.sparse CSR (user x movie) plus its
+transpose (movie x user, the CSC layout of the same data stored as CSR).
+
+Usage from the command line (paths relative to the repository root):
+
+    python notebooks/ratings_matrix.py data/raw/ml-25m/ratings.csv data/processed/ratings_matrix
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+RATING_COLUMNS = ['userId', 'movieId', 'rating']
+RATING_DTYPES = {'userId': np.int32, 'movieId': np.int32, 'rating': np.float32}
+
+
+def read_ratings(path, chunksize=5_000_000):
+    """Yield (userId, movieId, rating) array chunks from a CSV or Parquet file."""
+    if path.endswith('.parquet') or '.parquet.' in path:
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=RATING_COLUMNS):
+            yield tuple(batch.column(col).to_numpy().astype(RATING_DTYPES[col], copy=False) for col in RATING_COLUMNS)
+    else:
+        for chunk in pd.read_csv(path, usecols=RATING_COLUMNS, dtype=RATING_DTYPES, chunksize=chunksize):
+            yield tuple(chunk[col].to_numpy() for col in RATING_COLUMNS)
+
+
+def factorize_ids(ids):
+    """Map non-negative integer ids to contiguous codes.
+
+    Returns (codes, vocabulary) with vocabulary sorted ascending, i.e. the same
+    order as the index/columns produced by pivot_table.
+    """
+    # lookup table over the id range instead of a hash map: O(n) and int32 throughout
+    present = np.zeros(int(ids.max()) + 1, dtype=bool)
+    present[ids] = True
+    vocabulary = np.flatnonzero(present).astype(np.int32)
+    lookup = (np.cumsum(present, dtype=np.int32) - 1)
+    return lookup[ids], vocabulary
+
+
+class RatingsMatrix:
+    """User x movie ratings as CSR matrix, its transpose and the id vocabularies."""
+
+    def __init__(self, user_item, item_user, user_ids, movie_ids):
+        self.user_item = user_item # CSR, rows = users, columns = movies
+        self.item_user = item_user # CSR, rows = movies, columns = users
+        self.user_ids = user_ids # raw userId per row of user_item
+        self.movie_ids = movie_ids # raw movieId per row of item_user
+
+    @property
+    def shape(self):
+        return self.user_item.shape
+
+    @staticmethod
+    def _index(ids, raw_id, kind):
+        # searchsorted gives the insertion point of unknown ids, i.e. the row of another id
+        i = int(np.searchsorted(ids, raw_id))
+        if i == len(ids) or ids[i] != raw_id:
+            raise KeyError(f'unknown {kind} {raw_id}')
+        return i
+
+    def user_index(self, user_id):
+        """Row index of a raw userId (KeyError if unknown)."""
+        return self._index(self.user_ids, user_id, 'user')
+
+    def movie_index(self, movie_id):
+        """Row index (in item_user) of a raw movieId (KeyError if unknown)."""
+        return self._index(self.movie_ids, movie_id, 'movie')
+
+    def save(self, path):
+        """Save matrices and vocabularies as .npz files in directory path."""
+        os.makedirs(path, exist_ok=True)
+        # uncompressed on purpose: loading is then a plain read of the arrays
+        sp.save_npz(os.path.join(path, 'user_item.npz'), self.user_item, compressed=False)
+        sp.save_npz(os.path.join(path, 'item_user.npz'), self.item_user, compressed=False)
+        np.savez(os.path.join(path, 'vocabulary.npz'), user_ids=self.user_ids, movie_ids=self.movie_ids)
+
+    @classmethod
+    def load(cls, path):
+        """Load a RatingsMatrix saved with save()."""
+        vocabulary = np.load(os.path.join(path, 'vocabulary.npz'))
+        return cls(sp.load_npz(os.path.join(path, 'user_item.npz')).tocsr(),
+                   sp.load_npz(os.path.join(path, 'item_user.npz')).tocsr(),
+                   vocabulary['user_ids'], vocabulary['movie_ids'])
+
+
+def from_arrays(user_ids, movie_ids, ratings):
+    """Build a RatingsMatrix from raw userId, movieId and rating arrays.
+
+    Every (userId, movieId) pair is expected once, as in MovieLens; duplicates
+    would be summed by scipy.
+    """
+    rows, user_vocabulary = factorize_ids(np.asarray(user_ids))
+    cols, movie_vocabulary = factorize_ids(np.asarray(movie_ids))
+    shape = (len(user_vocabulary), len(movie_vocabulary))
+    user_item = sp.csr_matrix((np.asarray(ratings, dtype=np.float32), (rows, cols)), shape=shape)
+    user_item.sum_duplicates()
+    # transposing a CSR matrix gives its CSC twin without copying, converting that
+    # to CSR lays out the data movie by movie for fast row access
+    item_user = user_item.T.tocsr()
+    return RatingsMatrix(user_item, item_user, user_vocabulary, movie_vocabulary)
+
+
+def from_frame(df):
+    """Build a RatingsMatrix from a DataFrame with userId, movieId and rating columns."""
+    return from_arrays(df['userId'].to_numpy(np.int32), df['movieId'].to_numpy(np.int32), df['rating'].to_numpy(np.float32))
+
+
+def from_file(path, chunksize=5_000_000):
+    """Build a RatingsMatrix by streaming a ratings CSV or Parquet file."""
+    users, movies, ratings = [], [], []
+    for user_chunk, movie_chunk, rating_chunk in read_ratings(path, chunksize):
+        users.append(user_chunk)
+        movies.append(movie_chunk)
+        ratings.append(rating_chunk)
+    return from_arrays(np.concatenate(users), np.concatenate(movies), np.concatenate(ratings))
+
+
+def row_means(matrix):
+    """Mean of the stored entries per row (0 for empty rows)."""
+    counts = np.diff(matrix.indptr)
+    sums = np.asarray(matrix.sum(axis=1)).ravel()
+    return np.divide(sums, counts, out=np.zeros(matrix.shape[0]), where=counts != 0).astype(np.float32)
+
+
+def center_rows(matrix):
+    """Subtract each row's mean from its stored entries, missing entries stay 0."""
+    centered = matrix.copy()
+    centered.data -= np.repeat(row_means(matrix), np.diff(matrix.indptr))
+    return centered
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the sparse user x movie rating matrix.')
+    parser.add_argument('ratings', help='ratings.csv or a Parquet file with userId, movieId, rating')
+    parser.add_argument('output', help='directory for the .npz files')
+    parser.add_argument('--chunksize', type=int, default=5_000_000)
+    args = parser.parse_args()
+
+    ratings_matrix = from_file(args.ratings, args.chunksize)
+    ratings_matrix.save(args.output)
+    print(f'{ratings_matrix.shape[0]} users x {ratings_matrix.shape[1]} movies, '
+          f'{ratings_matrix.user_item.nnz} ratings saved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+"""Blockwise top-k similarity between the rows of a sparse rating matrix.
+
+The dense item x item (or user x user) similarity matrix does not fit in
+memory for the full MovieLens data, so the rows are processed in blocks: for
+each block the co-rating statistics against all other rows are computed with
+sparse matrix products, turned into similarities and only the k most similar
+neighbours per row are kept (int32 indices, float32 similarities).
+
+The similarity measures follow the definitions of the Surprise library, i.e.
+all sums run over the common ratings of two rows only:
+
+- 'cosine': sum(r_i * r_j) / sqrt(sum(r_i^2) * sum(r_j^2))
+- 'msd': 1 / (mean((r_i - r_j)^2) + 1)
+- 'pearson': Pearson correlation over the common ratings
+- 'adjusted_cosine': cosine after subtracting each column's mean (i.e. the
+  user mean for item similarities), see ratings_matrix.center_rows
+
+Pairs with less than min_support common ratings are not considered as
+neighbours. 'pearson_baseline' is not supported since it requires the
+baselines of a fitted Surprise model.
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+
+import ratings_matrix
+
+SIMILARITIES = ('cosine', 'msd', 'pearson', 'adjusted_cosine')
+
+# rough number of bytes needed per (block row x row) cell, i.e. up to six float64
+# co-rating statistics plus temporaries while turning them into similarities
+BYTES_PER_CELL = 96
+
+# matrices shared with the worker processes, set once per process by _init_worker
+_shared = {}
+
+
+class TopKNeighbours:
+    """The k most similar rows for every row of a rating matrix.
+
+    neighbours[i] holds the row indices of the neighbours of row i, sorted by
+    decreasing similarity, similarities[i] the corresponding values. Rows with
+    fewer than k neighbours are padded with index -1 and similarity 0.
+    ids maps row indices to raw ids (e.g. movieId).
+
+    Saved either as a single .npz file or, for large indexes, as a directory of
+    .npy files that is memory-mapped on load.
+    """
+
+    def __init__(self, neighbours, similarities, ids=None, name='cosine'):
+        self.neighbours = neighbours
+        self.similarities = similarities
+        self.ids = ids
+        self.name = name
+
+    @property
+    def k(self):
+        return self.neighbours.shape[1]
+
+    def neighbours_of(self, index):
+        """Return (indices, similarities) of the valid neighbours of a row."""
+        valid = self.neighbours[index] >= 0
+        return self.neighbours[index][valid], self.similarities[index][valid]
+
+    def save(self, path):
+        """Save the neighbour index as .npz file or, if path has no .npz suffix, as directory."""
+        ids = self.ids if self.ids is not None else np.arange(len(self.neighbours), dtype=np.int32)
+        if path.endswith('.npz'):
+            np.savez(path, neighbours=self.neighbours, similarities=self.similarities, ids=ids, name=self.name)
+            return
+        os.makedirs(path, exist_ok=True)
+        for key, array in (('neighbours', self.neighbours), ('similarities', self.similarities), ('ids', ids)):
+            # arrays created with empty(path=...) are already in place
+            if not (isinstance(array, np.memmap) and os.path.abspath(array.filename) == os.path.abspath(os.path.join(path, f'{key}.npy'))):
+                np.save(os.path.join(path, f'{key}.npy'), array)
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'name': self.name, 'k': self.k, 'n_rows': len(self.neighbours)}, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load a neighbour index saved with save(); directories are memory-mapped."""
+        if path.endswith('.npz'):
+            data = np.load(path)
+            return cls(data['neighbours'], data['similarities'], data['ids'], str(data['name']))
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = [np.load(os.path.join(path, f'{key}.npy'), mmap_mode=mmap_mode) for key in ('neighbours', 'similarities', 'ids')]
+        return cls(*arrays, meta['name'])
+
+    @classmethod
+    def empty(cls, n_rows, k, ids=None, name='cosine', path=None):
+        """Unfilled index, backed by memory-mapped .npy files in directory path if given."""
+        if path is None:
+            return cls(np.full((n_rows, k), -1, dtype=np.int32), np.zeros((n_rows, k), dtype=np.float32), ids, name)
+        os.makedirs(path, exist_ok=True)
+        neighbours = np.lib.format.open_memmap(os.path.join(path, 'neighbours.npy'), mode='w+', dtype=np.int32, shape=(n_rows, k))
+        similarities = np.lib.format.open_memmap(os.path.join(path, 'similarities.npy'), mode='w+', dtype=np.float32, shape=(n_rows, k))
+        neighbours[:] = -1
+        return cls(neighbours, similarities, ids, name)
+
+
+def prepare(matrix):
+    """Matrices shared by all blocks: ratings, rating pattern and squared ratings (float64 CSR)."""
+    matrix = sp.csr_matrix(matrix, dtype=np.float64)
+    pattern = matrix.copy()
+    pattern.data = np.ones_like(pattern.data)
+    squares = matrix.multiply(matrix).tocsr()
+    return {'matrix': matrix, 'pattern': pattern, 'squares': squares}
+
+
+def _statistics(start, stop, prepared, name, columns=None):
+    """Co-rating statistics of rows start:stop against all rows (or the rows in columns).
+
+    Returns a dict of dense (block rows x rows) arrays.
+    """
+    matrix, pattern, squares = prepared['matrix'], prepared['pattern'], prepared['squares']
+    block, block_pattern, block_squares = matrix[start:stop], pattern[start:stop], squares[start:stop]
+    if columns is not None:
+        matrix, pattern, squares = matrix[columns], pattern[columns], squares[columns]
+
+    stats = {
+        'freq': (block_pattern @ pattern.T).toarray(), # number of common ratings
+        'prods': (block @ matrix.T).toarray(), # sum of r_i * r_j
+        'sqi': (block_squares @ pattern.T).toarray(), # sum of r_i^2
+        'sqj': (block_pattern @ squares.T).toarray(), # sum of r_j^2
+    }
+    if name == 'pearson':
+        stats['si'] = (block @ pattern.T).toarray() # sum of r_i
+        stats['sj'] = (block_pattern @ matrix.T).toarray() # sum of r_j
+    return stats
+
+
+def block_similarities(start, stop, prepared, name='cosine', min_support=1, columns=None):
+    """Similarities of rows start:stop to all rows of the prepared matrix (dense array).
+
+    If columns (sorted row indices) is given, only those rows are compared.
+    Pairs below min_support common ratings are set to -inf.
+    """
+    stats = _statistics(start, stop, prepared, name, columns)
+    freq = stats['freq']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if name in ('cosine', 'adjusted_cosine'):
+            sim = stats['prods'] / np.sqrt(stats['sqi'] * stats['sqj'])
+        elif name == 'msd':
+            msd = (stats['sqi'] + stats['sqj'] - 2 * stats['prods']) / freq
+            sim = 1 / (msd + 1)
+        elif name == 'pearson':
+            num = freq * stats['prods'] - stats['si'] * stats['sj']
+            denum = np.sqrt((freq * stats['sqi'] - stats['si'] ** 2) * (freq * stats['sqj'] - stats['sj'] ** 2))
+            sim = num / denum
+        else:
+            raise ValueError(f"unknown similarity '{name}', use one of {SIMILARITIES}")
+    # undefined similarities (e.g. constant ratings for pearson) are 0 like in Surprise
+    sim[~np.isfinite(sim)] = 0
+    sim[freq < max(min_support, 1)] = -np.inf
+    return sim
+
+
+def top_k(sim, k, offset=0, columns=None):
+    """Indices and values of the k largest entries per row of sim, excluding self-similarity.
+
+    Row i of sim belongs to row offset + i of the full matrix, column j to row
+    columns[j] (or j if columns is None).
+    """
+    n_rows, n_cols = sim.shape
+    rows = offset + np.arange(n_rows)
+    if columns is None:
+        sim[np.arange(n_rows), rows] = -np.inf
+    else:
+        position = np.minimum(np.searchsorted(columns, rows), n_cols - 1)
+        is_self = columns[position] == rows
+        sim[np.arange(n_rows)[is_self], position[is_self]] = -np.inf
+    k = min(k, n_cols)
+    # argpartition finds the top k in linear time, only those k are sorted
+    part = np.argpartition(-sim, k - 1, axis=1)[:, :k]
+    part_sim = np.take_along_axis(sim, part, axis=1)
+    order = np.argsort(-part_sim, axis=1, kind='stable')
+    neighbours = np.take_along_axis(part, order, axis=1)
+    neighbours = (neighbours if columns is None else columns[neighbours]).astype(np.int32)
+    similarities = np.take_along_axis(part_sim, order, axis=1)
+    # pad rows with fewer than k valid neighbours
+    invalid = ~np.isfinite(similarities)
+    neighbours[invalid] = -1
+    similarities[invalid] = 0
+    return neighbours, similarities.astype(np.float32)
+
+
+def _init_worker(prepared, name, min_support, k, candidates, memory_mb=2048, n_jobs=1):
+    _shared.update(prepared=prepared, name=name, min_support=min_support, k=k, candidates=candidates,
+                   memory_mb=memory_mb, n_jobs=n_jobs)
+
+
+def _process_block(bounds):
+    start, stop = bounds
+    columns = mask = None
+    if _shared['candidates'] is not None:
+        columns, mask = _shared['candidates'].block(start, stop)
+        if len(columns) == 0:
+            return start, (np.full((stop - start, _shared['k']), -1, dtype=np.int32), np.zeros((stop - start, _shared['k']), dtype=np.float32))
+        # the union of the candidates of a block can be much wider than those of a single row: split the
+        # block until its dense buffers fit into the memory share of the worker (sub-blocks have at most
+        # the candidates of the block, so the splitting ends)
+        max_rows = block_size_for(len(columns), _shared['memory_mb'], _shared['n_jobs'])
+        if stop - start > max_rows:
+            results = [_process_block((sub_start, min(sub_start + max_rows, stop)))[1]
+                       for sub_start in range(start, stop, max_rows)]
+            return start, (np.concatenate([neighbours for neighbours, _ in results]),
+                           np.concatenate([similarities for _, similarities in results]))
+    sim = block_similarities(start, stop, _shared['prepared'], _shared['name'], _shared['min_support'], columns)
+    if mask is not None:
+        sim[~mask] = -np.inf
+    neighbours, similarities = top_k(sim, _shared['k'], start, columns)
+    if neighbours.shape[1] < _shared['k']:
+        # fewer candidate columns than k
+        pad = _shared['k'] - neighbours.shape[1]
+        neighbours = np.pad(neighbours, ((0, 0), (0, pad)), constant_values=-1)
+        similarities = np.pad(similarities, ((0, 0), (0, pad)))
+    return start, (neighbours, similarities)
+
+
+def block_size_for(n_rows, memory_mb=2048, n_jobs=1):
+    """Number of rows per block so that n_jobs blocks fit into memory_mb."""
+    return max(1, int(memory_mb * 2**20 / (n_jobs * n_rows * BYTES_PER_CELL)))
+
+
+def top_k_similarities(matrix, k=40, name='cosine', min_support=1, memory_mb=2048, n_jobs=-1, ids=None,
+                       candidates=None, block_size=None, path=None):
+    """Compute the top-k neighbours of every row of a sparse rating matrix.
+
+    matrix has one row per entity to compare (e.g. RatingsMatrix.item_user for
+    item-item similarities). Blocks of rows are processed in parallel by n_jobs
+    processes (-1 = all cores), with block sizes chosen such that the block
+    buffers of all workers together stay below memory_mb. The rating matrices
+    themselves are prepared once and inherited by the workers.
+
+    candidates optionally restricts the compared pairs: an object whose
+    block(start, stop) method returns the sorted candidate rows for a block and
+    a (block rows x candidates) boolean mask; blocks are split so that every
+    worker stays within its share of memory_mb. If path is given, the result is
+    written to memory-mapped files in that directory (see TopKNeighbours).
+    """
+    if name not in SIMILARITIES:
+        raise ValueError(f"unknown similarity '{name}', use one of {SIMILARITIES}")
+    matrix = sp.csr_matrix(matrix)
+    if name == 'adjusted_cosine':
+        # center each column (e.g. each user's ratings) on its mean
+        matrix = ratings_matrix.center_rows(matrix.T.tocsr()).T.tocsr()
+    prepared = prepare(matrix)
+    n_rows = matrix.shape[0]
+    n_jobs = os.cpu_count() if n_jobs == -1 else max(1, n_jobs)
+    # with candidates a row is compared to at most candidates.max_candidates rows (if the candidates
+    # know a bound); blocks whose candidates together are wider are split by the workers
+    block_size = block_size or block_size_for(min(n_rows, getattr(candidates, 'max_candidates', n_rows)),
+                                              memory_mb, n_jobs)
+    blocks = [(start, min(start + block_size, n_rows)) for start in range(0, n_rows, block_size)]
+
+    k = min(k, n_rows - 1)
+    index = TopKNeighbours.empty(n_rows, k, ids, name, path)
+    neighbours, similarities = index.neighbours, index.similarities
+
+    def store(result):
+        start, (block_neighbours, block_similarities_) = result
+        neighbours[start:start + len(block_neighbours)] = block_neighbours
+        similarities[start:start + len(block_neighbours)] = block_similarities_
+
+    if n_jobs == 1 or len(blocks) == 1:
+        _init_worker(prepared, name, min_support, k, candidates, memory_mb, n_jobs)
+        for bounds in blocks:
+            store(_process_block(bounds))
+    else:
+        with ProcessPoolExecutor(n_jobs, initializer=_init_worker, initargs=(prepared, name, min_support, k, candidates, memory_mb, n_jobs)) as executor:
+            for result in executor.map(_process_block, blocks):
+                store(result)
+
+    if path is not None:
+        neighbours.flush()
+        similarities.flush()
+        index.save(path)
+    return index
+
+
+def item_similarities(rm, k=40, name='cosine', min_support=1, memory_mb=2048, n_jobs=-1):
+    """Top-k item-item neighbours for a ratings_matrix.RatingsMatrix."""
+    return top_k_similarities(rm.item_user, k, name, min_support, memory_mb, n_jobs, ids=rm.movie_ids)
+
+
+def predict_user(index, ratings_row, min_k=1):
+    """Item-based KNN predictions of one user for all items.
+
+    index is the TopKNeighbours of the items, ratings_row the user's row of the
+    user x item CSR matrix. Like Surprise's KNNBasic only neighbours with
+    positive similarity that were rated by the user are aggregated; items with
+    fewer than min_k such neighbours get NaN.
+    """
+    n_items = len(index.neighbours)
+    ratings = np.zeros(n_items + 1, dtype=np.float32) # last slot for the -1 padding
+    rated = np.zeros(n_items + 1, dtype=bool)
+    ratings[ratings_row.indices] = ratings_row.data
+    rated[ratings_row.indices] = True
+
+    neighbour_ratings = ratings[index.neighbours]
+    use = rated[index.neighbours] & (index.similarities > 0)
+    weights = np.where(use, index.similarities, 0)
+    num = (weights * neighbour_ratings).sum(axis=1)
+    denum = weights.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        predictions = num / denum
+    predictions[use.sum(axis=1) < min_k] = np.nan
+    return predictions
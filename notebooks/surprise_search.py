@@ -0,0 +1,291 @@
+"""Resumable, parallel hyperparameter search for the Surprise models.
+
+Replaces the copy-pasted GridSearchCV cells of model_surprise_GridSearch.ipynb.
+A declarative JSON spec (see surprise_search_spec.json) lists the searches:
+algorithm, parameter grid (sim_options / bsl_options are expanded like in
+Surprise's GridSearchCV) and strategy:
+
+- 'grid': all combinations,
+- 'random': n_iter combinations drawn from the grid,
+- 'halving': successive halving in n_rungs rungs, all combinations are
+  evaluated on 1 / factor ** (n_rungs - 1) of the training ratings of every
+  fold, only the best 1 / factor of them go on to the next rung with factor
+  times as many ratings, up to all ratings in the last rung.
+
+Every (algorithm, params, fold, fraction) is one task. Tasks run in a process
+pool; the workers read the slim ratings table themselves once (initializer)
+instead of getting the dataset pickled with every task, and the folds are
+derived from the seed, so every worker builds the same splits. Each finished
+task is appended to a JSON lines results store right away. A rerun with the
+same store skips all tasks that are already in it, so a crash only loses the
+running tasks.
+
+At the end of every search its SearchResult (best_params / best_score per
+measure like GridSearchCV) is written to the artifact store in output_dir (see
+artifacts.py): the best parameters per measure to the table surp_best_params,
+the cv_results of all candidates of the last rung to surp_search_candidates,
+parameters as JSON strings. Reading them needs no unpickling.
+
+Usage from the command line (in the notebooks folder):
+
+    python surprise_search.py surprise_search_spec.json --searches SVD NMF --n-jobs 8
+"""
+import argparse
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+
+import numpy as np
+import pandas as pd
+import surprise
+from surprise import Dataset, Reader, accuracy
+
+import artifacts
+import dataprep
+
+STRATEGIES = ('grid', 'random', 'halving')
+
+# dataset of the worker process, set by _init_worker
+_shared = {}
+
+
+class SearchResult:
+    """Result of one search, with the attributes of GridSearchCV that the notebooks use.
+
+    best_params, best_score and best_index are dicts by measure, cv_results
+    holds the mean / std of the test measures and times of all candidates of
+    the last rung (dict of lists, one entry per candidate like in Surprise).
+    """
+
+    def __init__(self, name, algo, cv_results, measures):
+        self.name = name
+        self.algo = algo
+        self.cv_results = cv_results
+        self.best_index = {m: int(np.argmin(cv_results[f'mean_test_{m}'])) for m in measures}
+        self.best_params = {m: cv_results['params'][i] for m, i in self.best_index.items()}
+        self.best_score = {m: cv_results[f'mean_test_{m}'][i] for m, i in self.best_index.items()}
+
+
+def expand_grid(param_grid):
+    """All parameter combinations of a grid (list of dicts)."""
+    param_grid = dict(param_grid)
+    for key in ('sim_options', 'bsl_options'):
+        if key in param_grid:
+            options = param_grid[key]
+            param_grid[key] = [dict(zip(options, values)) for values in product(*options.values())]
+    return [dict(zip(param_grid, values)) for values in product(*param_grid.values())]
+
+
+def candidates(search, seed=42):
+    """Parameter combinations to evaluate for a search of the spec."""
+    grid = expand_grid(search['param_grid'])
+    if search.get('strategy', 'grid') == 'random' and search['n_iter'] < len(grid):
+        rng = np.random.default_rng(seed)
+        grid = [grid[i] for i in np.sort(rng.choice(len(grid), search['n_iter'], replace=False))]
+    return grid
+
+
+def rungs(search):
+    """Training fractions of the rungs of a search ([1.0] unless it is successive halving)."""
+    if search.get('strategy', 'grid') != 'halving':
+        return [1.0]
+    n_rungs, factor = search.get('n_rungs', 3), search.get('factor', 3)
+    return [float(factor) ** -(n_rungs - 1 - rung) for rung in range(n_rungs)]
+
+
+def task_key(name, params, fold, fraction):
+    """Identifier of a task in the results store."""
+    return json.dumps([name, params, fold, round(fraction, 6)], sort_keys=True)
+
+
+def read_store(path):
+    """Records of the results store by task key (a truncated last line from a crash is ignored)."""
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, 'rb+') as f:
+        content = f.read()
+        if content and not content.endswith(b'\n'):
+            # drop the incomplete last line, later records are appended after it
+            f.truncate(content.rfind(b'\n') + 1)
+    for line in content.decode().splitlines():
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        records[task_key(record['search'], record['params'], record['fold'], record['fraction'])] = record
+    return records
+
+
+def append_record(path, record):
+    """Append one record to the results store and flush it to disk."""
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def fold_assignment(n_ratings, cv, seed):
+    """Fold of every rating, a seeded shuffle like KFold(shuffle=True)."""
+    folds = np.empty(n_ratings, dtype=np.int8)
+    folds[np.random.default_rng(seed).permutation(n_ratings)] = np.arange(n_ratings) % cv
+    return folds
+
+
+def _init_worker(data_dir, cv, seed):
+    df = dataprep.read_ratings(data_dir, columns=['userId', 'movieId', 'rating'])
+    _shared.update(df=df, folds=fold_assignment(len(df), cv, seed), seed=seed, split=None)
+
+
+def _split(fold, fraction):
+    """Surprise trainset and testset of a fold, cached for consecutive tasks of the same split."""
+    if _shared['split'] is not None and _shared['split'][0] == (fold, fraction):
+        return _shared['split'][1]
+    df, folds = _shared['df'], _shared['folds']
+    train = np.flatnonzero(folds != fold)
+    if fraction < 1:
+        # seeded subsample of the training ratings (same for all candidates of a rung)
+        rng = np.random.default_rng(_shared['seed'] + fold)
+        train = np.sort(rng.choice(train, int(math.ceil(fraction * len(train))), replace=False))
+    trainset = Dataset.load_from_df(df.iloc[train], Reader(rating_scale=(0.5, 5.0))).build_full_trainset()
+    test = df.iloc[np.flatnonzero(folds == fold)]
+    testset = list(zip(test['userId'].tolist(), test['movieId'].tolist(), test['rating'].tolist()))
+    _shared['split'] = ((fold, fraction), (trainset, testset))
+    return trainset, testset
+
+
+def _run_task(name, algo, params, fold, fraction, measures):
+    trainset, testset = _split(fold, fraction)
+    np.random.seed(_shared['seed'])
+    model = getattr(surprise, algo)(**params)
+    start = time.perf_counter()
+    model.fit(trainset)
+    fit_time = time.perf_counter() - start
+    start = time.perf_counter()
+    predictions = model.test(testset)
+    test_time = time.perf_counter() - start
+    record = {'search': name, 'algo': algo, 'params': params, 'fold': fold, 'fraction': fraction,
+              'n_train': trainset.n_ratings, 'fit_time': fit_time, 'test_time': test_time}
+    for measure in measures:
+        record[f'test_{measure}'] = getattr(accuracy, measure)(predictions, verbose=False)
+    return record
+
+
+def summarize(records, params_list, measures, cv):
+    """GridSearchCV-like cv_results (dict of lists) of the candidates from their fold records."""
+    cv_results = {'params': params_list}
+    for key in [f'test_{m}' for m in measures] + ['fit_time', 'test_time']:
+        values = np.array([[record[key] for record in candidate_records] for candidate_records in records])
+        for fold in range(cv):
+            if key.startswith('test_'):
+                cv_results[f'split{fold}_{key}'] = values[:, fold].tolist()
+        cv_results[f'mean_{key}'] = values.mean(axis=1).tolist()
+        cv_results[f'std_{key}'] = values.std(axis=1).tolist()
+        if key.startswith('test_'):
+            cv_results[f'rank_{key}'] = (np.argsort(np.argsort(values.mean(axis=1))) + 1).tolist()
+    return cv_results
+
+
+def result_tables(result):
+    """Tables of a SearchResult: best parameters per measure and cv_results of the candidates."""
+    best = pd.DataFrame([{'search': result.name, 'algo': result.algo, 'measure': measure,
+                          'params': artifacts.to_json(params), 'score': float(result.best_score[measure])}
+                         for measure, params in result.best_params.items()])
+    candidates = pd.DataFrame({key: values for key, values in result.cv_results.items() if key != 'params'})
+    candidates.insert(0, 'params', [artifacts.to_json(params) for params in result.cv_results['params']])
+    candidates.insert(0, 'algo', result.algo)
+    candidates.insert(0, 'search', result.name)
+    return best, candidates
+
+
+def write_result(result, output_dir, dataset_hash=None):
+    """Write a SearchResult to the artifact store, replacing earlier results of the same search."""
+    best, candidates = result_tables(result)
+    artifacts.update_table(output_dir, 'surp_best_params', best, key='search', dataset_hash=dataset_hash)
+    artifacts.update_table(output_dir, 'surp_search_candidates', candidates, key='search', dataset_hash=dataset_hash)
+
+
+def run_search(search, spec, executor, store, done):
+    """Run one search of the spec (all rungs) and return its SearchResult."""
+    name, algo, cv, measures = search['name'], search['algo'], spec['cv'], spec['measures']
+    if search.get('strategy', 'grid') not in STRATEGIES:
+        raise ValueError(f"unknown strategy '{search['strategy']}', use one of {STRATEGIES}")
+    params_list = candidates(search, spec['seed'])
+    for rung, fraction in enumerate(rungs(search)):
+        keys = [[task_key(name, params, fold, fraction) for fold in range(cv)] for params in params_list]
+        # ordered by fold, so that workers can reuse the split of their previous task
+        todo = [(fold, i) for fold in range(cv) for i in range(len(params_list)) if keys[i][fold] not in done]
+        print(f'{name}: rung {rung} (fraction {fraction:.2f}), {len(params_list)} candidates, '
+              f'{len(todo)} of {len(params_list) * cv} tasks to run')
+        futures = [executor.submit(_run_task, name, algo, params_list[i], fold, fraction, measures) for fold, i in todo]
+        for future in as_completed(futures):
+            record = future.result()
+            append_record(store, record)
+            done[task_key(name, record['params'], record['fold'], record['fraction'])] = record
+
+        records = [[done[key] for key in candidate_keys] for candidate_keys in keys]
+        cv_results = summarize(records, params_list, measures, cv)
+        if fraction < 1:
+            # successive halving: keep the best 1 / factor by the first measure
+            n_keep = max(1, int(math.ceil(len(params_list) / search.get('factor', 3))))
+            best = np.argsort(cv_results[f'mean_test_{measures[0]}'])[:n_keep]
+            params_list = [params_list[i] for i in np.sort(best)]
+    return SearchResult(name, algo, cv_results, measures)
+
+
+def load_spec(path):
+    """Spec from a JSON file, relative paths in it are resolved relative to the file."""
+    with open(path) as f:
+        spec = json.load(f)
+    spec_dir = os.path.dirname(os.path.abspath(path))
+    for key in ('data_dir', 'output_dir', 'store'):
+        spec[key] = os.path.join(spec_dir, spec[key])
+    spec.setdefault('cv', 3)
+    spec.setdefault('measures', ['rmse', 'mse', 'mae'])
+    spec.setdefault('seed', 42)
+    return spec
+
+
+def run(spec, names=None, n_jobs=-1, mail=False):
+    """Run the searches of the spec (all or the ones in names) and write their results to the artifact store."""
+    searches = [search for search in spec['searches'] if names is None or search['name'] in names]
+    os.makedirs(spec['output_dir'], exist_ok=True)
+    dataset_hash = artifacts.file_hash(*dataprep.ratings_files(spec['data_dir']))
+    done = read_store(spec['store'])
+    results = {}
+    with ProcessPoolExecutor(max_workers=None if n_jobs == -1 else n_jobs, initializer=_init_worker,
+                             initargs=(spec['data_dir'], spec['cv'], spec['seed'])) as executor:
+        for search in searches:
+            result = run_search(search, spec, executor, spec['store'], done)
+            write_result(result, spec['output_dir'], dataset_hash)
+            print(result.best_score)
+            print(result.best_params)
+            results[search['name']] = result
+            if mail:
+                import send_status_mail as ssm
+
+                # send completion message via email (server, sender, recepient according to .env)
+                ssm.sendstatus(search['algo'])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resumable hyperparameter search for the Surprise models.')
+    parser.add_argument('spec', help='JSON search spec, e.g. surprise_search_spec.json')
+    parser.add_argument('--searches', nargs='*', default=None, help='names of the searches to run (default: all)')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='worker processes (-1: all CPUs)')
+    parser.add_argument('--store', default=None, help='results store, overrides the spec')
+    parser.add_argument('--mail', action='store_true', help='send a status mail after every search')
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec)
+    if args.store:
+        spec['store'] = args.store
+    run(spec, args.searches, args.n_jobs, args.mail)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Top-k user neighbours for user-based KNN on the full MovieLens data.
+
+A dense user x user similarity matrix for 162k users needs about 200 GB, which
+is why the Surprise GridSearch only tested user_based=False. Here the user
+similarities are computed blockwise from sparse co-rating products (see
+similarity.py) and only the top-k neighbours per user are kept, written to
+memory-mapped .npy files.
+
+Optionally the compared pairs are pre-filtered with MinHash / LSH on each
+user's set of rated movies: users only become candidates if they share an LSH
+bucket in at least one band, i.e. if their rated sets are similar enough
+(Jaccard similarity above roughly (1 / bands) ** (1 / rows_per_band)).
+"""
+import numpy as np
+
+import similarity
+
+# Mersenne prime 2^31 - 1 for the universal hash functions of MinHash
+_PRIME = np.int64(2**31 - 1)
+
+
+def minhash_signatures(matrix, num_perm=64, seed=42):
+    """MinHash signature (num_perm uint32 values) of the column set of every row of a CSR matrix."""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _PRIME, num_perm, dtype=np.int64)
+    b = rng.integers(0, _PRIME, num_perm, dtype=np.int64)
+    n_rows = matrix.shape[0]
+    # rows without entries keep the maximum value as signature
+    signatures = np.full((n_rows, num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+    non_empty = np.diff(matrix.indptr) > 0
+    starts = matrix.indptr[:-1][non_empty]
+    columns = matrix.indices.astype(np.int64)
+    for p in range(num_perm):
+        # one hash function at a time keeps memory at one int64 per rating
+        hashes = (a[p] * columns + b[p]) % _PRIME
+        signatures[non_empty, p] = np.minimum.reduceat(hashes, starts)
+    return signatures
+
+
+def lsh_buckets(signatures, bands=32):
+    """Bucket label per row and band (rows x bands int64) from banded MinHash signatures."""
+    n_rows, num_perm = signatures.shape
+    if num_perm % bands:
+        raise ValueError(f'num_perm ({num_perm}) must be a multiple of bands ({bands})')
+    rows_per_band = num_perm // bands
+    labels = np.empty((n_rows, bands), dtype=np.int64)
+    for band in range(bands):
+        band_signature = np.ascontiguousarray(signatures[:, band * rows_per_band:(band + 1) * rows_per_band])
+        # view each band signature as one opaque value, identical values share a bucket
+        band_signature = band_signature.view(np.dtype((np.void, band_signature.dtype.itemsize * rows_per_band))).ravel()
+        _, labels[:, band] = np.unique(band_signature, return_inverse=True)
+    return labels
+
+
+class LSHCandidates:
+    """Candidate neighbours of blocks of users from LSH buckets.
+
+    Used as candidates argument of similarity.top_k_similarities. Buckets larger
+    than max_bucket contribute only max_bucket of their members, which keeps
+    the work per user bounded for very popular rating patterns. The kept
+    members are a random sample, drawn anew for every band, so no users are
+    preferred (e.g. the low userIds). The price is recall: in a band, a user
+    in a bucket of b > max_bucket members only sees about max_bucket / b of
+    them, true neighbours that only share such buckets can be missed.
+    """
+
+    def __init__(self, labels, max_bucket=1000, seed=42):
+        self.labels = labels
+        self.max_bucket = max_bucket
+        # per band: users sorted by bucket label and, within a bucket, in random order, to look up
+        # bucket members with searchsorted and keep a random sample of the oversized buckets
+        rng = np.random.default_rng(seed)
+        self.order = np.empty(labels.shape, dtype=np.int64)
+        for band in range(labels.shape[1]):
+            self.order[:, band] = np.lexsort((rng.permutation(len(labels)), labels[:, band]))
+        self.sorted_labels = np.take_along_axis(labels, self.order, axis=0)
+
+    @property
+    def max_candidates(self):
+        """Upper bound of the candidates of a single user: max_bucket per band."""
+        return min(len(self.labels), self.labels.shape[1] * self.max_bucket)
+
+    def block(self, start, stop):
+        """Sorted candidate users and (block users x candidates) mask for users start:stop."""
+        owners, members = [], []
+        for band in range(self.labels.shape[1]):
+            block_labels = self.labels[start:stop, band]
+            low = np.searchsorted(self.sorted_labels[:, band], block_labels, side='left')
+            high = np.searchsorted(self.sorted_labels[:, band], block_labels, side='right')
+            lengths = np.minimum(high - low, self.max_bucket)
+            # positions low[i], ..., low[i] + lengths[i] - 1 for all users of the block at once
+            offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            members.append(self.order[np.repeat(low, lengths) + offsets, band])
+            owners.append(np.repeat(np.arange(stop - start), lengths))
+        owners, members = np.concatenate(owners), np.concatenate(members)
+        columns = np.unique(members)
+        mask = np.zeros((stop - start, len(columns)), dtype=bool)
+        mask[owners, np.searchsorted(columns, members)] = True
+        return columns, mask
+
+
+def user_similarities(rm, k=50, name='cosine', min_support=3, memory_mb=8192, n_jobs=-1, path=None,
+                      lsh=True, num_perm=64, bands=32, max_bucket=1000, block_size=None, seed=42):
+    """Top-k user-user neighbours for a ratings_matrix.RatingsMatrix.
+
+    With lsh=True only users sharing an LSH bucket are compared, otherwise all
+    pairs are. The result is written to memory-mapped files in directory path
+    if given and can be reopened with similarity.TopKNeighbours.load(path).
+    """
+    candidates = None
+    if lsh:
+        signatures = minhash_signatures(rm.user_item, num_perm, seed)
+        # the blocks are sized from memory_mb and the candidates per user (LSHCandidates.max_candidates)
+        candidates = LSHCandidates(lsh_buckets(signatures, bands), max_bucket, seed)
+    return similarity.top_k_similarities(rm.user_item, k, name, min_support, memory_mb, n_jobs, ids=rm.user_ids,
+                                         candidates=candidates, block_size=block_size, path=path)
+
+
+def predict_user(index, user_item, user, min_k=1):
+    """User-based KNN predictions of one user (row index) for all items.
+
+    Like Surprise's KNNBasic with user_based=True, the ratings of the positively
+    similar neighbours that rated an item are averaged, weighted by similarity.
+    Items rated by fewer than min_k neighbours get NaN.
+    """
+    neighbours, sims = index.neighbours_of(user)
+    positive = sims > 0
+    neighbours, sims = neighbours[positive], sims[positive].astype(np.float64)
+    neighbour_ratings = user_item[neighbours]
+    pattern = neighbour_ratings.copy()
+    pattern.data = np.ones_like(pattern.data)
+
+    num = neighbour_ratings.T @ sims
+    denum = pattern.T @ sims
+    n_raters = np.asarray(pattern.sum(axis=0)).ravel()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        predictions = num / denum
+    predictions[n_raters < min_k] = np.nan
+    return predictions
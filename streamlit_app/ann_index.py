@@ -0,0 +1,219 @@
+"""Approximate nearest-neighbour index over item factors and embeddings.
+
+Inverted file index (IVF) in pure NumPy: the vectors (e.g. SVD qi, the NCF
+item_embedding or genome-tag vectors) are clustered with k-means into nlist
+coarse cells and stored cell by cell. A query only scans the vectors of the
+nprobe cells whose centroids are closest to the query (by the metric the
+vectors were assigned to the cells with). Optionally the residuals to the cell
+centroid are compressed with product quantization (PQ, m sub-vectors with 256
+centroids each, i.e. m bytes per vector); candidates are then scored with
+lookup tables and the best ones re-ranked exactly (refine).
+
+Similarity is the inner product ('ip', e.g. for scoring MF factors) or cosine
+('cosine', vectors and queries are normalized). Knobs for the recall/latency
+trade-off: nlist and m at build time, nprobe and refine at query time.
+recall_at_n() compares the index with exact brute-force search.
+
+Indexes are saved as directory of .npy files and memory-mapped on load.
+"""
+import json
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+METRICS = ('ip', 'cosine')
+
+
+def kmeans(x, k, n_iter=20, seed=42):
+    """Plain Lloyd k-means, returns (centroids, assignment)."""
+    rng = np.random.default_rng(seed)
+    x = np.asarray(x, dtype=np.float32)
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    x_sq = (x ** 2).sum(axis=1)
+    for _ in range(n_iter):
+        # squared euclidean distances via ||x||^2 - 2 x.c + ||c||^2
+        distances = x_sq[:, None] - 2 * x @ centroids.T + (centroids ** 2).sum(axis=1)
+        assignment = distances.argmin(axis=1)
+        counts = np.bincount(assignment, minlength=k)
+        # per-cell sums as sparse (cells x points) one-hot product, much faster than np.add.at
+        one_hot = sp.csr_matrix((np.ones(len(x), dtype=np.float32), (assignment, np.arange(len(x)))), shape=(k, len(x)))
+        sums = one_hot @ x
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # re-seed empty cells with random points
+        centroids[empty] = x[rng.choice(len(x), empty.sum(), replace=False)]
+    distances = x_sq[:, None] - 2 * x @ centroids.T + (centroids ** 2).sum(axis=1)
+    return centroids, distances.argmin(axis=1)
+
+
+def _normalize(x):
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.where(norms == 0, 1, norms)
+
+
+class IVFIndex:
+    """IVF (optionally IVF-PQ) index, see module docstring.
+
+    Vectors are stored sorted by cell: the vectors of cell c are
+    vectors[offsets[c]:offsets[c + 1]] with raw ids ids[offsets[c]:offsets[c + 1]].
+    """
+
+    def __init__(self, centroids, offsets, ids, vectors, metric='cosine', codebooks=None, codes=None):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors
+        self.metric = metric
+        self.codebooks = codebooks # m x 256 x (dim / m) PQ centroids or None
+        self.codes = codes # n x m uint8 PQ codes or None
+        # raw id -> position in vectors
+        self._position = {raw_id: pos for pos, raw_id in enumerate(np.asarray(ids).tolist())}
+
+    @classmethod
+    def build(cls, vectors, ids=None, metric='cosine', nlist=None, m=None, n_iter=20, train_size=50_000, seed=42):
+        """Build the index from an (n x dim) array.
+
+        nlist defaults to about 4 * sqrt(n) cells. m (number of PQ sub-vectors,
+        must divide dim) enables product quantization of the residuals.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"unknown metric '{metric}', use one of {METRICS}")
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if metric == 'cosine':
+            vectors = _normalize(vectors)
+        n, dim = vectors.shape
+        ids = np.arange(n) if ids is None else np.asarray(ids)
+        nlist = nlist or max(1, int(4 * np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        train = vectors[rng.choice(n, min(n, train_size), replace=False)]
+
+        centroids, _ = kmeans(train, nlist, n_iter, seed)
+        assignment = np.argmax(vectors @ centroids.T, axis=1) if metric == 'ip' else \
+            np.argmin((vectors ** 2).sum(axis=1)[:, None] - 2 * vectors @ centroids.T + (centroids ** 2).sum(axis=1), axis=1)
+        # store vectors cell by cell
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=len(centroids)))])
+        vectors, ids, assignment = vectors[order], ids[order], assignment[order]
+
+        codebooks = codes = None
+        if m:
+            if dim % m:
+                raise ValueError(f'm ({m}) must divide the vector dimension ({dim})')
+            residuals = (vectors - centroids[assignment]).reshape(n, m, dim // m)
+            # 64 training points per sub-centroid are plenty for 256 centroids
+            sample = rng.choice(n, min(n, train_size, 256 * 64), replace=False)
+            codebooks = np.zeros((m, 256, dim // m), dtype=np.float32)
+            codes = np.zeros((n, m), dtype=np.uint8)
+            for j in range(m):
+                sub_centroids, _ = kmeans(residuals[sample, j], 256, n_iter, seed + j)
+                codebooks[j, :len(sub_centroids)] = sub_centroids
+                sub = residuals[:, j]
+                distances = (sub ** 2).sum(axis=1)[:, None] - 2 * sub @ codebooks[j].T + (codebooks[j] ** 2).sum(axis=1)
+                distances[:, len(sub_centroids):] = np.inf
+                codes[:, j] = distances.argmin(axis=1)
+        return cls(centroids, offsets, ids, vectors, metric, codebooks, codes)
+
+    def save(self, path):
+        """Save the index as directory of .npy files."""
+        os.makedirs(path, exist_ok=True)
+        arrays = {'centroids': self.centroids, 'offsets': self.offsets, 'ids': self.ids, 'vectors': self.vectors}
+        if self.codes is not None:
+            arrays.update(codebooks=self.codebooks, codes=self.codes)
+        for key, array in arrays.items():
+            np.save(os.path.join(path, f'{key}.npy'), np.asarray(array))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'metric': self.metric, 'pq': self.codes is not None}, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load an index saved with save(), memory-mapping the arrays."""
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {key: np.load(os.path.join(path, f'{key}.npy'), mmap_mode=mmap_mode)
+                  for key in ('centroids', 'offsets', 'ids', 'vectors') + (('codebooks', 'codes') if meta['pq'] else ())}
+        return cls(metric=meta['metric'], **arrays)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, raw_id):
+        return raw_id in self._position
+
+    def vector(self, raw_id):
+        """Stored (normalized for cosine) vector of a raw id."""
+        return np.asarray(self.vectors[self._position[raw_id]])
+
+    def search(self, query, n=10, nprobe=8, refine=4, exclude=None):
+        """Ids and scores of the approximate top-n vectors for one query vector.
+
+        nprobe cells are scanned. With PQ the best n * refine candidates by the
+        PQ estimate are re-ranked with the exact vectors. Raw ids in exclude are
+        skipped (e.g. the query item itself).
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if self.metric == 'cosine':
+            query = _normalize(query)
+        centroid_scores = self.centroids @ query
+        # probe the cells by the metric the vectors were assigned with: inner product for 'ip', euclidean
+        # distance to the (not normalized) k-means centroids for cosine, i.e. by q.c - ||c||^2 / 2
+        probe_scores = centroid_scores if self.metric == 'ip' else \
+            centroid_scores - 0.5 * np.einsum('ij,ij->i', self.centroids, self.centroids)
+        nprobe = min(nprobe, len(self.centroids))
+        cells = np.argpartition(-probe_scores, nprobe - 1)[:nprobe]
+        positions = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in cells])
+        cell_of = np.repeat(cells, np.diff(self.offsets)[cells])
+        if exclude is not None:
+            excluded = [self._position[raw_id] for raw_id in np.atleast_1d(exclude).tolist() if raw_id in self._position]
+            keep = ~np.isin(positions, excluded)
+            positions, cell_of = positions[keep], cell_of[keep]
+        if len(positions) == 0:
+            return np.array([], dtype=self.ids.dtype), np.array([], dtype=np.float32)
+
+        if self.codes is not None:
+            # asymmetric distance computation: q.(c + r) = q.c + sum_j q_j.codebook_j[code_j]
+            m = self.codes.shape[1]
+            tables = np.einsum('jkd,jd->jk', self.codebooks, query.reshape(m, -1))
+            estimates = centroid_scores[cell_of] + tables[np.arange(m), self.codes[positions]].sum(axis=1)
+            n_candidates = min(len(positions), n * max(refine, 1))
+            positions = positions[np.argpartition(-estimates, n_candidates - 1)[:n_candidates]]
+
+        scores = self.vectors[positions] @ query
+        n = min(n, len(positions))
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top])]
+        return np.asarray(self.ids[positions[top]]), scores[top]
+
+    def search_batch(self, queries, n=10, nprobe=8, refine=4):
+        """search() for every row of queries, returns (queries x n) ids and scores."""
+        results = [self.search(query, n, nprobe, refine) for query in np.asarray(queries, dtype=np.float32)]
+        ids = np.full((len(results), n), -1, dtype=np.int64)
+        scores = np.full((len(results), n), -np.inf, dtype=np.float32)
+        for row, (result_ids, result_scores) in enumerate(results):
+            ids[row, :len(result_ids)] = result_ids
+            scores[row, :len(result_scores)] = result_scores
+        return ids, scores
+
+    def similar(self, raw_id, n=10, nprobe=8, refine=4):
+        """Ids and scores of the n items most similar to the item raw_id (itself excluded)."""
+        return self.search(self.vector(raw_id), n, nprobe, refine, exclude=raw_id)
+
+
+def exact_search(vectors, queries, n=10, metric='cosine'):
+    """Brute-force top-n row indices for every query (queries x n)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    if metric == 'cosine':
+        vectors, queries = _normalize(vectors), _normalize(queries)
+    scores = queries @ vectors.T
+    top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    return np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+
+
+def recall_at_n(index, vectors, queries, ids=None, n=10, nprobe=8, refine=4):
+    """Share of the exact top-n (over vectors with raw ids) that the index returns, averaged over queries."""
+    ids = np.arange(len(vectors)) if ids is None else np.asarray(ids)
+    exact = ids[exact_search(vectors, queries, n, index.metric)]
+    approx, _ = index.search_batch(queries, n, nprobe, refine)
+    return float(np.mean([len(np.intersect1d(e, a)) / n for e, a in zip(exact, approx)]))
@@ -0,0 +1,99 @@
+"""Cold start benchmark of the Streamlit app: time from a fresh interpreter to the first painted page.
+
+Every run starts a new Python process that imports Streamlit and runs
+streamlit_presentation.py once with streamlit.testing (the first page of the
+navigation, like the first request after a container restart). The benchmark
+fails (exit code 1) if
+
+- the median time to first paint exceeds --max-seconds,
+- the first page raises an exception, or
+- a module of FORBIDDEN was imported on the way (TensorFlow, Surprise and
+  scikit-learn are dependencies of the notebooks, never of the presentation).
+
+With --importtime the slowest imports of the last run (python -X importtime)
+are listed, e.g. to find a heavy module that was imported eagerly again.
+
+Usage from the command line (in the streamlit_app folder):
+
+    python benchmark_startup.py --runs 5 --max-seconds 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FORBIDDEN = ('tensorflow', 'keras', 'surprise', 'sklearn', 'torch')
+
+# runs in the fresh process, prints the result as JSON on the last line of stdout
+_CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+at = AppTest.from_file('streamlit_presentation.py', default_timeout=60).run()
+painted = time.perf_counter()
+print(json.dumps({'import_seconds': imported - start, 'run_seconds': painted - imported,
+                  'exceptions': [str(e.value) for e in at.exception],
+                  'forbidden': [m for m in %r if m in sys.modules]}))
+'''
+
+
+def cold_start(importtime=False):
+    """One cold start in a new process, returns its measurements (and the -X importtime log if requested)."""
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', _CHILD % (FORBIDDEN,)]
+    start = time.perf_counter()
+    process = subprocess.run(command, cwd=APP_DIR, capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f'cold start failed:\n{process.stderr[-2000:]}')
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result['first_paint_seconds'] = seconds
+    result['importtime'] = process.stderr if importtime else None
+    return result
+
+
+def slowest_imports(log, n=15):
+    """(cumulative microseconds, module) of the n slowest imports of a -X importtime log."""
+    imports = []
+    for line in log.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), module.strip()))
+    return sorted(imports, reverse=True)[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start benchmark of the Streamlit app.')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=3.0, help='budget for the median time to first paint')
+    parser.add_argument('--importtime', action='store_true', help='list the slowest imports of the last run')
+    args = parser.parse_args()
+
+    results = [cold_start(args.importtime and run == args.runs - 1) for run in range(args.runs)]
+    median = statistics.median(result['first_paint_seconds'] for result in results)
+    for key in ('first_paint_seconds', 'import_seconds', 'run_seconds'):
+        print(f"{key}: median {statistics.median(result[key] for result in results):.3f}, "
+              f"max {max(result[key] for result in results):.3f}")
+    if args.importtime:
+        for cumulative, module in slowest_imports(results[-1]['importtime']):
+            print(f'{cumulative / 1e6:8.3f} s  {module}')
+
+    errors = []
+    if median > args.max_seconds:
+        errors.append(f'median time to first paint {median:.3f} s is over the budget of {args.max_seconds} s')
+    for result in results:
+        errors += [f'exception on the first page: {exception}' for exception in result['exceptions']]
+        errors += [f'{module} imported on the presentation path' for module in result['forbidden']]
+    for error in dict.fromkeys(errors):
+        print(f'FAILED: {error}')
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
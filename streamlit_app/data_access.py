@@ -0,0 +1,200 @@
+"""Central, cached access to the data files of the Streamlit app.
+
+Every artifact the pages show is registered once in ARTIFACTS with its path
+relative to the repository root and the function that loads it. load(name)
+resolves the path against the repository root (independent of the working
+directory the app was started from), loads the artifact on first use and
+keeps it with st.cache_resource, so all sessions and reruns share one copy
+instead of reading the files again on every widget interaction.
+
+The modification time of the file is part of the cache key: a rewritten file
+(e.g. new model results) is loaded again on its next use. The cached objects
+are shared by all sessions, so pages must not modify them in place.
+
+Importing this module is cheap: pandas, pyarrow, plotly and PIL are
+only imported by the loaders that need them, so the first page is painted
+without them (see benchmark_startup.py). Every load and figure is timed with
+its cache hit or miss by instrumentation.py. Images are served as the bytes of
+the copies in images/display that prepare_images.py resized to the width they
+are shown with (IMAGES). Like the figures per sidebar option, explore() keeps
+the aggregates of the interactive exploration per filter combination.
+"""
+import json
+import os
+
+import streamlit as st
+
+import instrumentation
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# name -> path relative to the repository root and loader (function of the absolute path)
+ARTIFACTS = {}
+
+
+def register(name, path, loader):
+    """Register an artifact under a name."""
+    ARTIFACTS[name] = {'path': path, 'loader': loader}
+
+
+def path(name):
+    """Absolute path of an artifact."""
+    return os.path.join(REPO_DIR, ARTIFACTS[name]['path'])
+
+
+def exists(name):
+    """Whether the file of an artifact exists, e.g. for optional exported models."""
+    return os.path.exists(path(name))
+
+
+def _mtime(path):
+    # folders (e.g. the item index) change with the files in them
+    if os.path.isdir(path):
+        return max([os.path.getmtime(path)] + [os.path.getmtime(os.path.join(path, file)) for file in os.listdir(path)])
+    return os.path.getmtime(path)
+
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(folder, file)) for folder, _, files in os.walk(path) for file in files)
+    return os.path.getsize(path)
+
+
+@st.cache_resource(show_spinner=False, max_entries=64)
+def _load(name, path, mtime):
+    # only runs on a cache miss
+    instrumentation.cache_miss(_size(path))
+    return ARTIFACTS[name]['loader'](path)
+
+
+def load(name):
+    """Artifact by name, loaded on first use and shared by all sessions until its file changes."""
+    artifact_path = path(name)
+    with instrumentation.timed('load', name, cache='hit'):
+        return _load(name, artifact_path, _mtime(artifact_path))
+
+
+def figure(name, **options):
+    """Precomputed Plotly figure by name and sidebar options (see notebooks/model_results.py).
+
+    Every (figure, options) combination is created once and shared by all
+    sessions until surp_figures.json changes.
+    """
+    figures_path = path('surp_figures')
+    with instrumentation.timed('figure', name, cache='hit', options=options):
+        return _figure(figures_path, _mtime(figures_path), name, tuple(sorted(options.items())))
+
+
+@st.cache_resource(show_spinner=False, max_entries=64)
+def _figure(path, mtime, name, options):
+    instrumentation.cache_miss()
+    import plotly.graph_objects as go
+
+    return go.Figure(load('surp_figures')[name, options])
+
+
+def explore(genres=(), year_range=None, min_ratings=1):
+    """Aggregates of the ratings for the filters of the data exploration (see exploration_queries.aggregate).
+
+    Every filter combination is queried once and shared by all sessions until
+    the partitioned ratings are rebuilt.
+    """
+    dataset_path = path('ratings_by_year')
+    filters = {'genres': tuple(sorted(genres)), 'year_range': tuple(year_range) if year_range else None,
+               'min_ratings': min_ratings}
+    with instrumentation.timed('compute', 'explore', cache='hit', options=filters):
+        return _explore(dataset_path, _mtime(dataset_path), **filters)
+
+
+@st.cache_resource(show_spinner=False, max_entries=256)
+def _explore(path, mtime, genres, year_range, min_ratings):
+    instrumentation.cache_miss()
+    import exploration_queries
+
+    return exploration_queries.aggregate(load('ratings_by_year'), load('movies_dim'), genres, year_range, min_ratings)
+
+
+def _load_figure_specs(path):
+    with open(path) as f:
+        specs = json.load(f)
+    return {(spec['figure'], tuple(sorted(spec['options'].items()))): spec['spec'] for spec in specs}
+
+
+def _load_table(path):
+    # tables of the artifact store are plain Parquet files, read memory-mapped without unpickling
+    import pyarrow.parquet as pq
+
+    return pq.read_table(path, memory_map=True).to_pandas()
+
+
+def _read_parquet(path):
+    import pandas as pd
+
+    return pd.read_parquet(path)
+
+
+def _read_arrow(path):
+    import pyarrow.parquet as pq
+
+    return pq.read_table(path, memory_map=True)
+
+
+def _open_ratings_dataset(path):
+    from exploration_queries import open_dataset
+
+    return open_dataset(path)
+
+
+def _read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _load_factor_recommender(path):
+    from recommender import FactorRecommender
+
+    return FactorRecommender.load(path)
+
+
+def _load_item_index(path):
+    from ann_index import IVFIndex
+
+    return IVFIndex.load(path)
+
+
+# data exploration
+for table in ['movies', 'ratings', 'tags', 'genome-tags', 'genome-scores', 'links']:
+    register(table, f'data/dataframes/{table}.parquet', _read_parquet)
+# aggregates and their describe() tables, materialized by notebooks/aggregates.py
+for table in ['frequency_genres', 'user_rating_describe', 'user_tag_describe']:
+    register(table, f'data/dataframes/{table}.parquet', _read_parquet)
+# ratings partitioned by year and the movies dimension of the interactive exploration,
+# written by notebooks/exploration_data.py
+register('ratings_by_year', 'data/dataframes/ratings_by_year', _open_ratings_dataset)
+register('movies_dim', 'data/dataframes/movies_dim.parquet', _read_arrow)
+
+# model results, tables of the artifact store (notebooks/artifacts.py) and the precomputed
+# summaries and figures (notebooks/model_results.py)
+for table in ['surp_default_metrics', 'surp_cv_folds', 'surp_cv_summary', 'surp_precision_recall_summary',
+              'surp_best_params']:
+    register(table, f'data/models/{table}.parquet', _load_table)
+register('surp_figures', 'data/models/surp_figures.json', _load_figure_specs)
+
+# exported models for the recommendations
+register('surp_svd_factors', 'data/models/surp_svd_factors.npz', _load_factor_recommender)
+register('surp_svd_item_index', 'data/models/surp_svd_item_index', _load_item_index)
+
+# images by file name and the width they are shown with (the width of the main column unless the page sets one)
+IMAGES = {
+    'movie_title_image.jpg': 704,
+    'distribution_movie_rating_genre.png': 704,
+    'average_rating_vs_number_of_ratings.png': 704,
+    'rug_number_tag_vs_number_ratings.png': 704,
+    'ncf_img.png': 600,
+    'img3.jpg': 550,
+}
+for image in IMAGES:
+    # the resized copy of prepare_images.py, the original until it was created
+    display_path = f'streamlit_app/images/display/{image}'
+    register(f'images/{image}', display_path if os.path.exists(os.path.join(REPO_DIR, display_path))
+             else f'streamlit_app/images/{image}', _read_bytes)
@@ -0,0 +1,105 @@
+"""On-the-fly aggregates of the ratings for the filters of the data exploration page.
+
+The ratings are a Parquet dataset partitioned by year (written by
+notebooks/exploration_data.py), queried with pyarrow.dataset: the year range
+selects the partitions to read (partition pruning), the genre filter becomes
+a movieId predicate evaluated while scanning (and against the row group
+statistics of the movieId-sorted files) and only the movieId, rating and year
+columns are read. Everything after the scan runs on Arrow tables in C++:
+one group-by per movie, the minimum number of ratings per movie, and the
+small result tables of aggregate().
+
+The page calls aggregate() through data_access.explore, which caches the
+result per filter combination.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as pads
+
+RATING_VALUES = np.arange(1, 11) / 2
+# the partitioning of notebooks/exploration_data.py
+PARTITIONING = pads.partitioning(pa.schema([('year', pa.int16())]), flavor='hive')
+
+
+def open_dataset(path):
+    """The partitioned ratings dataset (only reads the file metadata)."""
+    return pads.dataset(path, format='parquet', partitioning=PARTITIONING)
+
+
+def years(dataset):
+    """(first, last) year of the partitions of the dataset."""
+    values = [pads.get_partition_keys(fragment.partition_expression)['year'] for fragment in dataset.get_fragments()]
+    return min(values), max(values)
+
+
+def genre_names(movies):
+    """Sorted genre names of the movies_dim table, as the genre filter matches them (e.g. '(no genres listed)')."""
+    return sorted(pc.unique(pc.list_flatten(pc.split_pattern(movies.column('genres'), '|'))).to_pylist())
+
+
+def movie_ids_of_genres(movies, genres):
+    """movieIds of the movies with at least one of the genres (movies is the movies_dim table)."""
+    genre_lists = pc.split_pattern(movies.column('genres'), '|')
+    selected = pc.filter(pc.list_parent_indices(genre_lists),
+                         pc.is_in(pc.list_flatten(genre_lists), value_set=pa.array(list(genres))))
+    return pc.unique(pc.take(movies.column('movieId'), selected))
+
+
+def scan(dataset, year_range=None, movie_ids=None, columns=('movieId', 'rating', 'year')):
+    """Ratings of the year range and movies as Arrow table, with predicate and projection pushdown."""
+    expression = None
+    if year_range is not None:
+        expression = (pc.field('year') >= year_range[0]) & (pc.field('year') <= year_range[1])
+    if movie_ids is not None:
+        predicate = pc.field('movieId').isin(movie_ids)
+        expression = predicate if expression is None else expression & predicate
+    return dataset.to_table(columns=list(columns), filter=expression)
+
+
+def _quartiles(values):
+    q1, median, q3 = np.quantile(values, [0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    # whiskers like a box plot: the most extreme values within 1.5 IQR of the box
+    inside = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+    return {'q1': q1, 'median': median, 'q3': q3, 'lowerfence': inside.min(), 'upperfence': inside.max(),
+            'mean': values.mean(), 'n_movies': len(values)}
+
+
+def aggregate(dataset, movies, genres=(), year_range=None, min_ratings=1, n_top=20):
+    """Aggregates of the ratings of the given genres (all if empty), years and movies with >= min_ratings ratings.
+
+    Returns a dict of small pandas DataFrames: 'rating_histogram' (rating,
+    n_ratings), 'ratings_per_year' (year, n_ratings, mean_rating),
+    'movie_ratings_by_genre' (box plot statistics of the average rating per
+    movie, one row per genre), 'top_movies' (the n_top most rated movies) and
+    'totals' (numbers of ratings and movies).
+    """
+    movie_ids = movie_ids_of_genres(movies, genres) if genres else None
+    ratings = scan(dataset, year_range, movie_ids)
+
+    # per movie: number and mean of the ratings, only movies with enough ratings count
+    per_movie = ratings.group_by('movieId').aggregate([('rating', 'count'), ('rating', 'mean')])
+    per_movie = per_movie.filter(pc.greater_equal(per_movie.column('rating_count'), min_ratings))
+    if min_ratings > 1:
+        ratings = ratings.filter(pc.is_in(ratings.column('movieId'), value_set=per_movie.column('movieId')))
+
+    histogram = ratings.group_by('rating').aggregate([('rating', 'count')]).to_pandas()
+    histogram = (histogram.rename(columns={'rating_count': 'n_ratings'}).set_index('rating')
+                 .reindex(RATING_VALUES.astype(np.float32), fill_value=0).reset_index())
+    per_year = (ratings.group_by('year').aggregate([('rating', 'count'), ('rating', 'mean')]).to_pandas()
+                .rename(columns={'rating_count': 'n_ratings', 'rating_mean': 'mean_rating'}).sort_values('year'))
+
+    movie_table = per_movie.join(movies.select(['movieId', 'title', 'genres']), 'movieId').to_pandas()
+    by_genre = movie_table.assign(genre=movie_table['genres'].str.split('|')).explode('genre')
+    if genres:
+        by_genre = by_genre[by_genre['genre'].isin(genres)]
+    box = [{'genre': genre, **_quartiles(group['rating_mean'].to_numpy())} for genre, group in by_genre.groupby('genre')]
+    top = (movie_table.nlargest(n_top, 'rating_count')[['movieId', 'title', 'rating_count', 'rating_mean']]
+           .rename(columns={'rating_count': 'n_ratings', 'rating_mean': 'mean_rating'}))
+    totals = pd.DataFrame({'n_ratings': [ratings.num_rows], 'n_movies': [per_movie.num_rows]})
+    return {'rating_histogram': histogram, 'ratings_per_year': per_year,
+            'movie_ratings_by_genre': pd.DataFrame(box, columns=['genre', 'q1', 'median', 'q3', 'lowerfence',
+                                                                 'upperfence', 'mean', 'n_movies']),
+            'top_movies': top.reset_index(drop=True), 'totals': totals}
@@ -0,0 +1,206 @@
+"""Lightweight timing of the hot paths of the app: data loads, figure builds, computations and page runs.
+
+Code is timed with the timed() context manager or the instrumented()
+decorator. Every call becomes a record with its wall time, the page and
+session it ran for and, for the cached loads of data_access, whether the cache
+was hit and how many bytes were read on a miss:
+
+    with instrumentation.timed('compute', 'recommend'):
+        items, scores = recommender.recommend(user, n)
+
+Records are kept in memory (the last MAX_RECORDS and totals per kind, name and
+page, shared by all sessions of the process) and can be written
+
+- as rolling JSON-lines log: environment variable APP_METRICS_LOG=<file>
+  (rotated at 10 MB, 3 backups),
+- as Prometheus text file: APP_METRICS_PROMETHEUS=<file>, rewritten after
+  every page run (e.g. for the textfile collector of the node exporter).
+
+The debug panel in the sidebar shows the records of the current run and the
+totals of the process. It is shown with APP_DEBUG=1 or the query parameter
+?debug=1. Without these settings the overhead is a perf_counter call and an
+append to a deque per record.
+"""
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import streamlit as st
+
+LOG_FILE = os.environ.get('APP_METRICS_LOG')
+PROMETHEUS_FILE = os.environ.get('APP_METRICS_PROMETHEUS')
+DEBUG = os.environ.get('APP_DEBUG', '0') not in ('', '0')
+MAX_RECORDS = 5000
+
+_records = deque(maxlen=MAX_RECORDS)
+# (kind, name, page) -> totals of the records
+_totals = {}
+_lock = threading.Lock()
+# per script thread: stack of the open records, page and records of the current run
+_local = threading.local()
+_logger = None
+
+
+def _session_id():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else None
+
+
+def start_run(page):
+    """Start the records of a script run of a page (called by streamlit_presentation.py)."""
+    _local.page = page
+    _local.run_records = []
+
+
+@contextmanager
+def timed(kind, name, **tags):
+    """Time the block as record of a kind ('load', 'figure', 'compute', 'render', 'page') and name.
+
+    Yields the record (a dict), so the block can add tags, e.g. record['rows'].
+    """
+    record = {'kind': kind, 'name': name, 'page': getattr(_local, 'page', None), 'session': _session_id(),
+              'cache': None, 'bytes': None, **tags}
+    stack = _local.__dict__.setdefault('stack', [])
+    stack.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        record['time'] = time.time()
+        stack.pop()
+        _store(record)
+
+
+def instrumented(kind, name=None):
+    """Decorator that times every call of a function (as timed(kind, name or the function name))."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(kind, name or function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def cache_miss(bytes_read=None):
+    """Mark the innermost open record as cache miss (called from the body of a cached function)."""
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        stack[-1]['cache'] = 'miss'
+        stack[-1]['bytes'] = bytes_read
+
+
+def _store(record):
+    with _lock:
+        _records.append(record)
+        totals = _totals.setdefault((record['kind'], record['name'], record['page']),
+                                    {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'hits': 0, 'misses': 0, 'bytes': 0})
+        totals['count'] += 1
+        totals['seconds'] += record['seconds']
+        totals['max_seconds'] = max(totals['max_seconds'], record['seconds'])
+        totals['hits'] += record['cache'] == 'hit'
+        totals['misses'] += record['cache'] == 'miss'
+        totals['bytes'] += record['bytes'] or 0
+    run_records = getattr(_local, 'run_records', None)
+    if run_records is not None:
+        run_records.append(record)
+    if LOG_FILE:
+        _log(record)
+
+
+def _log(record):
+    global _logger
+    if _logger is None:
+        logger = logging.getLogger('streamlit_app.metrics')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=10 * 2**20, backupCount=3)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        _logger = logger
+    _logger.info(json.dumps(record, default=str))
+
+
+def records():
+    """The last MAX_RECORDS records of all sessions (oldest first)."""
+    with _lock:
+        return list(_records)
+
+
+def totals():
+    """Totals per (kind, name, page): count, seconds, max_seconds, hits, misses and bytes."""
+    with _lock:
+        return {key: dict(value) for key, value in _totals.items()}
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text():
+    """The totals in the Prometheus text exposition format."""
+    metrics = [('app_operation_seconds_total', 'counter', 'Wall time of the timed operations.', 'seconds'),
+               ('app_operations_total', 'counter', 'Number of timed operations.', 'count'),
+               ('app_operation_max_seconds', 'gauge', 'Slowest timed operation.', 'max_seconds'),
+               ('app_cache_hits_total', 'counter', 'Cache hits of the cached loads.', 'hits'),
+               ('app_cache_misses_total', 'counter', 'Cache misses of the cached loads.', 'misses'),
+               ('app_bytes_read_total', 'counter', 'Bytes read from files on cache misses.', 'bytes')]
+    items = sorted(totals().items(), key=lambda item: tuple(str(value) for value in item[0]))
+    lines = []
+    for metric, metric_type, description, field in metrics:
+        lines += [f'# HELP {metric} {description}', f'# TYPE {metric} {metric_type}']
+        for (kind, name, page), values in items:
+            labels = f'kind="{_label_value(kind)}",name="{_label_value(name)}",page="{_label_value(page or "")}"'
+            lines.append(f'{metric}{{{labels}}} {values[field]}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path):
+    """Write the Prometheus text file (replaced atomically, scrapers never see a partial file)."""
+    # the sessions are threads of one process, every thread writes its own temporary file
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(prometheus_text())
+    os.replace(tmp_path, path)
+
+
+def debug_enabled():
+    """Whether the debug panel is shown: APP_DEBUG=1 or the query parameter ?debug=1."""
+    return DEBUG or st.query_params.get('debug', '0') not in ('', '0')
+
+
+def finish_run():
+    """Export the metrics and show the debug panel after a page run (called by streamlit_presentation.py)."""
+    if PROMETHEUS_FILE:
+        write_prometheus(PROMETHEUS_FILE)
+    if debug_enabled():
+        debug_panel()
+
+
+def debug_panel():
+    """Sidebar panel with the records of this run and the slowest operations of the process."""
+    import pandas as pd
+
+    with st.sidebar.expander('Timings (debug)'):
+        run = pd.DataFrame(getattr(_local, 'run_records', []), columns=['kind', 'name', 'seconds', 'cache', 'bytes'])
+        st.markdown(f'**This run:** {len(run)} operations')
+        st.dataframe(run.assign(ms=(run['seconds'] * 1000).round(1)).drop(columns='seconds'), hide_index=True)
+
+        process = pd.DataFrame([{'kind': kind, 'name': name, 'page': page, **values}
+                                for (kind, name, page), values in totals().items()])
+        if len(process):
+            process['mean_ms'] = (process['seconds'] / process['count'] * 1000).round(1)
+            process['max_ms'] = (process['max_seconds'] * 1000).round(1)
+            process = process.sort_values('seconds', ascending=False)
+            st.markdown(f"**All sessions:** {len({record['session'] for record in records()})} sessions")
+            st.dataframe(process[['kind', 'name', 'page', 'count', 'mean_ms', 'max_ms', 'hits', 'misses', 'bytes']],
+                         hide_index=True)
@@ -0,0 +1,161 @@
+"""Top-N recommendations from a trained NCF model (see notebooks/ML_all_features.ipynb).
+
+The first dense layer of the NCF network acts on the concatenation of user
+embedding, item embedding and movie features, so it splits into a user part
+and an item part:
+
+    W1 . [user_emb, item_emb, features] + b1 = user_emb . W_u + (item_emb . W_i + features . W_f + b1)
+
+Both towers are computed once for all users / items when the model is
+exported. Scoring all items for a batch of users is then a broadcast sum of
+the tower outputs followed by the small remaining dense layers, in chunks of
+items, without model.predict on explicit (user, item, features) triples.
+
+The exported .npz file holds the tower outputs and the weights of the remaining
+layers as float32 arrays and only needs NumPy and SciPy to be loaded, Keras /
+TensorFlow is not imported here.
+"""
+import numpy as np
+import scipy.sparse as sp
+
+from recommender import top_n
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0, out=x),
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+    'tanh': np.tanh,
+}
+
+
+class NCFRecommender:
+    """Top-N recommender on the exported towers and dense layers of an NCF model.
+
+    user_tower (users x hidden) and item_tower (items x hidden) are the user and
+    item parts of the first dense layer, weights / biases / activations the
+    dense layers, the first activation belongs to the first dense layer. Rows
+    of user_tower / history belong to user_ids, rows of item_tower to item_ids
+    (raw ids, i.e. userId / movieId).
+    """
+
+    def __init__(self, user_tower, item_tower, weights, biases, activations, user_ids, item_ids, history, titles=None,
+                 max_pairs=2**20):
+        self.user_tower = np.ascontiguousarray(user_tower, dtype=np.float32)
+        self.item_tower = np.ascontiguousarray(item_tower, dtype=np.float32)
+        self.weights = [np.ascontiguousarray(w, dtype=np.float32) for w in weights]
+        self.biases = [np.ascontiguousarray(b, dtype=np.float32) for b in biases]
+        self.activations = [str(activation) for activation in activations]
+        self.user_ids = np.asarray(user_ids)
+        self.item_ids = np.asarray(item_ids)
+        self.history = sp.csr_matrix(history) # user x item, rated movies
+        self.titles = titles # optional movie titles aligned with item_ids
+        self.max_pairs = max_pairs # (user, item) pairs per chunk of the scoring
+        # raw id -> row lookup
+        self._user_index = {uid: idx for idx, uid in enumerate(self.user_ids.tolist())}
+
+    @classmethod
+    def from_keras(cls, model, user_ids, item_ids, history, movie_features=None, titles=None):
+        """Compute the towers of a trained Keras NCF model and extract its dense layers.
+
+        The model has the layers 'user_embedding' and 'item_embedding' whose
+        flattened outputs are concatenated in this order with the optional
+        movie features (items x features, rows in the order of the item codes)
+        and fed through a stack of Dense layers (dropout is inactive at
+        inference). user_ids / item_ids are the raw ids of the embedding rows,
+        history a (users x items) matrix of the rated movies and titles an
+        optional mapping movieId -> title (e.g. a pandas Series).
+        """
+        user_embedding = model.get_layer('user_embedding').get_weights()[0]
+        item_embedding = model.get_layer('item_embedding').get_weights()[0]
+        dense = [layer for layer in model.layers if type(layer).__name__ == 'Dense']
+        weights = [layer.get_weights()[0] for layer in dense]
+        biases = [layer.get_weights()[1] for layer in dense]
+        activations = [layer.get_config()['activation'] for layer in dense]
+        for activation in activations:
+            if activation not in ACTIVATIONS:
+                raise ValueError(f"unsupported activation '{activation}', use one of {list(ACTIVATIONS)}")
+
+        # split the first dense layer into the user and the item part
+        n_user, n_item = user_embedding.shape[1], item_embedding.shape[1]
+        first = weights[0]
+        user_tower = user_embedding @ first[:n_user]
+        item_tower = item_embedding @ first[n_user:n_user + n_item] + biases[0]
+        if movie_features is not None:
+            item_tower += np.asarray(movie_features, dtype=np.float32) @ first[n_user + n_item:]
+        elif first.shape[0] != n_user + n_item:
+            raise ValueError('the model has additional features inputs, movie_features are needed')
+
+        if titles is not None:
+            titles = np.array([titles.get(movie_id, str(movie_id)) for movie_id in np.asarray(item_ids).tolist()])
+        return cls(user_tower, item_tower, weights[1:], biases[1:], activations, user_ids, item_ids, history, titles)
+
+    def save(self, path):
+        """Save the recommender as .npz file."""
+        arrays = dict(user_tower=self.user_tower, item_tower=self.item_tower, activations=np.array(self.activations),
+                      user_ids=self.user_ids, item_ids=self.item_ids,
+                      history_indptr=self.history.indptr, history_indices=self.history.indices)
+        for layer, (w, b) in enumerate(zip(self.weights, self.biases)):
+            arrays[f'weights_{layer}'], arrays[f'biases_{layer}'] = w, b
+        if self.titles is not None:
+            arrays['titles'] = np.asarray(self.titles, dtype=str)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Load a recommender saved with save()."""
+        data = np.load(path)
+        shape = (len(data['user_ids']), len(data['item_ids']))
+        history = sp.csr_matrix((np.ones(len(data['history_indices']), dtype=np.int8), data['history_indices'],
+                                 data['history_indptr']), shape=shape)
+        n_layers = len(data['activations']) - 1
+        titles = data['titles'] if 'titles' in data.files else None
+        return cls(data['user_tower'], data['item_tower'], [data[f'weights_{layer}'] for layer in range(n_layers)],
+                   [data[f'biases_{layer}'] for layer in range(n_layers)], data['activations'].tolist(),
+                   data['user_ids'], data['item_ids'], history, titles)
+
+    def user_index(self, user_id):
+        """Row of a raw userId, None for unknown users."""
+        return self._user_index.get(user_id)
+
+    def _head(self, hidden):
+        # remaining layers on the summed tower outputs (pairs x hidden), returns the scores of the pairs
+        hidden = ACTIVATIONS[self.activations[0]](hidden)
+        for w, b, activation in zip(self.weights, self.biases, self.activations[1:]):
+            hidden = ACTIVATIONS[activation](hidden @ w + b)
+        return hidden[:, 0]
+
+    def predict(self, users, items):
+        """Scores of (user row, item row) pairs, like model.predict on the pairs."""
+        users, items = np.atleast_1d(users), np.atleast_1d(items)
+        return self._head(self.user_tower[users] + self.item_tower[items])
+
+    def scores(self, users):
+        """Scores of all items for a batch of user rows (users x items float32)."""
+        users = np.atleast_1d(users)
+        user_tower = self.user_tower[users][:, None, :]
+        n_items, hidden = self.item_tower.shape
+        scores = np.empty((len(users), n_items), dtype=np.float32)
+        # chunks of items, so that the (users x items x hidden) activations stay small
+        step = max(1, self.max_pairs // len(users))
+        for start in range(0, n_items, step):
+            stop = min(start + step, n_items)
+            pairs = (user_tower + self.item_tower[None, start:stop]).reshape(-1, hidden)
+            scores[:, start:stop] = self._head(pairs).reshape(len(users), stop - start)
+        return scores
+
+    def recommend(self, users, n=10, exclude_rated=True):
+        """Top-n item rows and scores for a batch of user rows.
+
+        Returns two (users x n) arrays sorted by decreasing score. Movies the
+        user rated in the training data are skipped if exclude_rated is True.
+        """
+        users = np.atleast_1d(users)
+        return top_n(self.scores(users), self.history[users] if exclude_rated else None, n)
+
+    def recommend_for_user(self, user_id, n=10, exclude_rated=True):
+        """Top-n (movieId, score) pairs for a raw userId."""
+        user = self.user_index(user_id)
+        if user is None:
+            raise KeyError(f'unknown user {user_id}')
+        items, scores = self.recommend(user, n, exclude_rated)
+        return list(zip(self.item_ids[items[0]].tolist(), scores[0].tolist()))
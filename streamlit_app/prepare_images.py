@@ -0,0 +1,49 @@
+"""Resize the images of the Streamlit app to the width they are shown with.
+
+The originals in images/ are up to 1280 px wide, the pages show them at most
+704 px wide (data_access.IMAGES). The resized copies in images/display/ are
+served as bytes by data_access, so the app neither decodes nor scales the
+originals and sends smaller files to the browser. Rerun after adding or
+changing an image.
+
+Usage from the command line (in the streamlit_app folder):
+
+    python prepare_images.py
+"""
+import argparse
+import os
+
+from PIL import Image
+
+from data_access import IMAGES
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images')
+
+
+def resize_image(source, target, width):
+    """Write source scaled to width (never enlarged) to target, returns the sizes of both files in bytes."""
+    with Image.open(source) as image:
+        if image.width > width:
+            image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        if target.lower().endswith(('.jpg', '.jpeg')):
+            image.convert('RGB').save(target, quality=85, optimize=True, progressive=True)
+        else:
+            # the PNGs are charts and diagrams, a palette of 256 colors keeps them sharp at a fraction of the size
+            image.quantize(256, method=Image.Quantize.FASTOCTREE).save(target, optimize=True)
+    return os.path.getsize(source), os.path.getsize(target)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resize the images of the Streamlit app to their display width.')
+    parser.add_argument('--images-dir', default=IMAGES_DIR)
+    args = parser.parse_args()
+
+    output_dir = os.path.join(args.images_dir, 'display')
+    os.makedirs(output_dir, exist_ok=True)
+    for image, width in IMAGES.items():
+        before, after = resize_image(os.path.join(args.images_dir, image), os.path.join(output_dir, image), width)
+        print(f'{image}: {before / 1024:.0f} KB -> {after / 1024:.0f} KB ({width} px)')
+
+
+if __name__ == '__main__':
+    main()
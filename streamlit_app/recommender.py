@@ -0,0 +1,377 @@
+"""Top-N recommendations from trained matrix factorization models (SVD / NMF).
+
+The learned parameters of a Surprise model (pu, qi, bu, bi and the global
+mean) are exported once into contiguous float32 NumPy arrays. Scoring all
+movies for a batch of users is then a single matrix multiplication, movies the
+user already rated are masked with the CSR rating history and the top-N are
+selected with argpartition, without one algo.predict call per (user, item).
+
+New ratings are applied without retraining: a new or changed user is folded
+in by solving a small regularized least-squares problem against the frozen
+item parameters (fold_in), and partial_fit runs a few SGD epochs over the
+ratings of recently touched items. Updates never modify the served arrays in
+place, they build new ones and replace the whole state in one assignment, so
+concurrent recommend calls always see either the old or the new model.
+
+The exported .npz file only needs NumPy and SciPy to be loaded, Surprise is not
+imported here.
+"""
+import threading
+from collections import namedtuple
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import nnls
+
+
+def top_n(scores, rated=None, n=10):
+    """Top-n columns and scores of every row of a (users x items) score matrix.
+
+    Returns two (users x n) arrays sorted by decreasing score. rated is an
+    optional CSR matrix of the same shape, its items are skipped. scores is
+    modified in place.
+    """
+    if rated is not None:
+        scores[np.repeat(np.arange(scores.shape[0]), np.diff(rated.indptr)), rated.indices] = -np.inf
+    n = min(n, scores.shape[1])
+    # argpartition selects the n best in linear time, only those are sorted
+    top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def fold_in(qi, bi, global_mean, ratings, reg=0.02, biased=True):
+    """Factors and bias of a user from ratings of the items with factors qi and biases bi.
+
+    Minimizes the loss of Surprise's SVD for this user with the item
+    parameters frozen. Its SGD shrinks the parameters by reg at every rating,
+    so the penalty of a user with n ratings is n * reg:
+    sum (r - global_mean - bu - bi - qi . pu)^2 + n * reg * (bu^2 + |pu|^2),
+    a ridge regression with n_factors + 1 unknowns, solved in closed form.
+    For unbiased models (NMF) the factors are the non-negative least-squares
+    solution of sum (r - qi . pu)^2 + n * reg * |pu|^2.
+    Returns (pu, bu) as float32 vector and float.
+    """
+    qi = np.asarray(qi, dtype=np.float64)
+    ratings = np.asarray(ratings, dtype=np.float64)
+    penalty = reg * len(ratings)
+    if not biased:
+        # ridge regression as least squares with the penalty * identity appended
+        x = np.vstack([qi, np.sqrt(penalty) * np.eye(qi.shape[1])])
+        pu, _ = nnls(x, np.concatenate([ratings, np.zeros(qi.shape[1])]))
+        return pu.astype(np.float32), 0.0
+    x = np.hstack([qi, np.ones((len(qi), 1))])
+    y = ratings - global_mean - np.asarray(bi, dtype=np.float64)
+    w = np.linalg.solve(x.T @ x + penalty * np.eye(x.shape[1]), x.T @ y)
+    return w[:-1].astype(np.float32), float(w[-1])
+
+
+# the served arrays, replaced as a whole by updates; changed is user row -> (item rows, ratings)
+# of users updated since the history matrix was last rebuilt
+_State = namedtuple('_State', 'pu bu qi bi user_ids user_index history changed item_offset')
+
+
+class FactorRecommender:
+    """Top-N recommender on the factors of a biased or unbiased MF model.
+
+    Scores follow Surprise's estimate: global_mean + bu + bi + qi . pu for
+    biased models and qi . pu otherwise. Rows of pu / history belong to
+    user_ids, rows of qi to item_ids (raw ids, i.e. userId / movieId). The
+    history holds the ratings of the training data (or ones for models
+    exported without them, which can be served and folded into but not
+    partially refitted).
+    """
+
+    def __init__(self, pu, qi, bu, bi, global_mean, user_ids, item_ids, history, biased=True, titles=None):
+        self.global_mean = np.float32(global_mean)
+        self.item_ids = np.asarray(item_ids)
+        self.biased = bool(biased)
+        self.titles = titles # optional movie titles aligned with item_ids
+        self._item_index = {iid: idx for idx, iid in enumerate(self.item_ids.tolist())}
+        # serializes the updates, readers take the current state without locking
+        self._lock = threading.Lock()
+        # items rated in updates since the last partial_fit
+        self._touched = set()
+        user_ids = np.asarray(user_ids)
+        self._state = self._make_state(np.ascontiguousarray(pu, dtype=np.float32), np.ascontiguousarray(bu, dtype=np.float32),
+                                       np.ascontiguousarray(qi, dtype=np.float32), np.ascontiguousarray(bi, dtype=np.float32),
+                                       user_ids, {uid: idx for idx, uid in enumerate(user_ids.tolist())},
+                                       sp.csr_matrix(history), {}) # history: user x item, rated movies
+
+    def _make_state(self, pu, bu, qi, bi, user_ids, user_index, history, changed):
+        # item part of the score that does not depend on the user
+        item_offset = bi + self.global_mean if self.biased else np.zeros(len(qi), dtype=np.float32)
+        return _State(pu, bu, qi, bi, user_ids, user_index, history, changed, item_offset)
+
+    # the arrays of the current state
+    pu = property(lambda self: self._state.pu)
+    bu = property(lambda self: self._state.bu)
+    qi = property(lambda self: self._state.qi)
+    bi = property(lambda self: self._state.bi)
+    user_ids = property(lambda self: self._state.user_ids)
+
+    @property
+    def history(self):
+        """User x item CSR matrix of the ratings, including the updated users."""
+        return self._history(self._state)
+
+    @classmethod
+    def from_surprise(cls, algo, trainset, titles=None):
+        """Extract factors, biases and rating history from a fitted Surprise SVD / NMF model.
+
+        titles is an optional mapping movieId -> title (e.g. a pandas Series).
+        """
+        n_users, n_items = trainset.n_users, trainset.n_items
+        user_ids = np.array([trainset.to_raw_uid(u) for u in range(n_users)])
+        item_ids = np.array([trainset.to_raw_iid(i) for i in range(n_items)])
+        # rating history as CSR matrix in inner ids
+        rows, cols, ratings = [], [], []
+        for u, user_ratings in trainset.ur.items():
+            rows.extend([u] * len(user_ratings))
+            cols.extend(i for i, _ in user_ratings)
+            ratings.extend(r for _, r in user_ratings)
+        history = sp.csr_matrix((np.asarray(ratings, dtype=np.float32), (rows, cols)), shape=(n_users, n_items))
+        biased = getattr(algo, 'biased', True)
+        bu = algo.bu if biased else np.zeros(n_users)
+        bi = algo.bi if biased else np.zeros(n_items)
+        if titles is not None:
+            titles = np.array([titles.get(movie_id, str(movie_id)) for movie_id in item_ids.tolist()])
+        return cls(algo.pu, algo.qi, bu, bi, trainset.global_mean, user_ids, item_ids, history, biased, titles)
+
+    def save(self, path):
+        """Save the recommender (including the updates) as .npz file."""
+        history = self.history
+        arrays = dict(pu=self.pu, qi=self.qi, bu=self.bu, bi=self.bi, global_mean=self.global_mean,
+                      user_ids=self.user_ids, item_ids=self.item_ids, biased=self.biased,
+                      history_indptr=history.indptr, history_indices=history.indices)
+        if history.dtype == np.float32:
+            arrays['history_ratings'] = history.data
+        if self.titles is not None:
+            arrays['titles'] = np.asarray(self.titles, dtype=str)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Load a recommender saved with save()."""
+        data = np.load(path)
+        shape = (len(data['user_ids']), len(data['item_ids']))
+        # files exported before the ratings were saved only mark the rated movies
+        ratings = (data['history_ratings'] if 'history_ratings' in data.files
+                   else np.ones(len(data['history_indices']), dtype=np.int8))
+        history = sp.csr_matrix((ratings, data['history_indices'], data['history_indptr']), shape=shape)
+        titles = data['titles'] if 'titles' in data.files else None
+        return cls(data['pu'], data['qi'], data['bu'], data['bi'], data['global_mean'], data['user_ids'],
+                   data['item_ids'], history, bool(data['biased']), titles)
+
+    def user_index(self, user_id):
+        """Row of a raw userId, None for unknown users."""
+        return self._state.user_index.get(user_id)
+
+    def item_index(self, movie_id):
+        """Row of a raw movieId, None for unknown movies."""
+        return self._item_index.get(movie_id)
+
+    def popular_items(self, n=100):
+        """Rows of the n items with the most ratings in the training data, most rated first."""
+        state = self._state
+        # computed once per state
+        if getattr(self, '_popular', (None,))[0] is not state:
+            counts = np.bincount(state.history.indices, minlength=len(self.item_ids))
+            self._popular = (state, np.argsort(-counts, kind='stable'))
+        return self._popular[1][:n]
+
+    @staticmethod
+    def _rated(state, users):
+        # rating history rows of a batch of users, updated users from state.changed
+        history = state.history
+        if not state.changed or not any(int(user) in state.changed for user in users):
+            return history[users]
+        rows = [state.changed[int(user)] if int(user) in state.changed else (history[user].indices, history[user].data)
+                for user in users]
+        indptr = np.concatenate([[0], np.cumsum([len(items) for items, _ in rows])])
+        return sp.csr_matrix((np.concatenate([ratings for _, ratings in rows]).astype(np.float32),
+                              np.concatenate([items for items, _ in rows]), indptr), shape=(len(users), history.shape[1]))
+
+    @staticmethod
+    def _history(state):
+        # history matrix with the rows of the updated users replaced
+        if not state.changed:
+            return state.history
+        history = state.history.tocoo()
+        keep = ~np.isin(history.row, list(state.changed))
+        users = list(state.changed)
+        rows = np.concatenate([history.row[keep]] + [np.full(len(state.changed[user][0]), user) for user in users])
+        cols = np.concatenate([history.col[keep]] + [state.changed[user][0] for user in users])
+        if history.dtype == np.float32:
+            data = np.concatenate([history.data[keep]] + [state.changed[user][1] for user in users])
+        else:
+            data = np.ones(len(rows), dtype=history.dtype)
+        return sp.csr_matrix((data, (rows, cols)), shape=history.shape)
+
+    def rated(self, user):
+        """Item rows and ratings of a user row.
+
+        For models exported without ratings these are ones, or NaN for the
+        earlier ratings of an updated user.
+        """
+        row = self._rated(self._state, [user])
+        return row.indices, row.data
+
+    def _scores(self, state, users):
+        scores = state.pu[users] @ state.qi.T
+        scores += state.item_offset
+        if self.biased:
+            scores += state.bu[users][:, None]
+        return scores
+
+    def scores(self, users):
+        """Scores of all items for a batch of user rows (users x items float32)."""
+        return self._scores(self._state, np.atleast_1d(users))
+
+    def recommend(self, users, n=10, exclude_rated=True):
+        """Top-n item rows and scores for a batch of user rows.
+
+        Returns two (users x n) arrays sorted by decreasing score. Movies the
+        user rated in the training data are skipped if exclude_rated is True.
+        """
+        state = self._state
+        users = np.atleast_1d(users)
+        return top_n(self._scores(state, users), self._rated(state, users) if exclude_rated else None, n)
+
+    def recommend_for_user(self, user_id, n=10, exclude_rated=True):
+        """Top-n (movieId, score) pairs for a raw userId."""
+        user = self.user_index(user_id)
+        if user is None:
+            raise KeyError(f'unknown user {user_id}')
+        items, scores = self.recommend(user, n, exclude_rated)
+        return list(zip(self.item_ids[items[0]].tolist(), scores[0].tolist()))
+
+    def _item_rows(self, movie_ids, ratings):
+        # item rows and ratings of the known movies, the last rating of a movie counts
+        known = {}
+        for movie_id, rating in zip(np.asarray(movie_ids).tolist(), np.asarray(ratings, dtype=np.float32).tolist()):
+            if movie_id in self._item_index:
+                known[self._item_index[movie_id]] = rating
+        items = np.array(sorted(known), dtype=np.int32)
+        return items, np.array([known[item] for item in items.tolist()], dtype=np.float32)
+
+    def fold_in(self, movie_ids, ratings, reg=0.02):
+        """Factors and bias of a user with the given ratings (raw movieIds, unknown movies are ignored).
+
+        Returns (pu, bu, item rows of the rated movies); see the module function fold_in.
+        """
+        return self._fold_in(self._state, movie_ids, ratings, reg)
+
+    def _fold_in(self, state, movie_ids, ratings, reg):
+        # against the item parameters of one state, a concurrent partial_fit swaps in a new one
+        items, ratings = self._item_rows(movie_ids, ratings)
+        if not len(items):
+            raise ValueError('none of the rated movies is known to the model')
+        pu, bu = fold_in(state.qi[items], state.bi[items], self.global_mean, ratings, reg, self.biased)
+        return pu, bu, items
+
+    def recommend_for_ratings(self, movie_ids, ratings, n=10, reg=0.02):
+        """Top-n (movieId, score) pairs for a visitor who is not part of the model, from their ratings.
+
+        The visitor is folded in on the fly, the model is not changed.
+        """
+        state = self._state
+        pu, bu, items = self._fold_in(state, movie_ids, ratings, reg)
+        scores = (pu @ state.qi.T + state.item_offset + (bu if self.biased else 0))[None, :]
+        rated = sp.csr_matrix((np.ones(len(items), dtype=np.int8), items, [0, len(items)]), shape=(1, len(self.item_ids)))
+        top, top_scores = top_n(scores, rated, n)
+        return list(zip(self.item_ids[top[0]].tolist(), top_scores[0].tolist()))
+
+    def update_users(self, updates, reg=0.02):
+        """Fold in new ratings of new or known users: {userId: (movieIds, ratings)}.
+
+        New ratings are merged with the stored ratings of a user (a new rating
+        of a movie replaces the old one) and the user's factors and bias are
+        refitted to all of them against the frozen item parameters. The rated
+        movies are remembered for the next partial_fit. The user arrays are
+        copied once per call, so batches of users are cheaper than single
+        calls.
+        """
+        with self._lock:
+            state = self._state
+            user_index, user_ids = dict(state.user_index), state.user_ids
+            new_ids = [user_id for user_id in updates if user_id not in user_index]
+            for user_id in new_ids:
+                user_index[user_id] = len(user_index)
+            n_new = len(new_ids)
+            pu = np.vstack([state.pu, np.zeros((n_new, state.pu.shape[1]), dtype=np.float32)])
+            bu = np.concatenate([state.bu, np.zeros(n_new, dtype=np.float32)])
+            if n_new:
+                user_ids = np.concatenate([user_ids, np.asarray(new_ids, dtype=user_ids.dtype)])
+            changed = dict(state.changed)
+            for user_id, (movie_ids, ratings) in updates.items():
+                user = user_index[user_id]
+                if user < len(state.user_ids):
+                    row = self._rated(state, [user])
+                    old_items, old_ratings = row.indices, row.data.astype(np.float32)
+                    if user not in state.changed and state.history.dtype != np.float32:
+                        # the ratings of models exported without them are unknown
+                        old_ratings = np.full(len(old_items), np.nan, dtype=np.float32)
+                else:
+                    old_items, old_ratings = np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+                new_items, new_ratings = self._item_rows(movie_ids, ratings)
+                keep = ~np.isin(old_items, new_items)
+                items = np.concatenate([old_items[keep], new_items])
+                order = np.argsort(items, kind='stable')
+                items, all_ratings = items[order].astype(np.int32), np.concatenate([old_ratings[keep], new_ratings])[order]
+                known = ~np.isnan(all_ratings)
+                if known.any():
+                    pu[user], bu[user] = fold_in(state.qi[items[known]], state.bi[items[known]], self.global_mean,
+                                                 all_ratings[known], reg, self.biased)
+                changed[user] = (items, all_ratings)
+                self._touched.update(new_items.tolist())
+            history = state.history
+            if n_new:
+                history = sp.csr_matrix((history.data, history.indices, np.concatenate([history.indptr, np.repeat(history.indptr[-1], n_new)])),
+                                        shape=(len(user_ids), history.shape[1]))
+            self._state = self._make_state(pu, bu, state.qi, state.bi, user_ids, user_index, history, changed)
+
+    def update_user(self, user_id, movie_ids, ratings, reg=0.02):
+        """Fold in new ratings of one new or known user (see update_users)."""
+        self.update_users({user_id: (movie_ids, ratings)}, reg)
+
+    def partial_fit(self, n_epochs=1, lr=0.005, reg=0.02, movie_ids=None, batch_size=256, seed=None):
+        """SGD epochs over all ratings of the recently touched movies (or of movie_ids).
+
+        Updates the factors and biases of these movies and of the users who
+        rated them with the update rules of Surprise's SVD (biased models with
+        rating history only), in mini-batches of batch_size ratings. Meant to
+        run periodically after update_users; the history of the updated users
+        is merged into the history matrix. Returns the number of ratings per
+        epoch. The similar movies index (ann_index) is built from qi and
+        has to be rebuilt to reflect the changes.
+        """
+        if not self.biased:
+            raise ValueError('partial_fit supports biased models (SVD) only')
+        with self._lock:
+            state = self._state
+            history = self._history(state)
+            if history.dtype != np.float32:
+                raise ValueError('the model was exported without ratings, export it again to refit it')
+            items = (np.array(sorted(self._touched), dtype=np.int32) if movie_ids is None
+                     else self._item_rows(movie_ids, np.zeros(len(movie_ids)))[0])
+            item_user = history.T.tocsr()[items].tocoo()
+            users, item_rows, ratings = item_user.col, items[item_user.row], item_user.data
+            pu, bu, qi, bi = state.pu.copy(), state.bu.copy(), state.qi.copy(), state.bi.copy()
+            rng = np.random.default_rng(seed)
+            for _ in range(n_epochs):
+                order = rng.permutation(len(ratings))
+                for start in range(0, len(order), batch_size):
+                    batch = order[start:start + batch_size]
+                    u, i = users[batch], item_rows[batch]
+                    pu_u, qi_i = pu[u], qi[i]
+                    err = ratings[batch] - (self.global_mean + bu[u] + bi[i] + np.einsum('ij,ij->i', pu_u, qi_i))
+                    np.add.at(bu, u, lr * (err - reg * bu[u]))
+                    np.add.at(bi, i, lr * (err - reg * bi[i]))
+                    np.add.at(pu, u, lr * (err[:, None] * qi_i - reg * pu_u))
+                    np.add.at(qi, i, lr * (err[:, None] * pu_u - reg * qi_i))
+            self._state = self._make_state(pu, bu, qi, bi, state.user_ids, state.user_index, history, {})
+            if movie_ids is None:
+                self._touched.clear()
+            return len(ratings)
@@ -1,15 +1,9 @@
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
-from PIL import Image
-import os
-import joblib
-from dotenv import load_dotenv
 
-load_dotenv()
-movie_rec_path = os.getenv('MOVIE_REC_PATH')
-
-current_dir = os.path.dirname(__file__)
+import data_access
+import instrumentation
 
 st.header('Data Exploration')
 
@@ -42,29 +36,24 @@ st.markdown('''
 ######################################## loading data, images ########################################
 ######################################################################################################
 
-@st.cache_data
-def load_df(name):
-    # df = pd.read_csv('../../movie_recommendation/data/raw/ml-25m/movies.csv')
-    df=pd.read_parquet(f'data/dataframes/{name}.parquet')
-    # os.getenv('MOVIE_REC_PATH')
-    return df
-df_movies = load_df('movies')
+# all files are loaded once through data_access and shared by all sessions
+df_movies = data_access.load('movies')
 
 with st.expander('See examples of all tables of the MovieLens 25M Dataset'):
     st.markdown("First five rows of the 'movies' table.")
-    st.dataframe(load_df('movies').head(), hide_index=True)
+    st.dataframe(df_movies.head(), hide_index=True)
 
     left_column, right_column = st.columns(2)
     left_column.markdown("First five rows of the 'ratings' table.")
-    left_column.dataframe(load_df('ratings').head(), hide_index=True)
+    left_column.dataframe(data_access.load('ratings').head(), hide_index=True)
     right_column.markdown("First five rows of the 'tags' table.")
-    right_column.dataframe(load_df('tags').head(), hide_index=True)
+    right_column.dataframe(data_access.load('tags').head(), hide_index=True)
     left_column.markdown("First five rows of the 'genome-tags' table.")
-    left_column.dataframe(load_df('genome-tags').head(), hide_index=True)
+    left_column.dataframe(data_access.load('genome-tags').head(), hide_index=True)
     right_column.markdown("First five rows of the 'genome-scores' table.")
-    right_column.dataframe(load_df('genome-scores').head(), hide_index=True)
+    right_column.dataframe(data_access.load('genome-scores').head(), hide_index=True)
     st.markdown("First five rows of the 'links' table, allows to link the ML dataset to IMDb and TMDB data.")
-    st.dataframe(load_df('links').head(), hide_index=True)
+    st.dataframe(data_access.load('links').head(), hide_index=True)
 
 # # hot-one encoding to split genres in separate columns using pandas strin method
 # df_movies = pd.concat([df_movies, df_movies['genres'].str.get_dummies(sep='|')], axis=1)
@@ -75,44 +64,14 @@ with st.expander('See examples of all tables of the MovieLens 25M Dataset'):
 
 # frequency_genres = df_movies.iloc[:,1:].sum()
 
-frequency_genres = joblib.load(f'{current_dir}/../../data/dataframes/frequency_genres.pkl')
-
-# @st.cache_data
-# def load_genre_ratings():
-#     df = pd.read_parquet('../data/dataframes/genre_ratings.parquet.gzip')
-#     return df
-# genre_ratings = load_genre_ratings()
-
-# @st.cache_data
-# def load_user_rating_avg():
-#     df = pd.read_parquet('../data/dataframes/user_rating_avg.parquet.gizp')
-#     return df
-# user_rating_avg = load_user_rating_avg()
-
-user_rating_avg_path = os.path.join(current_dir, "..","..", "data", "dataframes", "user_rating_avg.parquet.gizp")
-user_rating_avg = pd.read_parquet(user_rating_avg_path)
-
-# @st.cache_data
-# def load_user_rating_sum():
-#     df = pd.read_parquet('../data/dataframes/user_rating_sum.parquet.gizp')
-#     return df
-# user_rating_sum = load_user_rating_sum()
-# user_rating_sum = pd.read_parquet('../../data/dataframes/user_rating_sum.parquet.gizp')
-
-user_rating_sum_path = os.path.join(current_dir, "..","..", "data", "dataframes", "user_rating_sum.parquet.gizp")
-user_rating_sum = pd.read_parquet(user_rating_sum_path)
-
-# df_rat = user_rating_avg.merge(right=user_rating_sum, on='userId', how='outer')
-# df_rat.rename(columns={'n_movies':'n_ratings'}, inplace=True)
-
-# genre_ratings = pd.read_parquet('../data/dataframes/genre_ratings.parquet.gzip')
-# user_rating_avg = pd.read_parquet('../data/dataframes/user_rating_avg.parquet.gizp')
-# user_rating_sum = pd.read_parquet('../data/dataframes/user_rating_sum.parquet.gizp')
-
-stat_user_rating_sum = user_rating_sum.describe()
-stat_user_rating_avg = user_rating_avg.describe()
+frequency_genres = data_access.load('frequency_genres')['n_movies']
 
-stat_user_tag_movie = pd.DataFrame({'n_tags': [305356.000000,3.580555,4.247787,0.000000,1.000000,2.000000,4.000000,337.000000]}, index=['count','mean','std','min','25%','50%','75%','max'])
+# statistics of the ratings per user and the tags per user and movie, materialized from the
+# aggregate store (notebooks/aggregates.py) instead of computed from the 25M ratings
+user_rating_describe = data_access.load('user_rating_describe')
+stat_user_rating_sum = user_rating_describe[['n_movies']]
+stat_user_rating_avg = user_rating_describe[['avg_rating']]
+stat_user_tag_movie = data_access.load('user_tag_describe')
 
 
 ### definition of table style / highlight
@@ -133,10 +92,11 @@ styled_stat_user_tag_movie = stat_user_tag_movie.style.apply(higlight_mmm, axis=
 #####################################################################################################
 
 # pie chart Proportion of genres
-fig_pie = go.Figure()
-fig_pie.add_trace(go.Pie(labels=frequency_genres.index, values=frequency_genres, direction='clockwise'))
-fig_pie.update_layout(legend_title = 'Genres', title='Proportions of genres', title_x=0.45, title_y=0.95)
-fig_pie.update_layout(autosize=False, width=600, height=600)
+with instrumentation.timed('figure', 'genre_pie'):
+    fig_pie = go.Figure()
+    fig_pie.add_trace(go.Pie(labels=frequency_genres.index, values=frequency_genres, direction='clockwise'))
+    fig_pie.update_layout(legend_title = 'Genres', title='Proportions of genres', title_x=0.45, title_y=0.95)
+    fig_pie.update_layout(autosize=False, width=600, height=600)
 
 # # build and cache boxplot of rating distribution per genre
 # @st.cache_data
@@ -172,13 +132,14 @@ st.subheader('Statistics and data visualization')
 # checkbox for displaying plots
 with st.expander('See genre analysis'):
     st.markdown('#### Genre distribution and average rating per genre')
-    st.plotly_chart(fig_pie)
+    with instrumentation.timed('render', 'genre_pie'):
+        st.plotly_chart(fig_pie)
     st.write('''
              We see an imbalanced distribution of genres (a single movie can be tied to more than one genre). 
              Out of all 20 genres (including no_genre_listed), the top five account for 
              about 59% of all observations, while the least frequent five genres make up for about 4.3% only.
              ''' )
-    st.image(Image.open(os.path.join(os.path.dirname(__file__), "..", "images", "distribution_movie_rating_genre.png")))
+    st.image(data_access.load('images/distribution_movie_rating_genre.png'))
     st.write('''
              The boxplot shows average user ratings clustered by genre. Generally speaking, the medians and interquartile ranges (IQR) 
              are quite similar for most genres, the average rating is close to 3 stars for the majority. We see the trend, that smaller 
@@ -200,9 +161,7 @@ with st.expander('See rating analysis'):
     right_column.table(styled_stat_user_rating_avg)
 
     st.write('In the following scatter plot each point represents a user. For better readability one user with about 32.000 ratings was cut out by limiting the x-axis.')
-    img_path = os.path.join(current_dir, "..", "images", "average_rating_vs_number of ratings.png")
-    # st.image('../images/average_rating_vs_number of ratings.png')
-    st.image(Image.open(os.path.join(os.path.dirname(__file__), "..", "images", "average_rating_vs_number_of_ratings.png")))
+    st.image(data_access.load('images/average_rating_vs_number_of_ratings.png'))
 
 with st.expander('See tag analysis'):
     st.markdown('#### Tagging behaviour')
@@ -213,8 +172,64 @@ with st.expander('See tag analysis'):
     left_column.table(styled_stat_user_tag_movie)
 
     st.write('In the following scatter plot each point represents a user. Users who did not use any tags are higlighted in pink, the rugplot underlines the user concentration at zero tags.')
-    # st.image('../data/visualization/rug_number_tag_vs_number_ratings.png')
-    st.image(Image.open(os.path.join(os.path.dirname(__file__), "..", "images", "rug_number_tag_vs_number_ratings.png")))
+    st.image(data_access.load('images/rug_number_tag_vs_number_ratings.png'))
+
+###################################################################################################
+##################################### interactive exploration #####################################
+###################################################################################################
+
+st.subheader('Interactive exploration')
+
+if not data_access.exists('ratings_by_year'):
+    st.info('No partitioned ratings found. Run python notebooks/exploration_data.py to create '
+            'data/dataframes/ratings_by_year and data/dataframes/movies_dim.parquet.')
+else:
+    import exploration_queries
+
+    first_year, last_year = exploration_queries.years(data_access.load('ratings_by_year'))
+    with st.sidebar.container(border=True):
+        st.markdown('### Exploration filters')
+        # the genre names of the movies the filter is matched against, not the column names of the snapshots
+        selected_genres = st.multiselect('**Genres:**', exploration_queries.genre_names(data_access.load('movies_dim')),
+                                         placeholder='all genres')
+        # a slider needs two different bounds, the ratings of a small build can be from a single year
+        year_range = (first_year, last_year)
+        if first_year < last_year:
+            year_range = st.slider('**Years of the ratings:**', min_value=first_year, max_value=last_year,
+                                   value=year_range)
+        min_ratings = st.number_input('**Minimum number of ratings per movie:**', min_value=1, value=1, step=10)
+
+    # aggregated on the fly from the ratings of the selected partitions, cached per filter combination
+    explored = data_access.explore(selected_genres, year_range, min_ratings)
+    totals = explored['totals'].iloc[0]
+    st.markdown(f"**{totals['n_ratings']:,}** ratings of **{totals['n_movies']:,}** movies match the filters "
+                "of the sidebar.")
+
+    with instrumentation.timed('figure', 'explore_charts'):
+        fig_hist = go.Figure(go.Bar(x=explored['rating_histogram']['rating'], y=explored['rating_histogram']['n_ratings']))
+        fig_hist.update_layout(title='Distribution of the ratings', xaxis_title='rating', yaxis_title='number of ratings')
+
+        per_year = explored['ratings_per_year']
+        fig_year = go.Figure(go.Bar(x=per_year['year'], y=per_year['n_ratings'], name='number of ratings'))
+        fig_year.add_trace(go.Scatter(x=per_year['year'], y=per_year['mean_rating'], name='average rating', yaxis='y2'))
+        fig_year.update_layout(title='Ratings per year', yaxis_title='number of ratings',
+                               yaxis2=dict(title='average rating', overlaying='y', side='right', range=[0.5, 5]),
+                               legend=dict(orientation='h', y=-0.15))
+
+        by_genre = explored['movie_ratings_by_genre']
+        fig_genre = go.Figure(go.Box(x=by_genre['genre'], q1=by_genre['q1'], median=by_genre['median'],
+                                     q3=by_genre['q3'], lowerfence=by_genre['lowerfence'],
+                                     upperfence=by_genre['upperfence'], mean=by_genre['mean']))
+        fig_genre.update_layout(title='Average rating per movie by genre', yaxis_title='average rating',
+                                xaxis_tickangle=-75)
+
+    with instrumentation.timed('render', 'explore_charts'):
+        left_column, right_column = st.columns(2)
+        left_column.plotly_chart(fig_hist)
+        right_column.plotly_chart(fig_year)
+        st.plotly_chart(fig_genre)
+    st.markdown('Most rated movies:')
+    st.dataframe(explored['top_movies'].round({'mean_rating': 2}), hide_index=True)
 
 ###################################################################################################
 ############################################ learnings ############################################
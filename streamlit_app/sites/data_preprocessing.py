@@ -14,7 +14,8 @@ After selecting and merging the dataframes 'genome-scores', 'genome-tags', 'movi
          
 ##### 2. Word2Vec  
          
-- Trained a Word2Vec model on the aggregated tags to convert them into dense vector representations.
+- Trained a Word2Vec model on the aggregated tags (one tag document per movie) to convert them into dense vector representations.
+- The mean embedding of each movie's tags is stored once per movie as a movie x 100 table and joined onto the ratings by movieId.
 - This transformation helped capture semantic relationships between tags and decreased the size of the dataset.
 
 ##### 3. Cleaning up the dataset
@@ -31,4 +32,10 @@ After selecting and merging the dataframes 'genome-scores', 'genome-tags', 'movi
 - Applying the sampling function to each 'movieId' group resulted in a dataset with 5,273,559 entries.
 
 The final dataset, approximately 301.8 MB in memory usage, was saved to CSV and Parquet and was then ready for further analysis and modeling.
+
+##### 5. Storage
+
+- Instead of repeating the 40 tags and relevances of a movie on each of its ratings, the final dataset is stored as two Parquet tables:
+  a slim ratings table (int32 userId, int32 movieId, float32 rating, about 63 MB in memory) and a movie features table with one row per movie (title, genres, top tags and relevances).
+- The models join the movie features onto the ratings by movieId only where they need them.
 """)
@@ -1,11 +1,11 @@
 import streamlit as st
-from PIL import Image
-import os
+
+import data_access
 
 
 
 # Find and display image
-st.image(Image.open(os.path.join(os.path.dirname(__file__), "..", "images", "movie_title_image.jpg")), caption=" ")#, width=650)
+st.image(data_access.load('images/movie_title_image.jpg'), caption=" ")#, width=650)
 st.title("Movie Recommender System")
 
 st.markdown("""
@@ -1,6 +1,6 @@
 import streamlit as st
-from PIL import Image
-import os
+
+import data_access
 
 st.header('Advanced Models')
 st.write("""
@@ -21,7 +21,7 @@ st.write("""
 """)
 
 with st.expander("Model Architecture NCF"):
-    st.image(Image.open(os.path.join(os.path.dirname(__file__), "..", "images", "ncf_img.png")), caption="NCF Model Architecture", width=600)
+    st.image(data_access.load('images/ncf_img.png'), caption="NCF Model Architecture", width=600)
 
 st.write("""
     - **Hyperparameter Tuning**:
@@ -31,7 +31,7 @@ st.write("""
 """)
    
 # Find and display image
-st.image(Image.open(os.path.join(os.path.dirname(__file__), "..", "images", "img3.jpg")), caption=" ", width=550)
+st.image(data_access.load('images/img3.jpg'), caption=" ", width=550)
 
 
 box =  st.container(border=True)
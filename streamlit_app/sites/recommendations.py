@@ -0,0 +1,90 @@
+import streamlit as st
+import pandas as pd
+
+import data_access
+import instrumentation
+
+st.header('Get recommendations')
+
+st.markdown('''
+            Top-N movie recommendations of the tuned SVD model. All movies are scored for the selected user
+            in one matrix multiplication of the learned user and item factors, movies the user already rated are excluded.
+            ''')
+
+if not data_access.exists('surp_svd_factors'):
+    st.info('No exported model found. Run the export cell at the end of notebooks/model_surprise_cross_validation.ipynb '
+            'to create data/models/surp_svd_factors.npz.')
+    st.stop()
+
+recommender = data_access.load('surp_svd_factors')
+
+with st.sidebar.container(border=True):
+    st.markdown('### Recommendation options')
+    user_id = st.number_input('**Enter userId:**', min_value=int(recommender.user_ids.min()),
+                              max_value=int(recommender.user_ids.max()), value=int(recommender.user_ids[0]))
+    n = st.slider('**Number of recommendations:**', min_value=5, max_value=50, value=10, step=5)
+
+if recommender.user_index(user_id) is None:
+    st.warning(f'User {user_id} is not part of the training data.')
+    st.stop()
+
+with instrumentation.timed('compute', 'recommend'):
+    items, scores = recommender.recommend(recommender.user_index(user_id), n)
+df_rec = pd.DataFrame({'movieId': recommender.item_ids[items[0]],
+                       'predicted rating': scores[0].clip(0.5, 5.0).round(2)})
+if recommender.titles is not None:
+    df_rec.insert(1, 'title', recommender.titles[items[0]])
+df_rec.index = df_rec.index + 1
+
+st.subheader(f'Top {n} recommendations for user {user_id}')
+st.dataframe(df_rec, use_container_width=True)
+st.caption(f'User {user_id} rated {len(recommender.rated(recommender.user_index(user_id))[0])} movies in the training data.')
+
+######################################## similar movies ########################################
+
+if data_access.exists('surp_svd_item_index'):
+    item_index = data_access.load('surp_svd_item_index')
+
+    st.subheader('Similar movies')
+    st.markdown('Movies with the most similar SVD item factors (cosine similarity), looked up in an approximate nearest-neighbour index.')
+    movie_id = st.number_input('**Enter movieId:**', min_value=int(recommender.item_ids.min()),
+                               max_value=int(recommender.item_ids.max()), value=int(df_rec.movieId.iloc[0]))
+    if movie_id in item_index:
+        with instrumentation.timed('compute', 'similar_movies'):
+            similar_ids, similarities = item_index.similar(movie_id, n=10)
+        df_similar = pd.DataFrame({'movieId': similar_ids, 'similarity': similarities.round(3)})
+        if recommender.titles is not None:
+            titles = dict(zip(recommender.item_ids.tolist(), recommender.titles))
+            df_similar.insert(1, 'title', [titles.get(i, '') for i in similar_ids.tolist()])
+        df_similar.index = df_similar.index + 1
+        st.dataframe(df_similar, use_container_width=True)
+    else:
+        st.warning(f'Movie {movie_id} is not part of the training data.')
+
+######################################## rate movies yourself ########################################
+
+st.subheader('Rate movies yourself')
+st.markdown('''
+            Rate a few of the most rated movies and get recommendations without retraining: your user factors are
+            folded into the model by solving a small regularized least-squares problem against the learned item factors.
+            ''')
+
+popular = recommender.popular_items(200)
+labels = recommender.titles[popular] if recommender.titles is not None else recommender.item_ids[popular].astype(str)
+movie_of_label = dict(zip(labels.tolist(), recommender.item_ids[popular].tolist()))
+selected = st.multiselect('**Select movies to rate:**', list(movie_of_label), max_selections=10)
+
+if selected:
+    columns = st.columns(2)
+    visitor_ratings = [columns[i % 2].slider(label, min_value=0.5, max_value=5.0, value=3.5, step=0.5, key=f'rate_{label}')
+                       for i, label in enumerate(selected)]
+    with instrumentation.timed('compute', 'recommend_for_ratings') as record:
+        visitor_recs = recommender.recommend_for_ratings([movie_of_label[label] for label in selected], visitor_ratings, n)
+    df_visitor = pd.DataFrame(visitor_recs, columns=['movieId', 'predicted rating'])
+    df_visitor['predicted rating'] = df_visitor['predicted rating'].clip(0.5, 5.0).round(2)
+    if recommender.titles is not None:
+        titles = dict(zip(recommender.item_ids.tolist(), recommender.titles))
+        df_visitor.insert(1, 'title', [titles.get(i, '') for i in df_visitor['movieId'].tolist()])
+    df_visitor.index = df_visitor.index + 1
+    st.dataframe(df_visitor, use_container_width=True)
+    st.caption(f"Top {n} recommendations for your {len(selected)} ratings, computed in {record['seconds'] * 1000:.1f} ms.")
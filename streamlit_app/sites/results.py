@@ -1,11 +1,21 @@
 import streamlit as st
-import joblib
 import pandas as pd
-import plotly.graph_objects as go
-import os
+
+import data_access
 
 st.header('Results & Conclusion')
 
+# MAE of the NCF models (notebooks/ML_find_hypterparameters.ipynb and ML_all_features.ipynb)
+ncf_mae = {'NCF DL': 0.6744, 'NCF (all features)': 0.6681}
+
+# MAE of the tuned classical models (precomputed cv summary, see notebooks/model_results.py)
+cv_mae = data_access.load('surp_cv_summary').query("measure == 'test_mae'").set_index('model')['mean'].round(4)
+
+def mae_table(models):
+    '''One-row MAE table of classical and NCF models in the given order.'''
+    mae = {**ncf_mae, **cv_mae.to_dict()}
+    return pd.DataFrame({'Metric': ['MAE'], **{model: [mae[model]] for model in models}}).set_index('Metric')
+
 # counter for automated chart number updates
 n_chart = 0
 
@@ -30,23 +40,9 @@ st.markdown('''
 Our initial evaluation **without parameter tuning** showed that the SVD model performed best, followed closely by several KNN-based models. The NormalPredictor served as a benchmark and had significantly higher errors. The results indicated that matrix factorization and KNN models are promising for movie recommendations, even without optimization.
 ''')
 
-# Data for the table
-model_data = {
-    "Metric": ["MAE"],
-    "knnBasic": [0.7177],
-    "knnMeans": [0.6538],
-    "knnBaseline": [0.6527],
-    "knnZScore": [0.6531],
-    "SVD": [0.6515],
-    "NMF": [0.6838],
-    "NormalPredictor": [1.1537],
-    "SlopeOne": [0.6619],
-    "BaselineOnly": [0.6675],
-    "CoClustering": [0.7125]
-}
-
-# Creating DataFrame and setting 'Metric' as the index
-df_model = pd.DataFrame(model_data).set_index('Metric')
+# Data for the table (precomputed MAE of the default models)
+default_mae = data_access.load('surp_default_metrics').query("measure == 'mae'").set_index('model')['value']
+df_model = default_mae.round(4).to_frame('MAE').T.rename_axis(index='Metric', columns=None)
 
 # Function to highlight the MAE row with dark green
 def highlight_mae(row):
@@ -74,19 +70,7 @@ The following table also includes the results of the Neural Collaborative Filter
 ''')
 
 # Data for the table
-tuning_data = {
-    "Metric": ["MAE"],
-    "NCF DL": [0.6744],
-    "knnBasic": [0.6674],
-    "knnMeans": [0.6340],
-    "knnBaseline": [0.6324],
-    "knnZScore": [0.6330],
-    "SVD": [0.6327],
-    "NMF": [0.6679],
-}
-
-# Creating DataFrame and setting 'Metric' as the index
-df_tuning = pd.DataFrame(tuning_data).set_index('Metric')
+df_tuning = mae_table(['NCF DL', 'knnBasic', 'knnMeans', 'knnBaseline', 'knnZScore', 'SVD', 'NMF'])
 
 # Function to highlight the MAE row with dark green
 def highlight_tuning(row):
@@ -110,17 +94,8 @@ st.markdown('''
 The following table shows the results of the enhanced NCF model and the **top three performing models** as a end result.   
 ''')
 
-# Data for the table
-ncf_data = {
-    "Metric": ["MAE"],
-    "knnBaseline": [0.6324],
-    "SVD": [0.6327],
-    "knnZScore": [0.6330],
-    "NCF (all features)": [0.6681],
-}
-
-# Creating DataFrame and setting 'Metric' as the index
-df_ncf = pd.DataFrame(ncf_data).set_index('Metric')
+# Data for the table: top three classical models and the enhanced NCF model
+df_ncf = mae_table(list(cv_mae.nsmallest(3).index) + ['NCF (all features)'])
 
 # Function to highlight the MAE row with dark green
 def highlight_ncf(row):
@@ -1,5 +1,7 @@
 import streamlit as st
 
+import instrumentation
+
 st.set_page_config(page_title="Movie Recommender System", page_icon=":film_frames:")
 
 intro_page = st.Page("sites/intro.py", title="Introduction") #, icon='🎥')
@@ -8,6 +10,7 @@ data_prep_page = st.Page("sites/data_preprocessing.py", title="Data Preprocessin
 models_clas_page = st.Page("sites/models_classical.py", title="Models - classical") #, icon='🧮')
 models_adv_page = st.Page("sites/models_advanced.py", title="Models - advanced") #, icon='🧮')
 results_page = st.Page("sites/results.py", title="Results & Conclusion") #, icon='🥇')
+recommendations_page = st.Page("sites/recommendations.py", title="Get recommendations")
 conclusion_page = st.Page("sites/conclusion.py", title="Conclusion & Outlook") #, icon='📑')
 about_page = st.Page("sites/about.py", title="About")
 
@@ -19,6 +22,7 @@ pg = st.navigation([intro_page,
                     models_clas_page,
                     models_adv_page,
                     results_page,
+                    recommendations_page,
                     # conclusion_page,
                     about_page])
 
@@ -30,5 +34,10 @@ pg = st.navigation([intro_page,
 #                     "": [conclusion_page],
 #                     "_____": [about_page]})
 
-
-pg.run()
+# time the page run, then export the metrics and show the debug panel (see instrumentation.py)
+instrumentation.start_run(pg.title)
+try:
+    with instrumentation.timed('page', pg.title):
+        pg.run()
+finally:
+    instrumentation.finish_run()
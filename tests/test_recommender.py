@@ -0,0 +1,36 @@
+"""Folding in a trained user reproduces the scores of the trained model."""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path[:0] = [os.path.join(REPO_DIR, 'benchmarks'), os.path.join(REPO_DIR, 'streamlit_app')]
+
+import recommender  # noqa: E402
+import synthetic  # noqa: E402
+
+surprise = pytest.importorskip('surprise')
+
+
+@pytest.fixture(scope='module')
+def trained():
+    ratings = synthetic.generate('100k', seed=3)['ratings'][['userId', 'movieId', 'rating']]
+    trainset = surprise.Dataset.load_from_df(ratings, surprise.Reader(rating_scale=(0.5, 5))).build_full_trainset()
+    algo = surprise.SVD(random_state=0).fit(trainset)
+    return algo, trainset, recommender.FactorRecommender.from_surprise(algo, trainset)
+
+
+def test_fold_in_reproduces_trained_scores(trained):
+    algo, trainset, model = trained
+    errors = []
+    for user in range(0, len(model.user_ids), 13):
+        user_ratings = trainset.ur[trainset.to_inner_uid(model.user_ids[user])]
+        movie_ids = [trainset.to_raw_iid(item) for item, _ in user_ratings]
+        pu, bu, _ = model.fold_in(movie_ids, [rating for _, rating in user_ratings], reg=algo.reg_pu)
+        trained_scores = model.pu[user] @ model.qi.T + model.bu[user]
+        errors.append(np.abs(pu @ model.qi.T + bu - trained_scores).mean())
+    # SGD does not reach the exact optimum, a penalty that ignores the number of ratings is off by about 0.6
+    assert np.mean(errors) < 0.25
+    assert np.max(errors) < 0.4